@@ -8,6 +8,8 @@ import numpy as np
 from .deflectors import *
 from .lenses import *
 from .microscope import Microscope
+from .microscope_client import batch_call
+from .snapshot import StateSnapshot
 from .stage import *
 from .states import *
 from instamatic import config
@@ -59,9 +61,22 @@ def initialize(tem_name: str = default_tem, cam_name: str = default_cam, stream:
         print(f'Camera    : {cam_name}{cam_tag}')
 
         cam = Camera(cam_name, as_stream=stream, use_server=use_cam_server)
+
+        if not use_cam_server and hasattr(cam, 'attach_microscope'):
+            cam.attach_microscope(tem)  # synthetic camera renders the state of the microscope
     else:
         cam = None
 
+    if config.settings.record_file:
+        from .recording import CallLog
+        from .recording import RecordingProxy
+
+        print(f'Recording : {config.settings.record_file}')
+        log = CallLog(config.settings.record_file)
+        tem = RecordingProxy(tem, 'tem', log)
+        if cam is not None:
+            cam = RecordingProxy(cam, 'cam', log)
+
     global _ctrl
     ctrl = _ctrl = TEMController(tem=tem, cam=cam)
 
@@ -114,6 +129,13 @@ class TEMController:
         self.screen = Screen(tem)
         self.mode = Mode(tem)
 
+        # Cached microscope state for the image headers, invalidated by the objects above
+        self.snapshot = StateSnapshot(tem)
+        for obj in (self.gunshift, self.guntilt, self.beamshift, self.beamtilt,
+                    self.imageshift1, self.imageshift2, self.diffshift, self.stage,
+                    self.magnification, self.brightness, self.difffocus, self.mode):
+            obj._snapshot = self.snapshot
+
         self.autoblank = False
         self._saved_alignments = config.get_alignments()
 
@@ -156,8 +178,9 @@ class TEMController:
     @spotsize.setter
     def spotsize(self, value: int):
         self.tem.setSpotSize(value)
+        self.snapshot.invalidate('SpotSize')
 
-    def acquire_at_items(self, *args, **kwargs) -> None:
+    def acquire_at_items(self, *args, pipeline: bool = False, **kwargs) -> list:
         """Class to automated acquisition at many stage locations. The
         acquisition functions must be callable (or a list of callables) that
         accept `ctrl` as an argument. In case a list of callables is given,
@@ -178,15 +201,34 @@ class TEMController:
             This function is run after the last acquisition item has run.
         backlash: bool
         Move the stage with backlash correction.
+        route: str
+            Reorder the items to minimize the stage travel time ('tsp',
+            'nearest', 'serpentine'), see `instamatic.stage_route`.
+        pipeline: bool
+            Start the stage movement to the next item as soon as the acquisition
+            has finished, and run `process` on a worker thread in the meantime.
+            Internally, this runs instamatic.acquire_at_items.PipelinedAcquireAtItems.
+        process: callable
+            Function called as `process(i, item, result)` with the values returned
+            by the acquisition functions (pipeline only).
+
+        Returns
+        -------
+        results: list
+            List of `ItemResult` in the order of the items (pipeline only).
         """
         from instamatic.acquire_at_items import AcquireAtItems
+        from instamatic.acquire_at_items import PipelinedAcquireAtItems
 
         ctrl = self
 
-        aai = AcquireAtItems(ctrl, *args, **kwargs)
-        aai.start()
+        if pipeline:
+            aai = PipelinedAcquireAtItems(ctrl, *args, **kwargs)
+        else:
+            aai = AcquireAtItems(ctrl, *args, **kwargs)
+        return aai.start()
 
-    def run_script_at_items(self, nav_items: list, script: str, backlash: bool = True) -> None:
+    def run_script_at_items(self, nav_items: list, script: str, backlash: bool = True, pipeline: bool = False) -> list:
         """"Run the given script at all coordinates defined by the nav_items.
 
         Parameters
@@ -200,9 +242,14 @@ class TEMController:
                     `acquire`
                     `pre_acquire`
                     `post_acquire`
+                and optionally `process`, which is run on a worker thread with the
+                results of `acquire` (implies `pipeline`)
 
         backlash: bool
             Toggle to move to each position with backlash correction
+        pipeline: bool
+            Overlap the stage movement to the next item with the processing of
+            the previous one, see `acquire_at_items`
         """
         from instamatic.io import find_script
         script = find_script(script)
@@ -218,13 +265,21 @@ class TEMController:
 
         pre_acquire = getattr(acquire, 'pre_acquire', None)
         post_acquire = getattr(acquire, 'post_acquire', None)
+        process = getattr(acquire, 'process', None)
         acquire = getattr(acquire, 'acquire', None)
 
-        self.acquire_at_items(nav_items,
-                              acquire=acquire,
-                              pre_acquire=pre_acquire,
-                              post_acquire=post_acquire,
-                              backlash=backlash)
+        kwargs = {}
+        if process:
+            pipeline = True
+            kwargs['process'] = process
+
+        return self.acquire_at_items(nav_items,
+                                     acquire=acquire,
+                                     pre_acquire=pre_acquire,
+                                     post_acquire=post_acquire,
+                                     backlash=backlash,
+                                     pipeline=pipeline,
+                                     **kwargs)
 
     def run_script(self, script: str, verbose: bool = True) -> None:
         """Run a custom python script with access to the `ctrl` object.
@@ -281,7 +336,7 @@ class TEMController:
         return stagematrix
 
     def align_to(self,
-                 ref_img: 'np.array',
+                 ref_img: 'np.array | ImageRegistration',
                  apply: bool = True,
                  verbose: bool = False,
                  ) -> list:
@@ -291,8 +346,10 @@ class TEMController:
 
         Parameters
         ----------
-        ref_img : np.array
-            Reference image that the microscope will be aligned to
+        ref_img : np.array or ImageRegistration
+            Reference image that the microscope will be aligned to, pass an
+            `ImageRegistration` to reuse its reference spectrum when aligning
+            repeatedly to the same image
         apply : bool
             Toggle to translate the stage to center the image
         verbose : bool
@@ -303,7 +360,12 @@ class TEMController:
         stage_shift : np.array[2]
             The stage shift vector determined from cross correlation
         """
-        from skimage.registration import phase_cross_correlation
+        from instamatic.imreg import ImageRegistration
+
+        if isinstance(ref_img, ImageRegistration):
+            reg = ref_img
+        else:
+            reg = ImageRegistration(ref_img, upsample_factor=10)
 
         current_x, current_y = self.stage.xy
 
@@ -314,7 +376,7 @@ class TEMController:
 
         img = self.get_rotated_image()
 
-        pixel_shift, error, phasediff = phase_cross_correlation(ref_img, img, upsample_factor=10)
+        pixel_shift, error, phasediff = reg.register(img)
 
         stage_shift = np.dot(pixel_shift, stagematrix)
         stage_shift[0] = -stage_shift[0]  # match TEM Coordinate system
@@ -445,68 +507,72 @@ class TEMController:
         """
 
         # Each of these costs about 40-60 ms per call on a JEOL 2100, stage is 265 ms per call
-        funcs = {
-            'FunctionMode': self.tem.getFunctionMode,
-            'GunShift': self.gunshift.get,
-            'GunTilt': self.guntilt.get,
-            'BeamShift': self.beamshift.get,
-            'BeamTilt': self.beamtilt.get,
-            'ImageShift1': self.imageshift1.get,
-            'ImageShift2': self.imageshift2.get,
-            'DiffShift': self.diffshift.get,
-            'StagePosition': self.stage.get,
-            'Magnification': self.magnification.get,
-            'DiffFocus': self.difffocus.get,
-            'Brightness': self.brightness.get,
-            'SpotSize': self.tem.getSpotSize,
-        }
-
-        dct = {}
-
-        if 'all' in keys or not keys:
-            keys = funcs.keys()
-
-        for key in keys:
-            try:
-                dct[key] = funcs[key]()
-            except ValueError:
-                # print(f"No such key: `{key}`")
-                pass
-
-        return dct
+        # All values are read out concurrently (or in a single batch via the TEM server)
+        return self.snapshot.get(*keys, refresh=True)
 
     def from_dict(self, dct: dict):
         """Restore microscope parameters from dict."""
 
         funcs = {
-            # 'FunctionMode': self.tem.setFunctionMode,
-            'GunShift': self.gunshift.set,
-            'GunTilt': self.guntilt.set,
-            'BeamShift': self.beamshift.set,
-            'BeamTilt': self.beamtilt.set,
-            'ImageShift1': self.imageshift1.set,
-            'ImageShift2': self.imageshift2.set,
-            'DiffShift': self.diffshift.set,
-            'StagePosition': self.stage.set,
-            'Magnification': self.magnification.set,
-            'DiffFocus': self.difffocus.set,
-            'Brightness': self.brightness.set,
-            'SpotSize': self.tem.setSpotSize,
+            # 'FunctionMode': 'setFunctionMode',
+            'GunShift': 'setGunShift',
+            'GunTilt': 'setGunTilt',
+            'BeamShift': 'setBeamShift',
+            'BeamTilt': 'setBeamTilt',
+            'ImageShift1': 'setImageShift1',
+            'ImageShift2': 'setImageShift2',
+            'DiffShift': 'setDiffShift',
+            'StagePosition': 'setStagePosition',
+            'Magnification': 'setMagnification',
+            'DiffFocus': 'setDiffFocus',
+            'Brightness': 'setBrightness',
+            'SpotSize': 'setSpotSize',
         }
 
+        # The function mode must be set first, all values are sent as a single batch
         mode = dct['FunctionMode']
-        self.tem.setFunctionMode(mode)
+        calls = [('setFunctionMode', (mode,))]
 
         for k, v in dct.items():
             if k in funcs:
-                func = funcs[k]
+                func_name = funcs[k]
             else:
                 continue
 
-            try:
-                func(*v)
-            except TypeError:
-                func(v)
+            args = tuple(v) if isinstance(v, (list, tuple)) else (v,)
+            calls.append((func_name, args))
+
+        try:
+            self.batch(calls)
+        finally:
+            self.snapshot.invalidate()
+
+    def batch(self, calls: list, return_exceptions: bool = False) -> list:
+        """Evaluate a list of TEM calls in one go. If the TEM is accessed
+        through the TEM server, this takes a single round trip.
+
+        Parameters
+        ----------
+        calls: list
+            List of `(func_name, args)` or `(func_name, args, kwargs)`, where
+            `func_name` is the name of a method on `ctrl.tem`
+        return_exceptions: bool
+            Return the exception instance for a failed call instead of raising
+
+        Returns
+        -------
+        results: list
+            List of the return values in the same order as `calls`
+
+        Usage:
+            x, mode = ctrl.batch([('getStagePosition', ()), ('getFunctionMode', ())])
+        """
+        try:
+            batch = self.tem.batch
+        except AttributeError:
+            return batch_call(self.tem, calls, return_exceptions=return_exceptions)
+        else:
+            return batch(calls, return_exceptions=return_exceptions)
 
     def get_raw_image(self, exposure: float = None, binsize: int = None) -> np.ndarray:
         """Simplified function equivalent to `get_image` that only returns the
@@ -626,8 +692,10 @@ class TEMController:
 
         if not header_keys:
             h = {}
+        elif isinstance(header_keys, str):
+            h = self.snapshot.get(header_keys)
         else:
-            h = self.to_dict(header_keys)
+            h = self.snapshot.get(*header_keys)
 
         if self.autoblank:
             self.beam.unblank()
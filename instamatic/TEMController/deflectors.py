@@ -14,6 +14,7 @@ class Deflector:
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._snapshot = None
         self.key = 'def'
 
     def __repr__(self):
@@ -26,6 +27,7 @@ class Deflector:
 
     def set(self, x: int, y: int):
         self._setter(x, y)
+        self._invalidate()
 
     def get(self) -> Tuple[int, int]:
         return DeflectorTuple(*self._getter())
@@ -59,6 +61,12 @@ class Deflector:
 
     def neutral(self):
         self._tem.setNeutral(self.key)
+        self._invalidate()
+
+    def _invalidate(self) -> None:
+        """Invalidate the value in the cached microscope state."""
+        if self._snapshot:
+            self._snapshot.invalidate(self.name)
 
 
 class GunShift(Deflector):
@@ -7,6 +7,7 @@ class Lens:
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._snapshot = None
         self.key = 'lens'
 
     def __repr__(self):
@@ -22,10 +23,16 @@ class Lens:
 
     def set(self, value: int):
         self._setter(value)
+        self._invalidate()
 
     def get(self) -> int:
         return self._getter()
 
+    def _invalidate(self) -> None:
+        """Invalidate the value in the cached microscope state."""
+        if self._snapshot:
+            self._snapshot.invalidate(self.name)
+
     @property
     def value(self) -> int:
         return self.get()
@@ -51,6 +58,7 @@ class DiffFocus(Lens):
         Turning it off results in a 2x speed-up in the call, but it will silently fail if the TEM is in the wrong mode.
         """
         self._setter(value, confirm_mode=confirm_mode)
+        self._invalidate()
 
     def defocus(self, offset):
         """Apply a defocus to the IL1 lens, use `.refocus` to restore the
@@ -124,6 +132,7 @@ class Magnification(Lens):
     @index.setter
     def index(self, index: int):
         self._indexsetter(index)
+        self._invalidate()
 
     def increase(self) -> None:
         try:
@@ -15,7 +15,9 @@ def get_tem(interface: str):
         if not admin.is_admin():
             raise PermissionError('Access to the TEM interface requires admin rights.')
 
-    if simulate or interface == 'simulate':
+    if interface == 'replay':
+        from .recording import ReplayMicroscope as cls
+    elif simulate or interface == 'simulate':
         from .simu_microscope import SimuMicroscope as cls
     elif interface == 'jeol':
         from .jeol_microscope import JeolMicroscope as cls
@@ -33,7 +35,7 @@ def Microscope(name: str = None, use_server: bool = False):
     """Generic class to load microscope interface class.
 
     name: str
-        Specify which microscope to use, must be one of `jeol`, `fei_simu`, `simulate`
+        Specify which microscope to use, must be one of `jeol`, `fei_simu`, `simulate`, `replay`
     use_server: bool
         Connect to microscope server running on the host/port defined in the config file
 
@@ -11,13 +11,14 @@ from functools import wraps
 from instamatic import config
 from instamatic.exceptions import exception_list
 from instamatic.exceptions import TEMCommunicationError
+from instamatic.server.framing import recv_message
+from instamatic.server.framing import send_message
 from instamatic.server.serializer import dumper
 from instamatic.server.serializer import loader
 
 
 HOST = config.settings.tem_server_host
 PORT = config.settings.tem_server_port
-BUFSIZE = 1024
 
 
 class ServerError(Exception):
@@ -29,6 +30,31 @@ def kill_server(p):
     sp.call(['taskkill', '/F', '/T', '/PID', str(p.pid)])
 
 
+def unpack_call(call) -> tuple:
+    """Unpack a call given as `(func_name, args)` or `(func_name, args,
+    kwargs)`, returns `(func_name, args, kwargs)`."""
+    func_name, args, *kwargs = call
+    kwargs = kwargs[0] if kwargs else {}
+    return func_name, tuple(args), dict(kwargs)
+
+
+def batch_call(tem, calls: list, return_exceptions: bool = False) -> list:
+    """Evaluate `calls` one after another directly on the microscope object
+    `tem`. Counterpart of `MicroscopeClient.batch` for microscope objects
+    that are not behind a server."""
+    results = []
+    for call in calls:
+        func_name, args, kwargs = unpack_call(call)
+        try:
+            ret = getattr(tem, func_name)(*args, **kwargs)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            ret = e
+        results.append(ret)
+    return results
+
+
 def start_server_in_subprocess():
     cmd = 'instamatic.temserver.exe'
     p = sp.Popen(cmd, stdout=sp.DEVNULL)
@@ -48,7 +74,6 @@ class MicroscopeClient:
         super().__init__()
 
         self.name = name
-        self._bufsize = BUFSIZE
 
         try:
             self.connect()
@@ -96,13 +121,19 @@ class MicroscopeClient:
     def _eval_dct(self, dct):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'."""
 
-        self.s.send(dumper(dct))
+        send_message(self.s, dct, dumper)
+
+        response, _ = recv_message(self.s, loader)
 
-        response = self.s.recv(self._bufsize)
+        if response is None:
+            raise TEMCommunicationError('Connection to the TEM server was closed')
 
-        if response:
-            status, data = loader(response)
+        status, data = response
 
+        return self._parse_response(status, data)
+
+    def _parse_response(self, status: int, data):
+        """Return `data` or raise the exception sent by the server."""
         if status == 200:
             return data
 
@@ -113,6 +144,42 @@ class MicroscopeClient:
         else:
             raise ConnectionError(f'Unknown status code: {status}')
 
+    def batch(self, calls: list, return_exceptions: bool = False) -> list:
+        """Evaluate a list of calls in a single round trip to the server.
+
+        The calls are executed one after another on the server in a
+        single slot of the command queue, so they are not interleaved
+        with calls from other connections.
+
+        calls: list
+            List of `(func_name, args)` or `(func_name, args, kwargs)`
+        return_exceptions: bool
+            If True, a failed call returns the exception instance in the
+            list of results, otherwise the first exception is raised
+            (the remaining calls are still evaluated by the server).
+
+        Returns a list of the return values in the same order as `calls`.
+        """
+        batch = []
+        for call in calls:
+            func_name, args, kwargs = unpack_call(call)
+            batch.append({'func_name': func_name,
+                          'args': args,
+                          'kwargs': kwargs})
+
+        responses = self._eval_dct({'batch': batch})
+
+        results = []
+        for status, data in responses:
+            try:
+                ret = self._parse_response(status, data)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                ret = e
+            results.append(ret)
+        return results
+
     def _init_dict(self):
         from instamatic.TEMController.microscope import get_tem
         tem = get_tem(self.name)
@@ -132,6 +199,11 @@ class MicroscopeClient:
 class TraceVariable:
     """Simple class to trace a variable over time.
 
+    The function is called on a single thread every `interval` seconds.
+    To monitor many TEM getters over a long time, use
+    `instamatic.TEMController.telemetry.TelemetryRecorder`, which
+    batches the calls on one thread for all variables.
+
     Usage:
         t = TraceVariable(ctrl.stage.get, verbose=True)
         t.start()
@@ -153,18 +225,31 @@ class TraceVariable:
         self.verbose = verbose
 
         self._traced = []
+        self._stop_event = threading.Event()
+        self._thread = None
 
     def start(self):
         print(f'Trace started: {self.name}')
-        self.update()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f'Trace-{self.name}', daemon=True)
+        self._thread.start()
 
     def stop(self):
-        self._timer.cancel()
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
 
         print(f'Trace canceled: {self.name}')
 
         return self._traced
 
+    def _run(self):
+        t_next = time.perf_counter()
+        while not self._stop_event.is_set():
+            self.update()
+            t_next += self.interval
+            self._stop_event.wait(max(t_next - time.perf_counter(), 0))
+
     def update(self):
         ret = self.func()
 
@@ -174,6 +259,3 @@ class TraceVariable:
             print(f'{now} | Trace {self.name}: {ret}')
 
         self._traced.append((now, ret))
-
-        self._timer = threading.Timer(self.interval, self.update)
-        self._timer.start()
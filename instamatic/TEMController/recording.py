@@ -0,0 +1,387 @@
+"""Record and replay the calls to the microscope and camera.
+
+`RecordingProxy` wraps the `tem` or `cam` object and logs every call, its
+arguments, the return value (or exception), and the latency to a
+`CallLog`. The log is written by a background thread as a stream of
+pickled records to a gzip-compressed file, so that recording does not add
+to the latencies. To record a session, set `record_file` in
+`settings.yaml` (used by `initialize`), or wrap an existing controller
+with `record`.
+
+The replay backends `ReplayMicroscope` and `camera_replay.CameraReplay`
+(interface `replay`, see `microscope.get_tem` and `camera.get_cam`) read
+a recording (`replay_file` in `settings.yaml`), and respond to the calls
+with the recorded return values, after sleeping for the recorded latency
+multiplied by `replay_time_scale` (0 to respond immediately). Responses
+are matched by the function name and arguments, in the order they were
+recorded. Calls with arguments that were not recorded are answered with
+the next recorded response to a call with the same name. When the
+responses run out, the last one is repeated.
+
+Recordings are pickle files, only replay recordings from a trusted source.
+
+Usage:
+    ctrl = record(ctrl, 'session.rec')
+    ...  # run the experiment
+    ctrl.tem.close_log()
+"""
+import atexit
+import copy
+import datetime
+import functools
+import gzip
+import logging
+import numbers
+import os
+import pickle
+import queue
+import threading
+import time
+from collections import defaultdict
+from collections import deque
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from instamatic import __version__
+from instamatic import config
+from instamatic.exceptions import exception_list
+from instamatic.exceptions import TEMCommunicationError
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+Call = namedtuple('Call', ['device', 'name', 'args', 'kwargs', 'time', 'latency', 'error', 'value'])
+Call.__doc__ = """Recorded call of `name` on `device` (`tem` or `cam`), with the start
+`time` relative to the start of the recording, the `latency` (s), and
+the return `value`, or the `error` as (exception name, args)."""
+
+Device = namedtuple('Device', ['class_name', 'attrs', 'methods'])
+Device.__doc__ = """Recorded device: the class name, the plain attributes (dict), and
+the names of the methods."""
+
+Recording = namedtuple('Recording', ['header', 'devices', 'calls'])
+Recording.__doc__ = """Contents of a recording: the `header` (dict), the `devices` as a dict
+mapping the device name to `Device`, and the list of `calls` (see
+`Call`)."""
+
+
+class ReplayError(Exception):
+    pass
+
+
+def is_plain(value) -> bool:
+    """Check whether `value` is a plain (configuration) value: a number,
+    string, or a (nested) tuple, list, or dict of those."""
+    if value is None or isinstance(value, (numbers.Number, str)):
+        return True
+    if isinstance(value, (tuple, list)):
+        return all(is_plain(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and is_plain(item) for key, item in value.items())
+    return False
+
+
+def _wrapped_objects(obj) -> list:
+    """Return `obj`, preceded by the camera if `obj` is a `VideoStream`."""
+    wrapped = vars(obj).get('cam')
+    return [obj] if wrapped is None else [wrapped, obj]
+
+
+def plain_attributes(obj) -> dict:
+    """Collect the public plain attributes of `obj` (including the class
+    attributes, and those of the camera wrapped by a `VideoStream`),
+    without evaluating properties."""
+    attrs = {}
+    for o in _wrapped_objects(obj):
+        for namespace in (*(vars(cls) for cls in reversed(type(o).__mro__)), vars(o)):
+            for name, value in namespace.items():
+                if not name.startswith('_') and is_plain(value):
+                    attrs[name] = value
+    return attrs
+
+
+def method_names(obj) -> list:
+    """Collect the names of the public methods of `obj`."""
+    names = set()
+    for o in _wrapped_objects(obj):
+        names.update(name for name in dir(type(o)) if not name.startswith('_') and callable(getattr(type(o), name)))
+        names.update(name for name in vars(o).get('_dct', ()) if not name.startswith('_'))  # `MicroscopeClient`
+    return sorted(names)
+
+
+def call_key(name: str, args: tuple, kwargs: dict) -> str:
+    """Key to identify identical calls."""
+    return f'{name}{tuple(args)!r}{sorted(kwargs.items())!r}'
+
+
+def _picklable(obj):
+    try:
+        pickle.dumps(obj)
+    except Exception:
+        return repr(obj)
+    return obj
+
+
+class CallLog:
+    """Write the recorded calls to `path` on a background thread."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = Path(path)
+        self.n_calls = 0
+
+        self._t0 = time.perf_counter()
+        self._queue = queue.Queue()
+        self._file = gzip.open(self.path, 'wb', compresslevel=1)
+        self._thread = threading.Thread(target=self._run, name='CallLog', daemon=True)
+        self._thread.start()
+
+        self._queue.put(('header', {
+            'version': FORMAT_VERSION,
+            'instamatic': __version__,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        }))
+
+        atexit.register(self.close)
+        logger.info('Recording calls to %s', self.path)
+
+    def add_device(self, device: str, obj) -> None:
+        self._queue.put(('device', device, type(obj).__name__, plain_attributes(obj), method_names(obj)))
+
+    def add_call(self, device: str, name: str, args: tuple, kwargs: dict,
+                 t_start: float, latency: float, error: tuple = None, value=None) -> None:
+        if isinstance(value, np.ndarray):
+            value = value.copy()  # the caller may modify the array
+        self._queue.put(('call', device, name, args, kwargs, t_start - self._t0, latency, error, value))
+        self.n_calls += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                data = pickle.dumps(tuple(_picklable(x) for x in item), protocol=pickle.HIGHEST_PROTOCOL)
+            self._file.write(data)
+        self._file.close()
+
+    def close(self) -> None:
+        """Write the remaining calls and close the file."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        logger.info('Recorded %d calls to %s', self.n_calls, self.path)
+
+
+class RecordingProxy:
+    """Wrap the microscope or camera object `obj`, and record all method
+    calls as `device` to `log`.
+
+    Other attribute lookups and assignments are passed on to `obj`.
+    """
+
+    def __init__(self, obj, device: str, log: CallLog):
+        super().__init__()
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_device', device)
+        object.__setattr__(self, '_log', log)
+        log.add_device(device, obj)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._obj!r})'
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                ret = attr(*args, **kwargs)
+            except Exception as e:
+                self._log.add_call(self._device, name, args, kwargs, t0, time.perf_counter() - t0,
+                                   error=(e.__class__.__name__, e.args))
+                raise
+            self._log.add_call(self._device, name, args, kwargs, t0, time.perf_counter() - t0, value=ret)
+            return ret
+
+        return wrapper
+
+    def __setattr__(self, name, value):
+        setattr(self._obj, name, value)
+
+    def close_log(self) -> None:
+        """Stop recording and close the file."""
+        self._log.close()
+
+
+def record(ctrl, path: str):
+    """Return a new `TEMController` around the microscope and camera of
+    `ctrl`, which records all calls to `path`."""
+    from .TEMController import TEMController
+
+    log = CallLog(path)
+    tem = RecordingProxy(ctrl.tem, 'tem', log)
+    cam = RecordingProxy(ctrl.cam, 'cam', log) if ctrl.cam is not None else None
+    return TEMController(tem=tem, cam=cam)
+
+
+@functools.lru_cache(maxsize=4)
+def _read_recording(path: str, mtime: float) -> Recording:
+    header = {}
+    devices = {}
+    calls = []
+
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                item = pickle.load(f)
+            except EOFError:
+                break  # end of file, or the recording was interrupted
+            except pickle.UnpicklingError as e:
+                logger.warning('Recording %s is truncated: %s', path, e)
+                break
+
+            kind = item[0]
+            if kind == 'header':
+                header = item[1]
+            elif kind == 'device':
+                devices[item[1]] = Device(*item[2:])
+            elif kind == 'call':
+                calls.append(Call(*item[1:]))
+
+    return Recording(header, devices, calls)
+
+
+def read_recording(path: str) -> Recording:
+    """Read the recording in `path`, recordings are cached until the file
+    is modified."""
+    path = str(Path(path).resolve())
+    return _read_recording(path, os.path.getmtime(path))
+
+
+def latency_summary(path: str) -> dict:
+    """Return the number of calls and the total and mean latency (s) per
+    function in the recording, sorted by total latency."""
+    stats = defaultdict(list)
+    for call in read_recording(path).calls:
+        stats[f'{call.device}.{call.name}'].append(call.latency)
+
+    summary = {name: {'n': len(latencies), 'total': sum(latencies), 'mean': sum(latencies) / len(latencies)}
+               for name, latencies in stats.items()}
+    return dict(sorted(summary.items(), key=lambda item: item[1]['total'], reverse=True))
+
+
+class Player:
+    """Look up the recorded responses of a device, see module docstring."""
+
+    def __init__(self, calls: list):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._by_key = defaultdict(deque)
+        self._by_name = defaultdict(list)
+        self._index = defaultdict(int)
+
+        for call in calls:
+            self._by_key[call_key(call.name, call.args, call.kwargs)].append(call)
+            self._by_name[call.name].append(call)
+
+        self.n_unmatched = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def next(self, name: str, args: tuple, kwargs: dict) -> Call:
+        """Return the recorded call matching `name`, `args`, and `kwargs`."""
+        if name not in self._by_name:
+            raise ReplayError(f'No calls to `{name}` were recorded')
+
+        with self._lock:
+            responses = self._by_key.get(call_key(name, args, kwargs))
+            if responses:
+                return responses.popleft() if len(responses) > 1 else responses[0]
+
+            self.n_unmatched += 1
+            calls = self._by_name[name]
+            i = self._index[name]
+            self._index[name] = min(i + 1, len(calls) - 1)
+            return calls[i]
+
+
+class ReplayBackend:
+    """Replay the recorded calls of `device`, see module docstring.
+
+    The recorded plain attributes (i.e. the camera dimensions) are set on
+    the instance, and the methods of the recorded object are available as
+    attributes. Calling a method that was not recorded raises
+    `ReplayError`.
+
+    path: str
+        Recording to replay, defaults to `replay_file` in `settings.yaml`
+    time_scale: float
+        Multiply the recorded latencies by this factor, defaults to
+        `replay_time_scale` in `settings.yaml`
+    """
+
+    device = None
+
+    def __init__(self, name: str = None, path: str = None, time_scale: float = None):
+        super().__init__()
+        path = path or config.settings.replay_file
+        if not path:
+            raise ValueError('Set `replay_file` in `settings.yaml` to replay a recording')
+
+        recording = read_recording(path)
+        if self.device not in recording.devices:
+            raise ValueError(f'No `{self.device}` in recording {path}')
+
+        device = recording.devices[self.device]
+        self.__dict__.update(copy.deepcopy(device.attrs))
+        if name is not None and 'name' not in device.attrs:
+            self.name = name
+
+        self.path = path
+        self.recorded_class = device.class_name
+        self.time_scale = config.settings.replay_time_scale if time_scale is None else time_scale
+        self._player = Player([call for call in recording.calls if call.device == self.device])
+        self._methods = set(device.methods)
+
+        logger.info('Replaying %s (%s) from %s', self.device, device.class_name, path)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or (name not in self._methods and name not in self._player):
+            raise AttributeError(f'`{self.__class__.__name__}` object has no attribute `{name}` (not recorded)')
+
+        def replay(*args, **kwargs):
+            return self.replay(name, args, kwargs)
+
+        replay.__name__ = name
+        return replay
+
+    def replay(self, name: str, args: tuple, kwargs: dict):
+        """Respond to the call with the recorded value or exception."""
+        call = self._player.next(name, args, kwargs)
+
+        if self.time_scale:
+            time.sleep(call.latency * self.time_scale)
+
+        if call.error:
+            error_code, args = call.error
+            raise exception_list.get(error_code, TEMCommunicationError)(*args)
+
+        return copy.deepcopy(call.value)
+
+
+class ReplayMicroscope(ReplayBackend):
+    """Microscope interface replaying a recording."""
+
+    device = 'tem'
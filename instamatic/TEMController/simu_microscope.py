@@ -1,3 +1,4 @@
+import math
 import random
 import time
 from typing import Tuple
@@ -39,6 +40,9 @@ class SimuMicroscope:
     are randomized based on the config file loaded.
     """
 
+    # Can be called from several threads at once (see `StateSnapshot`)
+    thread_safe = True
+
     def __init__(self, name: str = 'simulate'):
         super().__init__()
 
@@ -121,12 +125,15 @@ class SimuMicroscope:
             if key in ('a', 'b'):
                 speed = 20.0  # degree / sec
                 current = random.randint(-40, 40)
+                overshoot = 0.02  # degree
             elif key in ('x', 'y'):
                 speed = 1_000_000.0  # nm / sec
                 current = random.randint(-100000, 100000)
+                overshoot = 100.0  # nm
             elif key == 'z':
                 speed = 100_000.0  # nm / sec
                 current = random.randint(-10000, 10000)
+                overshoot = 50.0  # nm
 
             self._stage_dict[key] = {
                 'current': current,
@@ -137,6 +144,9 @@ class SimuMicroscope:
                 'start': 0.0,
                 'end': 0.0,
                 't0': 0.0,
+                't1': 0.0,
+                'overshoot': overshoot,
+                'settle_time': 0.05,  # sec
             }
 
         self.goniotool_available = config.settings.use_goniotool
@@ -158,11 +168,30 @@ class SimuMicroscope:
         """Eliminate stage movement delays for testing."""
         for key in ('a', 'b', 'x', 'y', 'z'):
             self._stage_dict[key]['speed'] = 2**32
+            self._stage_dict[key]['overshoot'] = 0.0
+
+    def _set_call_latency(self, latency: float = 0.05):
+        """Add a delay of `latency` seconds to every call to simulate the
+        communication overhead with a real microscope (40-60 ms per call on
+        a JEOL 2100). Set to 0 to remove the delay."""
+        def delayed(method):
+            def wrapper(*args, **kwargs):
+                time.sleep(latency)
+                return method(*args, **kwargs)
+            return wrapper
+
+        for name in dir(type(self)):
+            if name.startswith('_') or not callable(getattr(type(self), name)):
+                continue
+
+            self.__dict__.pop(name, None)
+            if latency:
+                setattr(self, name, delayed(getattr(self, name)))
 
     def _StagePositionSetter(self, var: str, val: float) -> None:
         """General stage position setter, models stage movement speed."""
         d = self._stage_dict[var]
-        current = d['current']
+        current = self._StagePositionGetter(var)
         direction = +1 if (val > current) else -1
 
         d['is_moving'] = True
@@ -172,11 +201,17 @@ class SimuMicroscope:
         d['direction'] = direction
 
     def _StagePositionGetter(self, var: str) -> float:
-        """General stage position getter, models stage movement speed."""
+        """General stage position getter, models stage movement speed.
+
+        After the stage has stopped moving, the position overshoots the
+        target by `overshoot`, which decays exponentially with time
+        constant `settle_time` to model the settling of the stage.
+        """
         d = self._stage_dict[var]
         is_moving = d['is_moving']
         if is_moving:
-            dt = time.perf_counter() - d['t0']
+            t = time.perf_counter()
+            dt = t - d['t0']
             direction = d['direction']
             speed = d['speed']
             start = d['start']
@@ -186,14 +221,26 @@ class SimuMicroscope:
             if abs(val - start) > abs(end - start):
                 d['current'] = end
                 d['is_moving'] = False
-                ret = end
+                d['t1'] = d['t0'] + abs(end - start) / speed
+                ret = end + self._stage_overshoot(d, t)
             else:
                 ret = val
         else:
-            ret = d['current']
+            ret = d['current'] + self._stage_overshoot(d, time.perf_counter())
 
         return ret
 
+    @staticmethod
+    def _stage_overshoot(d: dict, t: float) -> float:
+        """Remaining overshoot of the stage at time `t` after the end of the
+        last movement."""
+        if not d['overshoot'] or d['start'] == d['end']:
+            return 0.0
+        dt = t - d['t1']
+        if dt > 10 * d['settle_time']:
+            return 0.0
+        return d['direction'] * d['overshoot'] * math.exp(-dt / d['settle_time'])
+
     @property
     def StagePosition_a(self):
         return self._StagePositionGetter('a')
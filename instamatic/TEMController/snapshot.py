@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .deflectors import DeflectorTuple
+from .microscope_client import batch_call
+from .stage import StagePositionTuple
+
+
+# Maps the keys of the microscope state to the getter on the TEM and the
+# namedtuple used to wrap the return value
+GETTERS = {
+    'FunctionMode': ('getFunctionMode', None),
+    'GunShift': ('getGunShift', DeflectorTuple),
+    'GunTilt': ('getGunTilt', DeflectorTuple),
+    'BeamShift': ('getBeamShift', DeflectorTuple),
+    'BeamTilt': ('getBeamTilt', DeflectorTuple),
+    'ImageShift1': ('getImageShift1', DeflectorTuple),
+    'ImageShift2': ('getImageShift2', DeflectorTuple),
+    'DiffShift': ('getDiffShift', DeflectorTuple),
+    'StagePosition': ('getStagePosition', StagePositionTuple),
+    'Magnification': ('getMagnification', None),
+    'DiffFocus': ('getDiffFocus', None),
+    'Brightness': ('getBrightness', None),
+    'SpotSize': ('getSpotSize', None),
+}
+
+# Time in seconds that a value is considered valid. Values that are changed
+# through `TEMController` are invalidated immediately, the TTL covers changes
+# made by other means (e.g. the knobs on the microscope). The stage is always
+# read out, because it may be moving.
+DEFAULT_TTL = 1.0
+TTL = {
+    'StagePosition': 0.0,
+}
+
+
+class StateSnapshot:
+    """Cached snapshot of the microscope state, used for the image headers.
+
+    If the TEM is accessed through the TEM server, all stale values are
+    requested in a single batch. Otherwise they are read out one by one,
+    because the microscope interfaces (COM) are bound to the thread that
+    created them. Backends that declare `thread_safe = True` (i.e.
+    `SimuMicroscope`) are read out concurrently. Each value is kept for a
+    limited time (see `TTL`), and the `TEMController` objects (deflectors,
+    lenses, stage, mode) invalidate the values they change.
+
+    tem: Microscope control object
+    ttl: dict, override the time-to-live (s) for the given keys
+    max_workers: int, number of threads to read out the TEM (1 reads sequentially),
+        defaults to 1, or one per getter if the TEM is thread-safe
+    """
+
+    def __init__(self, tem, ttl: dict = None, max_workers: int = None):
+        super().__init__()
+        self._tem = tem
+
+        self.ttl = {key: TTL.get(key, DEFAULT_TTL) for key in GETTERS}
+        if ttl:
+            self.ttl.update(ttl)
+
+        if max_workers is None:
+            max_workers = len(GETTERS) if getattr(tem, 'thread_safe', False) else 1
+        self._max_workers = max_workers
+        self._executor = None
+
+        self._lock = threading.Lock()
+        self._values = {}
+        self._generation = {key: 0 for key in GETTERS}
+
+    def invalidate(self, *keys) -> None:
+        """Invalidate the cached values for `keys`, or all values if no keys
+        are given."""
+        if not keys:
+            keys = GETTERS.keys()
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+                self._generation[key] += 1
+
+    def get(self, *keys, refresh: bool = False) -> dict:
+        """Return the microscope state for the given keys as a dict.
+
+        self.get('all') or self.get() will return all keys. Keys
+        that cannot be read out in the current mode (e.g.
+        `DiffFocus` outside of diffraction mode) are omitted. If
+        `refresh` is set, all values are read out from the TEM.
+        """
+        if 'all' in keys or not keys:
+            keys = tuple(GETTERS.keys())
+
+        now = time.perf_counter()
+
+        with self._lock:
+            cached = {}
+            for key in keys:
+                try:
+                    t, value = self._values[key]
+                except KeyError:
+                    continue
+                if not refresh and now - t < self.ttl[key]:
+                    cached[key] = value
+            stale = [key for key in keys if key not in cached]
+            generation = {key: self._generation[key] for key in stale}
+
+        fetched = self._fetch(stale)
+
+        with self._lock:
+            for key, value in fetched.items():
+                if isinstance(value, Exception):
+                    continue
+                if self._generation[key] == generation[key]:
+                    self._values[key] = (now, value)
+
+        dct = {}
+        for key in keys:
+            value = cached[key] if key in cached else fetched[key]
+            if isinstance(value, ValueError):
+                continue
+            elif isinstance(value, Exception):
+                raise value
+            dct[key] = value
+
+        return dct
+
+    def _fetch(self, keys: list) -> dict:
+        """Read out `keys` from the TEM, returns a dict with the values or
+        the exception raised by the getter."""
+        if not keys:
+            return {}
+
+        calls = [(GETTERS[key][0], ()) for key in keys]
+
+        if hasattr(self._tem, 'batch'):
+            # TEM server: single round trip
+            results = self._tem.batch(calls, return_exceptions=True)
+        elif self._max_workers > 1 and len(calls) > 1:
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+            futures = [self._executor.submit(batch_call, self._tem, [call], True) for call in calls]
+            results = [future.result()[0] for future in futures]
+        else:
+            results = batch_call(self._tem, calls, return_exceptions=True)
+
+        dct = {}
+        for key, ret in zip(keys, results):
+            wrapper = GETTERS[key][1]
+            if wrapper and not isinstance(ret, Exception):
+                ret = wrapper(*ret)
+            dct[key] = ret
+        return dct
@@ -9,6 +9,194 @@ import numpy as np
 # namedtuples to store results from .get()
 StagePositionTuple = namedtuple('StagePositionTuple', ['x', 'y', 'z', 'a', 'b'])
 
+# the position has settled when it changes less than this between readouts (nm / degrees)
+SETTLE_TOLERANCE = StagePositionTuple(x=10, y=10, z=10, a=0.005, b=0.005)
+# the target is reached when the position is within this distance (nm / degrees)
+TARGET_TOLERANCE = StagePositionTuple(x=150, y=150, z=500, a=0.057, b=0.057)
+
+
+class StageMove:
+    """Handle to a stage movement started with `Stage.set_async`.
+
+    The stage is polled whenever `done`, `wait`, or `result` is called,
+    so that the microscope is only accessed from the calling thread.
+    The polling interval adapts to the remaining travel time, estimated
+    from the measured stage velocity. The movement has finished when the
+    stage no longer reports that it is moving, and the position has
+    converged: it has stayed within `settle_tolerance` for at least
+    `settle_time` seconds, and it is within `target_tolerance` of the
+    target (or has not changed for `stall_time` seconds, in case the
+    target cannot be reached). The TEM server does not cache the stage
+    position, so that each readout is a new measurement.
+
+    Usage:
+        move = ctrl.stage.set_async(x=10_000, y=-5_000)
+        move.add_progress_callback(lambda progress, position: print(f'{progress:.0%}'))
+        ...  # do something else
+        move.wait(timeout=10)
+    """
+
+    def __init__(self, stage, target: dict,
+                 settle_tolerance: tuple = SETTLE_TOLERANCE,
+                 target_tolerance: tuple = TARGET_TOLERANCE,
+                 settle_time: float = 0.05,
+                 min_interval: float = 0.01,
+                 max_interval: float = 0.25,
+                 stall_time: float = 2.0,
+                 start: tuple = None,
+                 ):
+        super().__init__()
+        self._stage = stage
+        self.target = {key: val for key, val in target.items() if val is not None}
+        self.start = start if start is not None else stage.get()
+
+        keys = StagePositionTuple._fields
+        self._axes = [keys.index(key) for key in self.target]
+        self._target = np.array([self.target[key] for key in self.target], dtype=float)
+        self._settle_tolerance = np.array([settle_tolerance[i] for i in self._axes], dtype=float)
+        self._target_tolerance = np.array([target_tolerance[i] for i in self._axes], dtype=float)
+        self._distance = np.abs(self._target - np.take(self.start, self._axes))
+
+        self.settle_time = settle_time
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stall_time = stall_time
+
+        self.t0 = time.perf_counter()
+        self.t1 = None
+        self._last = np.take(self.start, self._axes).astype(float)
+        self._last_t = self.t0
+        self._last_change = self.t0
+        self._settle_ref = self._last  # position at the last change beyond the settle tolerance
+        self._next_poll = self.t0
+
+        self.position = self.start
+        self.progress = 0.0 if np.any(self._distance) else 1.0
+        self._done = False
+        self._cancelled = False
+        self._progress_callbacks = []
+        self._done_callbacks = []
+
+    def __repr__(self):
+        target = ', '.join(f'{key}={val}' for key, val in self.target.items())
+        status = 'done' if self._done else f'{self.progress:.0%}'
+        return f'{self.__class__.__name__}({target}, {status})'
+
+    @property
+    def duration(self) -> float:
+        """Time taken by the movement in seconds (so far)."""
+        return (self.t1 or time.perf_counter()) - self.t0
+
+    def add_progress_callback(self, func) -> None:
+        """Call `func(progress, position)` at each readout of the stage
+        position, where `progress` is the fraction (0-1) of the distance
+        covered."""
+        self._progress_callbacks.append(func)
+
+    def add_done_callback(self, func) -> None:
+        """Call `func(move)` when the movement has finished, immediately if
+        it has finished already."""
+        if self._done:
+            func(self)
+        else:
+            self._done_callbacks.append(func)
+
+    def _poll(self) -> None:
+        now = time.perf_counter()
+        moving = self._stage.is_moving()
+        position = self._stage.get()
+        current = np.take(position, self._axes).astype(float)
+
+        change = np.abs(current - self._last)
+        velocity = change / max(now - self._last_t, 1e-6)
+        remaining = np.abs(self._target - current)
+
+        if moving or np.any(np.abs(current - self._settle_ref) > self._settle_tolerance):
+            self._settle_ref = current
+            self._last_change = now
+
+        self.position = position
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covered = np.where(self._distance > 0, 1 - remaining / self._distance, 1.0)
+        self.progress = max(self.progress, float(np.clip(np.min(covered), 0.0, 1.0)))  # ignore the overshoot
+
+        settled = not moving and now - self._last_change >= self.settle_time
+        arrived = np.all(remaining <= self._target_tolerance)
+        stalled = now - self._last_change > self.stall_time
+
+        if settled and (arrived or stalled):
+            self.progress = 1.0
+
+        for func in self._progress_callbacks:
+            func(self.progress, position)
+
+        if settled and (arrived or stalled):
+            self._finish()
+            return
+
+        # poll again halfway the estimated remaining travel time
+        with np.errstate(divide='ignore', invalid='ignore'):
+            eta = np.nanmax(np.where(velocity > 0, remaining / velocity, 0.0))
+        self._next_poll = now + np.clip(eta / 2, self.min_interval, self.max_interval)
+        self._last = current
+        self._last_t = now
+
+    def _finish(self) -> None:
+        self._done = True
+        self.t1 = time.perf_counter()
+        self._stage._invalidate()
+        for func in self._done_callbacks:
+            func(self)
+
+    def done(self) -> bool:
+        """Return True if the movement has finished (non-blocking)."""
+        if not self._done and time.perf_counter() >= self._next_poll:
+            self._poll()
+        return self._done
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the movement has finished, or until `timeout`
+        seconds have passed.
+
+        Returns True if the movement has finished.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self._done:
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                break
+            delay = self._next_poll - now
+            if deadline is not None:
+                delay = min(delay, deadline - now)
+            if delay > 0:
+                time.sleep(delay)
+            self.done()
+        return self._done
+
+    def result(self, timeout: float = None) -> StagePositionTuple:
+        """Wait for the movement to finish and return the final stage
+        position.
+
+        Raises TimeoutError if the movement does not finish within
+        `timeout` seconds.
+        """
+        if not self.wait(timeout):
+            raise TimeoutError(f'Stage movement did not finish within {timeout} s: {self}')
+        return self.position
+
+    def cancel(self) -> bool:
+        """Stop the stage, returns False if the movement had already
+        finished."""
+        if self._done:
+            return False
+        self._stage.stop()
+        self._cancelled = True
+        self._finish()
+        return True
+
 
 class Stage:
     """Stage control."""
@@ -18,6 +206,7 @@ class Stage:
         self._tem = tem
         self._setter = self._tem.setStagePosition
         self._getter = self._tem.getStagePosition
+        self._snapshot = None
         self._wait = True  # properties only
 
     def __repr__(self):
@@ -31,6 +220,25 @@ class Stage:
     def set(self, x: int = None, y: int = None, z: int = None, a: int = None, b: int = None, wait: bool = True) -> None:
         """wait: bool, block until stage movement is complete (JEOL only)"""
         self._setter(x, y, z, a, b, wait=wait)
+        self._invalidate()
+
+    def set_async(self, x: int = None, y: int = None, z: int = None, a: int = None, b: int = None, **kwargs) -> StageMove:
+        """Start moving the stage without blocking, and return a `StageMove`
+        handle with `done()`, `wait(timeout)`, and `result(timeout)`. Progress
+        and completion callbacks can be added to the handle.
+
+        Completion is determined from the convergence of the stage position
+        rather than a fixed settle delay. Keyword arguments are passed to
+        `StageMove` to adjust the tolerances and polling intervals.
+
+        Usage:
+            move = ctrl.stage.set_async(x=0, y=0)
+            img = process(img)  # do something useful in the meantime
+            move.wait()
+        """
+        start = self.get()
+        self.set(x=x, y=y, z=z, a=a, b=b, wait=False)
+        return StageMove(self, {'x': x, 'y': y, 'z': z, 'a': a, 'b': b}, start=start, **kwargs)
 
     def set_with_speed(self, x: int = None, y: int = None, z: int = None, a: int = None, b: int = None, wait: bool = True, speed: float = 1.0) -> None:
         """Note that this function only works on FEI machines.
@@ -39,6 +247,7 @@ class Stage:
         speed: float, set stage rotation with specified speed (FEI only)
         """
         self._setter(x, y, z, a, b, wait=wait, speed=speed)
+        self._invalidate()
 
     def set_rotation_speed(self, speed=1) -> None:
         """Sets the stage (rotation) movement speed on the TEM."""
@@ -195,6 +404,12 @@ class Stage:
         """This will halt the stage preemptively if `wait=False` is passed to
         Stage.set."""
         self._tem.stopStage()
+        self._invalidate()
+
+    def _invalidate(self) -> None:
+        """Invalidate the value in the cached microscope state."""
+        if self._snapshot:
+            self._snapshot.invalidate('StagePosition')
 
     def alpha_wobbler(self, delta: float = 5.0, event=None) -> None:
         """Tilt the stage by plus/minus the value of delta (degrees) If event
@@ -234,8 +449,14 @@ class Stage:
         step: float,
             stepsize in nm
         settle_delay: float,
-            delay between movements in seconds to allow the stage to settle
+            delay between movements in seconds to allow the stage to settle,
+            if None, wait until the stage position has converged instead
         """
+        if settle_delay is None:
+            self.set_async(x=x - step, y=y - step).wait()
+            self.set_async(x=x, y=y).wait()
+            return
+
         wait = True
         self.set(x=x - step, y=y - step)
         if settle_delay:
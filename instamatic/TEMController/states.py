@@ -9,6 +9,7 @@ class State:
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._snapshot = None
 
     def __repr__(self):
         return f'{self.name}({repr(self.state)})'
@@ -81,6 +82,9 @@ class Mode(State):
     def set(self, mode: str) -> None:
         """Set the function mode."""
         self._setter(mode)
+        if self._snapshot:
+            # magnification and lens values depend on the mode
+            self._snapshot.invalidate()
 
     def get(self) -> str:
         """Returns the function mode."""
@@ -0,0 +1,268 @@
+"""Telemetry recorder for long-running monitoring of the microscope state.
+
+A single scheduler thread samples a set of getters, each at its own
+interval. Getters that are due at the same time are read out in one
+batch (a single round trip through the TEM server). The samples are
+kept in an in-memory ring buffer per channel, and optionally appended
+to an HDF5 file, with one dataset per channel where each row holds the
+timestamp (`time.time()`) followed by the values.
+
+Usage:
+    rec = TelemetryRecorder(ctrl.tem, channels={'StagePosition': 1.0, 'BeamShift': 5.0}, path='telemetry.h5')
+    rec.start()
+    ...  # run the experiment
+    rec.stop()
+    t, values = rec.get('StagePosition')
+"""
+import heapq
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .microscope_client import batch_call
+from .snapshot import GETTERS
+
+logger = logging.getLogger(__name__)
+
+# Default channels and their sampling intervals in seconds
+DEFAULT_CHANNELS = {
+    'StagePosition': 1.0,
+    'BeamShift': 5.0,
+    'BeamTilt': 5.0,
+    'DiffShift': 5.0,
+    'ImageShift1': 5.0,
+    'ImageShift2': 5.0,
+    'Brightness': 5.0,
+    'Magnification': 5.0,
+}
+
+
+class RingBuffer:
+    """Fixed-size buffer of rows, overwriting the oldest rows when full."""
+
+    def __init__(self, capacity: int, ncols: int):
+        super().__init__()
+        self._data = np.full((capacity, ncols), np.nan)
+        self._n = 0  # total number of rows appended
+
+    def __len__(self) -> int:
+        return min(self._n, len(self._data))
+
+    def append(self, row) -> None:
+        self._data[self._n % len(self._data)] = row
+        self._n += 1
+
+    def get(self) -> np.ndarray:
+        """Return a copy of the rows, oldest first."""
+        capacity = len(self._data)
+        if self._n <= capacity:
+            return self._data[:self._n].copy()
+        i = self._n % capacity
+        return np.vstack((self._data[i:], self._data[:i]))
+
+
+class Channel:
+    """Telemetry channel, samples `func_name` on the TEM every `interval`
+    seconds."""
+
+    def __init__(self, name: str, interval: float, capacity: int):
+        super().__init__()
+        self.name = name
+        self.interval = interval
+        self.capacity = capacity
+
+        getter, wrapper = GETTERS.get(name, (name, None))
+        self.func_name = getter
+        self.columns = list(wrapper._fields) if wrapper else None
+
+        self.buffer = None
+        self.pending = []  # rows not yet written to the file
+        self.errors = 0
+
+    def add(self, t: float, value) -> None:
+        """Add a sample, values that are not numeric are stored as NaN."""
+        if isinstance(value, Exception):
+            self.errors += 1
+            if self.errors == 1:
+                logger.warning('Telemetry %s: %r', self.name, value)
+            value = np.nan
+
+        try:
+            values = np.asarray(value, dtype=float).ravel()
+        except (TypeError, ValueError):
+            values = np.array([np.nan])
+
+        if self.buffer is None:
+            if self.columns is None or len(self.columns) != len(values):
+                self.columns = ['value'] if len(values) == 1 else [f'value_{i}' for i in range(len(values))]
+            self.buffer = RingBuffer(self.capacity, 1 + len(self.columns))
+
+        row = np.full(1 + len(self.columns), np.nan)
+        row[0] = t
+        row[1:1 + len(values)] = values[:len(self.columns)]
+
+        self.buffer.append(row)
+        self.pending.append(row)
+
+
+class TelemetryRecorder:
+    """Record the microscope state at fixed rates on a single thread.
+
+    tem:
+        Microscope control object (e.g. `ctrl.tem`)
+    channels: dict
+        Maps the channel names to the sampling interval in seconds. Names
+        are keys of the microscope state (see `snapshot.GETTERS`, i.e.
+        `StagePosition`), or names of getters on the TEM (i.e.
+        `getHTValue`). Defaults to `DEFAULT_CHANNELS`
+    capacity: int
+        Number of samples kept in memory per channel
+    path: str
+        HDF5 file to append the samples to, in memory only if None
+    flush_interval: float
+        Interval in seconds at which the samples are written to the file
+    """
+
+    def __init__(self, tem,
+                 channels: dict = None,
+                 capacity: int = 10_000,
+                 path: str = None,
+                 flush_interval: float = 10.0,
+                 ):
+        super().__init__()
+        self._tem = tem
+        self.path = path
+        self.flush_interval = flush_interval
+
+        channels = channels or DEFAULT_CHANNELS
+        self.channels = {name: Channel(name, interval, capacity) for name, interval in channels.items()}
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.n_batches = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.stop()
+
+    def start(self) -> None:
+        """Start sampling on the scheduler thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='TelemetryRecorder', daemon=True)
+        self._thread.start()
+        logger.info('Telemetry started: %s', ', '.join(f'{ch.name} ({ch.interval} s)' for ch in self.channels.values()))
+
+    def stop(self) -> None:
+        """Stop sampling and write the remaining samples to the file."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        logger.info('Telemetry stopped')
+
+    def sample(self, channels: list) -> None:
+        """Read out the given channels in one batch."""
+        calls = [(ch.func_name, ()) for ch in channels]
+        if hasattr(self._tem, 'batch'):
+            results = self._tem.batch(calls, return_exceptions=True)
+        else:
+            results = batch_call(self._tem, calls, return_exceptions=True)
+
+        t = time.time()
+        with self._lock:
+            for ch, value in zip(channels, results):
+                ch.add(t, value)
+        self.n_batches += 1
+
+    def _run(self) -> None:
+        now = time.perf_counter()
+        queue = [(now, name) for name in self.channels]
+        heapq.heapify(queue)
+        next_flush = now + self.flush_interval
+
+        while not self._stop_event.is_set():
+            now = time.perf_counter()
+
+            # batch all channels that are due
+            due = []
+            while queue and queue[0][0] <= now:
+                t_due, name = heapq.heappop(queue)
+                due.append(self.channels[name])
+                interval = self.channels[name].interval
+                t_next = t_due + interval
+                if t_next <= now:
+                    t_next = now + interval  # skip missed samples
+                heapq.heappush(queue, (t_next, name))
+
+            if due:
+                try:
+                    self.sample(due)
+                except Exception as e:
+                    logger.error('Telemetry sample failed: %r', e)
+
+            if self.path and now >= next_flush:
+                self.flush()
+                next_flush = now + self.flush_interval
+
+            self._stop_event.wait(max(queue[0][0] - time.perf_counter(), 0))
+
+    def flush(self) -> None:
+        """Append the samples collected since the last flush to the file."""
+        if not self.path:
+            return
+
+        with self._lock:
+            rows = {ch.name: (ch, np.array(ch.pending)) for ch in self.channels.values() if ch.pending}
+            for ch in self.channels.values():
+                ch.pending = []
+
+        if not rows:
+            return
+
+        import h5py
+        with h5py.File(self.path, 'a') as f:
+            for name, (ch, data) in rows.items():
+                if name not in f:
+                    dset = f.create_dataset(name, shape=(0, data.shape[1]), maxshape=(None, data.shape[1]),
+                                            dtype=float, chunks=(1024, data.shape[1]))
+                    dset.attrs['columns'] = ['time', *ch.columns]
+                    dset.attrs['interval'] = ch.interval
+                dset = f[name]
+                n = len(dset)
+                dset.resize(n + len(data), axis=0)
+                dset[n:] = data
+
+    def get(self, name: str) -> tuple:
+        """Return the timestamps and values of channel `name` in the ring
+        buffer, oldest first."""
+        ch = self.channels[name]
+        with self._lock:
+            if ch.buffer is None:
+                return np.empty(0), np.empty((0, 0))
+            data = ch.buffer.get()
+        return data[:, 0], data[:, 1:]
+
+    def latest(self, name: str) -> dict:
+        """Return the last sample of channel `name` as a dict."""
+        t, values = self.get(name)
+        if not len(t):
+            return {}
+        return {'time': t[-1], **dict(zip(self.channels[name].columns, values[-1]))}
+
+
+def read_telemetry(path: str, name: str) -> tuple:
+    """Read channel `name` from a telemetry file, returns the timestamps,
+    the values, and the column names."""
+    import h5py
+    with h5py.File(path, 'r') as f:
+        dset = f[name]
+        data = dset[:]
+        columns = [str(col) for col in dset.attrs['columns']]
+    return data[:, 0], data[:, 1:], columns[1:]
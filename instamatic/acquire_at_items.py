@@ -1,8 +1,15 @@
+import logging
+import time
 from collections import defaultdict
+from collections import deque
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from tqdm.auto import tqdm
 
+logger = logging.getLogger(__name__)
+
 
 class AcquireAtItems:
     """Class to automated acquisition at many stage locations. The acquisition
@@ -30,6 +37,12 @@ class AcquireAtItems:
         sequence _after_ the main acquisition function.
     backlash: bool
         Move the stage with backlash correction.
+    route: str
+        Reorder the items to minimize the stage travel time, 'tsp' (nearest
+        neighbour tour with 2-opt), 'nearest', or 'serpentine', see
+        `instamatic.stage_route.plan_route`. With backlash correction, the
+        correction is skipped for items approached from the correct side.
+        The items are visited in the order given if None.
 
     Returns
     -------
@@ -43,11 +56,29 @@ class AcquireAtItems:
                  pre_acquire=None,
                  post_acquire=None,
                  every_n: dict = {},
-                 backlash: bool = True):
+                 backlash: bool = True,
+                 route: str = None):
         super().__init__()
 
-        self.nav_items = nav_items
         self.ctrl = ctrl
+        self.backlash = backlash
+
+        if route:
+            from instamatic.stage_route import StageModel
+            from instamatic.stage_route import plan_route
+            from instamatic.stage_route import route_time
+
+            model = StageModel.from_tem(ctrl.tem)
+            plan = plan_route(nav_items, model=model, method=route, backlash=backlash)
+            t_given = route_time(nav_items, range(len(nav_items)), model=model, backlash=backlash)
+            logger.info('Route (%s): estimated stage time %.0f s (was %.0f s)', route, plan.time, t_given)
+
+            nav_items = [nav_items[i] for i in plan.order]
+            self.backlash_flags = [backlash and flag for flag in plan.backlash]
+        else:
+            self.backlash_flags = [backlash] * len(nav_items)
+
+        self.nav_items = nav_items
 
         if pre_acquire:
             self._pre_acquire = self.validate(pre_acquire)
@@ -68,8 +99,6 @@ class AcquireAtItems:
             self._post_acquire = self.validate(post_acquire)
             print(f'Post-acquire:', ', '.join([func.__name__ for func in self._post_acquire]))
 
-        self.backlash = backlash
-
     # blank placeholders
     _acquire = ()
     _pre_acquire = ()
@@ -97,17 +126,27 @@ class AcquireAtItems:
 
     def acquire(self, ctrl, i: int = 1):
         """Handler to call functions at each stage position/NavItem (or at
-        specific intervals)."""
+        specific intervals).
+
+        Returns the list of values returned by the functions.
+        """
+        ret = []
+        if not self._acquire:
+            return ret
+
         r = self._acquire_intervals
         tasks = r[(i + 1) % r == 0]
         for interval in tasks:
             funcs = self._acquire[interval]
             for func in funcs:
                 # print(f" >> {interval}: {func.__name__}")
-                func(ctrl)
+                ret.append(func(ctrl))
+        return ret
 
-    def move_to_item(self, item):
-        """Move the stage to the stage coordinates given by the NavItem."""
+    @staticmethod
+    def item_coords(item) -> tuple:
+        """Return the stage coordinates (x, y, z) in nm of the NavItem or
+        coordinate, z is None if it is not defined."""
         try:
             x = item.stage_x * 1000  # um -> nm
             y = item.stage_y * 1000  # um -> nm
@@ -120,11 +159,22 @@ class AcquireAtItems:
                 x, y, z = item
             else:
                 raise IndexError(f'Coordinate must have 2 (x, y) or 3 (x, y, z) elements: {item}')
+        return x, y, z
+
+    def move_to_item(self, item, backlash: bool = None):
+        """Move the stage to the stage coordinates given by the NavItem.
+
+        `backlash` overrides the backlash correction set on the class.
+        """
+        x, y, z = self.item_coords(item)
 
         if z is not None:
             self.ctrl.stage.set(z=z)
 
-        if self.backlash:
+        if backlash is None:
+            backlash = self.backlash
+
+        if backlash:
             set_xy = self.ctrl.stage.set_xy_with_backlash_correction
         else:
             set_xy = self.ctrl.stage.set
@@ -139,23 +189,23 @@ class AcquireAtItems:
         start_index : int
             Start acquisition from this item.
         """
-        import time
         import msvcrt
 
         ctrl = self.ctrl
         nav_items = self.nav_items[start_index:]
+        backlash_flags = self.backlash_flags[start_index:]
 
         ntot = len(nav_items)
 
         print(f'\nAcquiring on {ntot} items.')
         print('Press <Ctrl-C> or ⬛ to interrupt.\n')
 
-        self.move_to_item(nav_items[0])  # pre-move
+        self.move_to_item(nav_items[0], backlash=backlash_flags[0])  # pre-move
         self.pre_acquire(ctrl)
 
         t0 = time.perf_counter()
 
-        for i, item in enumerate(tqdm(nav_items)):
+        for i, (item, backlash) in enumerate(zip(tqdm(nav_items), backlash_flags)):
             # Run script in try/except block so that Keyboard interrupt
             # will safely break out of the loop
             try:
@@ -163,7 +213,7 @@ class AcquireAtItems:
                 ctrl.current_item = item
                 ctrl.current_i = i
 
-                self.move_to_item(item)
+                self.move_to_item(item, backlash=backlash)
                 self.acquire(ctrl, i=i)
 
             except (Exception, KeyboardInterrupt) as e:
@@ -179,3 +229,188 @@ class AcquireAtItems:
         n_items = i + 1
         print(f'Total time taken: {dt:.0f} s for {n_items} items ({dt/n_items:.2f} s/item)')
         print('\nAll done!')
+
+
+# namedtuple to store the results of `PipelinedAcquireAtItems`
+ItemResult = namedtuple('ItemResult', ['index', 'item', 'result', 'processed', 'error'])
+
+
+class PipelinedAcquireAtItems(AcquireAtItems):
+    """Automated acquisition at many stage locations, where the stage
+    movement to the next item overlaps with the processing of the previous
+    one.
+
+    As soon as the acquisition functions have run at an item, the stage
+    move to the next item is started without waiting for it to finish
+    (`Stage.set_async`). The values returned by the acquisition
+    functions are passed to `process`, which runs on a worker thread while
+    the stage is moving. The processing functions should therefore not
+    control the microscope. The results are stored in `results`, in the
+    order of the items.
+
+    Takes the same parameters as `AcquireAtItems`, and:
+
+    process: callable
+        Function called as `process(i, item, result)` on a worker thread,
+        where `result` is the list of values returned by the acquisition
+        functions at item `i`
+    workers: int
+        Number of worker threads used for processing
+    settle_delay: float
+        Additional delay after each move to allow the stage to settle in
+        seconds. By default, the stage is considered settled once its
+        position has converged (see `StageMove`)
+    backlash_step: float
+        Step size of the backlash correction in nm, see
+        `Stage.set_xy_with_backlash_correction`
+    """
+
+    def __init__(self, ctrl,
+                 nav_items: list,
+                 acquire=None,
+                 process=None,
+                 workers: int = 1,
+                 settle_delay: float = None,
+                 backlash_step: float = 10000,
+                 **kwargs):
+        super().__init__(ctrl, nav_items, acquire=acquire, **kwargs)
+
+        if process:
+            assert callable(process), f'{process} is not a function!'
+            print('Process:', process.__name__)
+
+        self._process = process
+        self.workers = workers
+        self.settle_delay = settle_delay
+        self.backlash_step = backlash_step
+
+        self.results = []
+        self._move = None
+        self._target = None
+
+    def issue_move(self, item, backlash: bool = None) -> None:
+        """Start moving the stage to the NavItem without waiting for the
+        movement to finish, see `complete_move`.
+
+        With backlash correction, only the move to the approach
+        position is started.
+        """
+        x, y, z = self.item_coords(item)
+        stage = self.ctrl.stage
+
+        if z is not None:
+            stage.set(z=z)
+
+        if backlash is None:
+            backlash = self.backlash
+
+        if backlash:
+            self._move = stage.set_async(x=x - self.backlash_step, y=y - self.backlash_step)
+            self._target = (x, y)
+        else:
+            self._move = stage.set_async(x=x, y=y)
+            self._target = None
+
+    def complete_move(self) -> None:
+        """Wait for the stage movement started by `issue_move` to finish,
+        and make the final approach in case of backlash correction."""
+        stage = self.ctrl.stage
+        if self._move:
+            self._move.wait()
+            self._move = None
+
+        if self._target:
+            if self.settle_delay:
+                time.sleep(self.settle_delay)
+            x, y = self._target
+            stage.set_async(x=x, y=y).wait()
+            self._target = None
+
+        if self.settle_delay:
+            time.sleep(self.settle_delay)
+
+    def process(self, i: int, item, result: list):
+        """Handler to call the processing function on the worker thread."""
+        if self._process:
+            return self._process(i, item, result)
+
+    def _collect(self, pending: deque, block: bool = False) -> None:
+        """Move finished items from `pending` to `results`, keeping the
+        order of the items."""
+        while pending and (block or pending[0][-1].done()):
+            i, item, result, future = pending.popleft()
+            try:
+                processed = future.result()
+            except Exception as e:
+                print(f'\nProcessing failed for item {i}: {e!r}')
+                self.results.append(ItemResult(i, item, result, None, e))
+            else:
+                self.results.append(ItemResult(i, item, result, processed, None))
+
+    def start(self, start_index: int = 0):
+        """Start serial acquisition protocol.
+
+        Parameters
+        ----------
+        start_index : int
+            Start acquisition from this item.
+
+        Returns
+        -------
+        results : list
+            List of `ItemResult` (index, item, result, processed, error)
+        """
+        ctrl = self.ctrl
+        nav_items = self.nav_items[start_index:]
+        backlash_flags = self.backlash_flags[start_index:]
+
+        ntot = len(nav_items)
+
+        print(f'\nAcquiring on {ntot} items (pipelined).')
+        print('Press <Ctrl-C> or ⬛ to interrupt.\n')
+
+        self.results = []
+        pending = deque()
+
+        self.pre_acquire(ctrl)
+        self.move_to_item(nav_items[0], backlash=backlash_flags[0])
+
+        t0 = time.perf_counter()
+
+        i = start_index
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for k, item in enumerate(tqdm(nav_items)):
+                try:
+                    i = k + start_index
+                    ctrl.current_item = item
+                    ctrl.current_i = i
+
+                    if k > 0:
+                        self.complete_move()
+
+                    result = self.acquire(ctrl, i=i)
+
+                    if k + 1 < ntot:
+                        self.issue_move(nav_items[k + 1], backlash=backlash_flags[k + 1])
+
+                    future = pool.submit(self.process, i, item, result)
+                    pending.append((i, item, result, future))
+                    self._collect(pending)
+
+                except (Exception, KeyboardInterrupt) as e:
+                    print(repr(e.with_traceback(None)))
+                    print(f'\nAcquisition was interrupted during item `{item}`!')
+                    break
+
+            self._collect(pending, block=True)
+
+        t1 = time.perf_counter()
+
+        self.post_acquire(ctrl)
+
+        dt = t1 - t0
+        n_items = i - start_index + 1
+        print(f'Total time taken: {dt:.0f} s for {n_items} items ({dt/n_items:.2f} s/item)')
+        print('\nAll done!')
+
+        return self.results
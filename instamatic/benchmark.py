@@ -0,0 +1,443 @@
+"""Benchmarks for the image formats, serializers, processing functions and
+the TEM/camera servers.
+
+Every benchmark is run `repeat` times after one warm-up call, and the
+timings (seconds per call) are stored in a json file together with some
+information about the machine and package versions, so that the results
+of two runs can be compared to find regressions.
+
+The input images are rendered by the synthetic camera
+(`camera_synthetic.CameraSynthetic`) with a fixed seed, so that the
+inputs are identical between runs. The server benchmarks start the TEM
+and camera servers in this process on a free port of the loopback
+interface, with the simulated backends.
+
+Usage:
+    instamatic.benchmark -o after.json -c before.json
+"""
+import datetime
+import json
+import logging
+import platform
+import queue
+import socket
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from instamatic import __version__
+from instamatic import config
+
+logger = logging.getLogger(__name__)
+
+Benchmark = namedtuple('Benchmark', ['name', 'func', 'number', 'nbytes'], defaults=(1, None))
+Benchmark.__doc__ = """Benchmark `name` calling `func` (without arguments) `number`
+times per timing, `nbytes` is the amount of data handled per call, used
+to calculate the throughput."""
+
+# Ratio of the median timings above which a benchmark is reported as slower
+REGRESSION_THRESHOLD = 1.2
+
+
+def measure(func, repeat: int = 5, number: int = 1) -> dict:
+    """Time `func`, returns the statistics of the time per call (s) over
+    `repeat` timings of `number` calls each."""
+    func()  # warm-up
+
+    timings = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        for j in range(number):
+            func()
+        timings.append((time.perf_counter() - t0) / number)
+
+    timings = np.array(timings)
+    return {
+        'repeat': repeat,
+        'number': number,
+        'min': timings.min(),
+        'median': np.median(timings),
+        'mean': timings.mean(),
+        'std': timings.std(),
+    }
+
+
+class Inputs:
+    """Deterministic input images, rendered by the synthetic camera.
+
+    diff: list of diffraction patterns in a rotation series (uint16)
+    image: image of crystals in imaging mode (uint16)
+    shifted: `image` shifted by (5, -3) pixels
+    """
+
+    def __init__(self, nframes: int = 10, binsize: int = 1, seed: int = 0):
+        super().__init__()
+        from instamatic.camera.camera_synthetic import CameraSynthetic
+
+        cam = CameraSynthetic(name=config.camera.name)
+        rng = np.random.default_rng(seed)
+
+        def noisy(img):
+            return np.clip(rng.poisson(img), 0, 2**16 - 1).astype(np.uint16)
+
+        self.binsize = binsize
+        self.pixelsize = cam.pixelsize('diff', None) * binsize
+        self.diff = [noisy(cam.render_diffraction(0.1, binsize=binsize, alpha=0.5 * i)) for i in range(nframes)]
+        self.image = noisy(cam.render_image(0.1, binsize=binsize, mag=2500))
+        self.shifted = np.roll(self.image, (5, -3), axis=(0, 1))
+
+        self.header = {
+            'ImageExposureTime': 0.1,
+            'ImageBinsize': binsize,
+            'ImageComment': 'benchmark',
+            'StagePosition': (0.0, 0.0, 0.0, 0.0, 0.0),
+            'Magnification': 2500,
+        }
+
+
+def bench_formats(inputs: Inputs, tmp: Path):
+    """Write and read a diffraction pattern in all image formats."""
+    from instamatic import formats
+
+    img = inputs.diff[0]
+    header = inputs.header
+
+    writers = {
+        'tiff': ('.tiff', formats.write_tiff, True),
+        'cbf': ('.cbf', formats.write_cbf, True),
+        'mrc': ('.mrc', formats.write_mrc, False),  # header not supported
+        'smv': ('.img', formats.write_adsc, True),
+        'hdf5': ('.h5', formats.write_hdf5, True),
+    }
+
+    for name, (ext, write, has_header) in writers.items():
+        fn = tmp / f'image{ext}'
+        args = (fn, img, header) if has_header else (fn, img)
+        yield Benchmark(f'formats.write_{name}', lambda write=write, args=args: write(*args), nbytes=img.nbytes)
+        yield Benchmark(f'formats.read_{name}', lambda fn=fn: formats.read_image(fn), nbytes=img.nbytes)
+
+    fn = tmp / 'container.h5'
+    nbytes = sum(frame.nbytes for frame in inputs.diff)
+
+    def write_container():
+        if fn.exists():
+            fn.unlink()  # the writer appends to existing containers
+        with formats.H5ContainerWriter(fn) as writer:
+            for i, frame in enumerate(inputs.diff):
+                writer.append('images', frame, header={**header, 'exp_image_index': i})
+
+    def read_container():
+        with formats.H5ContainerReader(fn) as reader:
+            images = reader['images']
+            for i in range(len(images)):
+                images[i]
+
+    yield Benchmark('formats.write_h5container', write_container, nbytes=nbytes)
+    yield Benchmark('formats.read_h5container', read_container, nbytes=nbytes)
+
+
+def bench_serializer(inputs: Inputs, tmp: Path):
+    """Dump and load typical messages of the server protocol."""
+    from instamatic.server import serializer
+
+    command = {'func_name': 'getStagePosition', 'args': (), 'kwargs': {}}
+    response = (200, [1234.5, -5678.9, 12.3, -30.1, 0.0])
+    batch = {'batch': [{'func_name': f'get{name}', 'args': (), 'kwargs': {}} for name in
+                       ('StagePosition', 'BeamShift', 'BeamTilt', 'DiffShift', 'ImageShift1',
+                        'ImageShift2', 'Brightness', 'Magnification', 'FunctionMode', 'SpotSize')]}
+
+    protocols = ['json', 'pickle', 'yaml']
+    if hasattr(serializer, 'msgpack_dumper'):
+        protocols.append('msgpack')
+
+    for protocol in protocols:
+        dumper = getattr(serializer, f'{protocol}_dumper')
+        loader = getattr(serializer, f'{protocol}_loader')
+        number = 10 if protocol == 'yaml' else 1000
+
+        for name, message in (('command', command), ('response', response), ('batch', batch)):
+            data = dumper(message)
+            yield Benchmark(f'serializer.{protocol}.dumps_{name}', lambda dumper=dumper, message=message: dumper(message),
+                            number=number, nbytes=len(data))
+            yield Benchmark(f'serializer.{protocol}.loads_{name}', lambda loader=loader, data=data: loader(data),
+                            number=number, nbytes=len(data))
+
+
+def bench_imgconversion(inputs: Inputs, tmp: Path):
+    """Convert a rotation series to tiff, SMV and MRC, including the beam
+    center search and the XDS/REDp input files."""
+    from instamatic.processing.ImgConversionTPX import ImgConversionTPX
+
+    buffer = [(i + 1, frame, {'ImageExposureTime': 0.1, 'ImageGetTime': 0}) for i, frame in enumerate(inputs.diff)]
+
+    def convert():
+        img_conv = ImgConversionTPX(buffer=list(buffer),  # the buffer is consumed
+                                    osc_angle=0.5,
+                                    start_angle=0.0,
+                                    end_angle=0.5 * len(buffer),
+                                    rotation_axis=-2.2,
+                                    acquisition_time=0.1,
+                                    flatfield=None,
+                                    pixelsize=inputs.pixelsize,
+                                    physical_pixelsize=config.camera.physical_pixelsize * inputs.binsize,
+                                    wavelength=config.microscope.wavelength)
+        try:
+            img_conv.threadpoolwriter(tiff_path=tmp / 'tiff', smv_path=tmp / 'SMV', mrc_path=tmp / 'RED')
+            img_conv.write_xds_inp(tmp / 'SMV')
+            img_conv.write_ed3d(tmp / 'RED')
+        finally:
+            img_conv.close()
+
+    nbytes = sum(frame.nbytes for frame in inputs.diff)
+    yield Benchmark(f'imgconversion.{len(buffer)}_frames', convert, nbytes=nbytes)
+
+
+def bench_processing(inputs: Inputs, tmp: Path):
+    """Image analysis used during data collection."""
+    from instamatic import imreg
+    from instamatic.processing.find_crystals import find_crystals
+    from instamatic.tools import find_beam_center
+
+    yield Benchmark('processing.find_beam_center', lambda: find_beam_center(inputs.diff[0], sigma=10))
+    yield Benchmark('processing.find_crystals', lambda: find_crystals(inputs.image, magnification=2500))
+    yield Benchmark('processing.imreg_translation', lambda: imreg.translation(inputs.image, inputs.shifted))
+
+
+def serve(module, server, target) -> int:
+    """Start the server thread, and handle connections on a free port of the
+    loopback interface with `module.handle(conn, target)`, returns the port
+    number."""
+    server.daemon = True
+    server.start()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    s.listen(5)
+
+    def accept():
+        while True:
+            conn, addr = s.accept()
+            threading.Thread(target=module.handle, args=(conn, target), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    return s.getsockname()[1]
+
+
+def bench_tem_server(inputs: Inputs, tmp: Path):
+    """Round trips to the TEM server, responses are not cached."""
+    from instamatic.server import tem_server
+    from instamatic.TEMController import microscope_client
+
+    q = queue.PriorityQueue()
+    dispatcher = tem_server.Dispatcher(q, ttl=0)
+    port = serve(tem_server, tem_server.TemServer(q=q), dispatcher)
+
+    host_port = microscope_client.HOST, microscope_client.PORT
+    microscope_client.HOST, microscope_client.PORT = 'localhost', port
+    try:
+        tem = microscope_client.MicroscopeClient(name=config.microscope.name)
+    finally:
+        microscope_client.HOST, microscope_client.PORT = host_port
+
+    try:
+        calls = [(f'get{name}', ()) for name in ('StagePosition', 'BeamShift', 'BeamTilt', 'DiffShift', 'ImageShift1',
+                                                 'ImageShift2', 'Brightness', 'Magnification', 'FunctionMode', 'SpotSize')]
+
+        yield Benchmark('tem_server.getStagePosition', tem.getStagePosition, number=100)
+        yield Benchmark('tem_server.setSpotSize', lambda: tem.setSpotSize(3), number=100)
+        yield Benchmark('tem_server.batch_10', lambda: tem.batch(calls), number=100)
+        yield Benchmark('tem_server.sequential_10', lambda: [getattr(tem, func_name)() for func_name, args in calls], number=10)
+    finally:
+        tem.s.close()
+
+
+def bench_cam_server(inputs: Inputs, tmp: Path):
+    """Round trips to the camera server, the images are sent over the
+    socket."""
+    from instamatic.camera import camera_client
+    from instamatic.server import cam_server
+
+    use_shared_memory = config.settings.cam_use_shared_memory
+    config.settings.cam_use_shared_memory = False
+
+    q = queue.Queue(maxsize=100)
+    port = serve(cam_server, cam_server.CamServer(q=q), q)
+
+    host_port = camera_client.HOST, camera_client.PORT
+    camera_client.HOST, camera_client.PORT = 'localhost', port
+    try:
+        cam = camera_client.CamClient(name=config.camera.name, interface='simulate')
+    finally:
+        camera_client.HOST, camera_client.PORT = host_port
+        config.settings.cam_use_shared_memory = use_shared_memory
+
+    try:
+        xres, yres = cam.getImageDimensions()
+        nbytes = xres * yres * 2
+
+        yield Benchmark('cam_server.getImageDimensions', cam.getImageDimensions, number=100)
+        yield Benchmark('cam_server.getImage', lambda: cam.getImage(exposure=0.001, binsize=1), number=10, nbytes=nbytes)
+    finally:
+        cam.s.close()
+
+
+GROUPS = {
+    'formats': bench_formats,
+    'serializer': bench_serializer,
+    'imgconversion': bench_imgconversion,
+    'processing': bench_processing,
+    'tem_server': bench_tem_server,
+    'cam_server': bench_cam_server,
+}
+
+
+def run(groups: list = None, repeat: int = 5, inputs: Inputs = None, verbose: bool = True) -> dict:
+    """Run the benchmark `groups` (all if None), returns the results as a
+    dict with the keys `meta` (machine and package versions) and `results`
+    (timings per benchmark). A benchmark that raises an exception is
+    recorded with the `error` instead of the timings."""
+    groups = groups or list(GROUPS)
+    for group in groups:
+        if group not in GROUPS:
+            raise ValueError(f'No such benchmark group: `{group}` (choose from {", ".join(GROUPS)})')
+
+    if inputs is None:
+        inputs = Inputs()
+
+    results = {}
+
+    # the servers must not connect to the hardware
+    simulate = config.settings.simulate
+    config.settings.simulate = True
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for group in groups:
+                benchmarks = GROUPS[group](inputs, Path(tmp))
+                while True:
+                    try:
+                        bench = next(benchmarks)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        logger.warning('Benchmark group %s failed: %r', group, e)
+                        results[group] = {'group': group, 'error': repr(e)}
+                        break
+
+                    try:
+                        result = measure(bench.func, repeat=repeat, number=bench.number)
+                    except Exception as e:
+                        logger.debug('Benchmark %s failed: %r', bench.name, e)
+                        result = {'error': repr(e)}
+                    else:
+                        if bench.nbytes:
+                            result['nbytes'] = bench.nbytes
+                            result['MB/s'] = bench.nbytes / result['median'] / 1e6
+
+                    results[bench.name] = {'group': group, **result}
+                    if verbose:
+                        print_result(bench.name, results[bench.name])
+    finally:
+        config.settings.simulate = simulate
+
+    meta = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'instamatic': __version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'repeat': repeat,
+        'shape': inputs.diff[0].shape,
+    }
+
+    return {'meta': meta, 'results': results}
+
+
+def print_result(name: str, result: dict) -> None:
+    if 'error' in result:
+        print(f'{name:45s} error: {result["error"]}')
+        return
+    line = f'{name:45s} {result["median"] * 1e3:10.3f} ms ± {result["std"] * 1e3:8.3f} ms'
+    if 'MB/s' in result:
+        line += f' {result["MB/s"]:10.1f} MB/s'
+    print(line)
+
+
+def compare(baseline: dict, results: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """Compare the median timings of `results` to those of `baseline` (both
+    as returned by `run`), returns a list of (name, baseline, current,
+    ratio) for the benchmarks in both runs. Benchmarks that are more than
+    `threshold` times slower are logged as regressions."""
+    old = baseline['results']
+    new = results['results']
+
+    rows = []
+    for name, result in new.items():
+        if name not in old or 'median' not in result or 'median' not in old[name]:
+            continue
+        ratio = result['median'] / old[name]['median']
+        rows.append((name, old[name]['median'], result['median'], ratio))
+        if ratio > threshold:
+            logger.warning('Regression in %s: %.3f ms -> %.3f ms (x%.2f)', name, old[name]['median'] * 1e3, result['median'] * 1e3, ratio)
+
+    return rows
+
+
+def print_comparison(rows: list, threshold: float = REGRESSION_THRESHOLD) -> None:
+    print(f'\n{"benchmark":45s} {"baseline":>12s} {"current":>12s} {"ratio":>8s}')
+    for name, old, new, ratio in rows:
+        flag = '  slower' if ratio > threshold else '  faster' if ratio < 1 / threshold else ''
+        print(f'{name:45s} {old * 1e3:9.3f} ms {new * 1e3:9.3f} ms {ratio:8.2f}{flag}')
+
+
+def main_entry():
+    import argparse
+
+    description = """Benchmark the image formats, serializers, data conversion, image processing, and the TEM/camera servers (over the loopback interface, with the simulated microscope and camera). The timings are written to a json file, which can be compared to the results of an earlier run to find regressions."""
+
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-o', '--output',
+                        action='store', type=str, dest='output',
+                        help='Write the results to this json file (default: `benchmark.json`).')
+
+    parser.add_argument('-g', '--group',
+                        action='append', type=str, dest='groups', choices=list(GROUPS),
+                        help='Run only this group of benchmarks, can be given multiple times.')
+
+    parser.add_argument('-r', '--repeat',
+                        action='store', type=int, dest='repeat',
+                        help='Number of timings per benchmark (default: 5).')
+
+    parser.add_argument('-c', '--compare',
+                        action='store', type=str, dest='baseline',
+                        help='Compare the results to this earlier run (json file).')
+
+    parser.set_defaults(output='benchmark.json',
+                        groups=None,
+                        repeat=5,
+                        baseline=None)
+
+    options = parser.parse_args()
+
+    results = run(groups=options.groups, repeat=options.repeat)
+
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent=2, default=float)
+    print(f'\nResults written to {options.output}')
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        print_comparison(compare(baseline, results))
+
+
+if __name__ == '__main__':
+    main_entry()
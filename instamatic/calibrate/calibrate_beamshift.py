@@ -5,13 +5,13 @@ import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
-from skimage.registration import phase_cross_correlation
 
 from .filenames import *
 from .fit import fit_affine_transformation
 from instamatic import config
 from instamatic.image_utils import autoscale
 from instamatic.image_utils import imgscale
+from instamatic.imreg import ImageRegistration
 from instamatic.processing.find_holes import find_holes
 from instamatic.tools import find_beam_center
 from instamatic.tools import printer
@@ -151,6 +151,7 @@ def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=Fal
     print(f'Gridsize: {gridsize} | Stepsize: {stepsize:.2f}')
 
     img_cent, scale = autoscale(img_cent)
+    reg = ImageRegistration(img_cent, upsample_factor=10)
 
     outfile = os.path.join(outdir, 'calib_beamcenter') if save_images else None
 
@@ -178,7 +179,7 @@ def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=Fal
         img, h = ctrl.get_image(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys='BeamShift')
         img = imgscale(img, scale)
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift, error, phasediff = reg.register(img)
 
         beamshift = np.array(h['BeamShift'])
         beampos.append(beamshift)
@@ -222,6 +223,7 @@ def calibrate_beamshift_from_image_fn(center_fn, other_fn):
     beamshift_cent = np.array(h_cent['BeamShift'])
 
     img_cent, scale = autoscale(img_cent, maxdim=512)
+    reg = ImageRegistration(img_cent, upsample_factor=10)
 
     binsize = h_cent['ImageBinsize']
 
@@ -243,7 +245,7 @@ def calibrate_beamshift_from_image_fn(center_fn, other_fn):
         print('Image:', fn)
         print('Beamshift: x={} | y={}'.format(*beamshift))
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift, error, phasediff = reg.register(img)
 
         beampos.append(beamshift)
         shifts.append(shift)
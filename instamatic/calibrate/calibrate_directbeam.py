@@ -5,13 +5,13 @@ import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
-from skimage.registration import phase_cross_correlation
 
 from .filenames import *
 from .fit import fit_affine_transformation
 from instamatic import config
 from instamatic.image_utils import autoscale
 from instamatic.image_utils import imgscale
+from instamatic.imreg import ImageRegistration
 from instamatic.tools import printer
 logger = logging.getLogger(__name__)
 
@@ -22,9 +22,22 @@ refine_params = {
 }
 
 
-def optimize_diffraction_focus(ctrl, steps=(50, 15, 5)):
+def optimize_diffraction_focus(ctrl, steps=(50, 15, 5), method='model', **kwargs):
     """Function to optimize the diffraction focus live on the microscope It
-    does so by minimizing the halfwidth of the primary beam."""
+    does so by minimizing the halfwidth of the primary beam.
+
+    With `method='model'`, the focus is found by fitting the beam size
+    around the direct beam (see `optimize_focus.FocusOptimizer`), starting
+    with the first step size and stopping at the last one. Keyword
+    arguments are passed to the optimizer. With `method='sweep'`, 11
+    images are taken for every step size.
+    """
+    if method == 'model':
+        from .optimize_focus import FocusOptimizer
+        result = FocusOptimizer(ctrl, step=steps[0], tolerance=steps[-1], **kwargs).optimize()
+        return result.focus
+    elif method != 'sweep':
+        raise ValueError(f'Unknown method: {method!r}')
 
     for step in steps:
         current = ctrl.difffocus.value
@@ -215,6 +228,7 @@ def calibrate_directbeam_live(ctrl, key='DiffShift', gridsize=None, stepsize=Non
     x_cent, y_cent = readout_cent = np.array(h_cent[key])
 
     img_cent, scale = autoscale(img_cent)
+    reg = ImageRegistration(img_cent, upsample_factor=10)
 
     print('{}: x={} | y={}'.format(key, *readout_cent))
 
@@ -238,7 +252,7 @@ def calibrate_directbeam_live(ctrl, key='DiffShift', gridsize=None, stepsize=Non
         img, h = ctrl.get_image(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys=key)
         img = imgscale(img, scale)
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift, error, phasediff = reg.register(img)
 
         readout = np.array(h[key])
         readouts.append(readout)
@@ -269,6 +283,7 @@ def calibrate_directbeam_from_file(center_fn, other_fn, key='DiffShift'):
     readout_cent = np.array(h_cent[key])
 
     img_cent, scale = autoscale(img_cent, maxdim=512)
+    reg = ImageRegistration(img_cent, upsample_factor=10)
 
     binsize = h_cent['ImageBinsize']
 
@@ -287,7 +302,7 @@ def calibrate_directbeam_from_file(center_fn, other_fn, key='DiffShift'):
         print('Image:', fn)
         print('{}: dx={} | dy={}'.format(key, *readout))
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift, error, phasediff = reg.register(img)
 
         readouts.append(readout)
         shifts.append(shift)
@@ -1,10 +1,10 @@
 import logging
 
 import numpy as np
-from skimage.registration import phase_cross_correlation
 from tqdm.auto import tqdm
 
 from instamatic.calibrate.fit import fit_affine_transformation
+from instamatic.imreg import ImageRegistration
 logger = logging.getLogger(__name__)
 
 
@@ -47,6 +47,7 @@ def Calibrate_Imageshift(ctrl, diff_defocus, stepsize, logger, key='IS1'):
         scaling = False
 
     img_cent, h_cent = ctrl.get_image(exposure=0.01, comment='Beam in center of image')
+    reg = ImageRegistration(img_cent, upsample_factor=10)
 
     shifts = []
     imgpos = []
@@ -57,7 +58,7 @@ def Calibrate_Imageshift(ctrl, diff_defocus, stepsize, logger, key='IS1'):
             deflector.set(x=x0 + (i - 2) * stepsize, y=y0 + (j - 2) * stepsize)
             img, h = ctrl.get_image(exposure=0.01, comment='imageshifted image')
 
-            shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+            shift, error, phasediff = reg.register(img)
             imgshift = np.array(((i - 2) * stepsize, (j - 2) * stepsize))
             imgpos.append(imgshift)
             shifts.append(shift)
@@ -4,13 +4,13 @@ import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
-from skimage.registration import phase_cross_correlation
 
 from .filenames import *
 from .fit import fit_affine_transformation
 from instamatic.formats import read_image
 from instamatic.image_utils import autoscale
 from instamatic.image_utils import imgscale
+from instamatic.imreg import ImageRegistration
 logger = logging.getLogger(__name__)
 
 
@@ -239,6 +239,7 @@ def calibrate_stage_lowmag_live(ctrl, gridsize=5, stepsize=50000, save_images=Fa
     xy_cent = np.array([x_cent, y_cent])
 
     img_cent, scale = autoscale(img_cent)
+    reg = ImageRegistration(img_cent, upsample_factor=10)
 
     stagepos = []
     shifts = []
@@ -262,7 +263,7 @@ def calibrate_stage_lowmag_live(ctrl, gridsize=5, stepsize=50000, save_images=Fa
 
         img = imgscale(img, scale)
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift, error, phasediff = reg.register(img)
 
         xobs, yobs, _, _, _ = h['StagePosition']
         stagepos.append((xobs, yobs))
@@ -310,6 +311,7 @@ def calibrate_stage_lowmag_from_image_fn(center_fn, other_fn):
     img_cent, h_cent = read_image(center_fn)
 
     img_cent, scale = autoscale(img_cent, maxdim=512)
+    reg = ImageRegistration(img_cent, upsample_factor=10)
 
     x_cent, y_cent, _, _, _ = h_cent['StagePosition']
     xy_cent = np.array([x_cent, y_cent])
@@ -332,7 +334,7 @@ def calibrate_stage_lowmag_from_image_fn(center_fn, other_fn):
         print(f'Stageposition: x={xobs:.0f} | y={yobs:.0f}')
         print()
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift, error, phasediff = reg.register(img)
 
         stagepos.append((xobs, yobs))
         shifts.append(shift)
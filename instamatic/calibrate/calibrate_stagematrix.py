@@ -4,13 +4,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 import yaml
 from scipy import stats
-from skimage.registration import phase_cross_correlation
 
 from instamatic import config
 from instamatic.calibrate.fit import fit_affine_transformation
 from instamatic.formats import read_tiff
 from instamatic.formats import write_tiff
 from instamatic.image_utils import rotate_image
+from instamatic.imreg import ImageRegistration
 from instamatic.io import get_new_work_subdirectory
 
 np.set_printoptions(suppress=True)
@@ -39,10 +39,19 @@ def get_outlier_filter(data, threshold: float = 2.0) -> list:
 
 
 def cross_correlate_image_pairs(pairs: tuple) -> list:
-    """Cross correlate image pairs."""
+    """Cross correlate image pairs.
+
+    When the pairs are chained (the second image of a pair is the first
+    image of the next pair), its spectrum is reused as the reference.
+    """
     translations = []
+    reg = None
     for img0, img1 in pairs:
-        translation, error, phasediff = phase_cross_correlation(img0, img1, upsample_factor=10)
+        if reg is None:
+            reg = ImageRegistration(img0, upsample_factor=10)
+        elif img0 is not reg.reference:
+            reg.set_reference(img0)
+        translation, error, phasediff = reg.register(img1)
         print(f'shift {translation} error {error:.4f} phasediff {phasediff:.4f}')
         translations.append(translation)
     return translations
@@ -0,0 +1,205 @@
+"""Model-based optimization of the diffraction focus.
+
+The area of the direct beam above half its maximum is proportional to
+the squared width of the beam, which depends quadratically on the
+defocus: w^2 = w0^2 + k^2 (f - f0)^2. The optimizer brackets the
+minimum of this score, and then refines it by fitting a parabola to the
+measurements around the best point, falling back to a golden-section
+step if the fit is not usable. Measurements are cached, and the score
+is calculated on a small region around the direct beam, so the focus
+is found in a handful of exposures.
+
+Usage:
+    result = FocusOptimizer(ctrl, step=50, tolerance=5).optimize()
+    print(result.focus, result.n_exposures)
+"""
+import logging
+from collections import namedtuple
+
+import numpy as np
+from scipy import ndimage
+
+logger = logging.getLogger(__name__)
+
+GOLDEN = (3 - 5**0.5) / 2  # fraction of the interval for a golden-section step
+
+FocusResult = namedtuple('FocusResult', ['focus', 'score', 'n_exposures', 'history'])
+FocusResult.__doc__ = """Result of the focus optimization: the best `focus`, its
+(measured or modeled) `score`, the number of exposures taken, and the
+`history` of (focus, score) measurements in the order they were taken."""
+
+
+def halfmax_area(img) -> int:
+    """Number of pixels above half the maximum (above the background),
+    proportional to the squared width of the direct beam. The image is
+    smoothed to make the maximum robust against noise."""
+    img = ndimage.gaussian_filter(img.astype(float), sigma=1)
+    background = np.median(img)
+    return int(np.sum(img - background > (img.max() - background) / 2))
+
+
+def beam_roi(img, size: int = 64) -> tuple:
+    """Return the slices for a square region of `size` pixels centered on
+    the direct beam (the maximum of the smoothed image)."""
+    smooth = ndimage.uniform_filter(img.astype(float), size=5)
+    row, col = np.unravel_index(np.argmax(smooth), img.shape)
+    half = size // 2
+    r0 = int(np.clip(row - half, 0, max(img.shape[0] - size, 0)))
+    c0 = int(np.clip(col - half, 0, max(img.shape[1] - size, 0)))
+    return slice(r0, r0 + size), slice(c0, c0 + size)
+
+
+def fit_parabola(x, y) -> tuple:
+    """Least-squares fit of y = a x^2 + b x + c, returns the position and
+    value of the vertex, or None if the parabola opens downwards."""
+    x = np.asarray(x, dtype=float)
+    x0 = x.mean()  # center for numerical stability
+    a, b, c = np.polyfit(x - x0, y, 2)
+    if a <= 0:
+        return None
+    xv = -b / (2 * a)
+    return xv + x0, c - b**2 / (4 * a)
+
+
+class FocusOptimizer:
+    """Find the diffraction focus that minimizes the size of the direct
+    beam.
+
+    ctrl: `TEMController`
+        The microscope must be in diffraction mode, with the direct beam
+        visible on the camera (not behind the beamstop)
+    step: int
+        Initial step size of the diffraction focus
+    tolerance: int
+        Stop when the minimum is bracketed within this distance
+    roi: int
+        Size of the region around the direct beam used for scoring, the
+        full image is used if None
+    exposure, binsize:
+        Passed to `ctrl.get_image`
+    max_exposures: int
+        Maximum number of images to take
+    score: callable
+        Function that scores an image (lower is better), defaults to the
+        area above half maximum
+    """
+
+    def __init__(self, ctrl,
+                 step: int = 50,
+                 tolerance: int = 5,
+                 roi: int = 64,
+                 exposure: float = None,
+                 binsize: int = None,
+                 max_exposures: int = 12,
+                 score=halfmax_area,
+                 ):
+        super().__init__()
+        self.ctrl = ctrl
+        self.step = step
+        self.tolerance = tolerance
+        self.roi = roi
+        self.exposure = exposure
+        self.binsize = binsize
+        self.max_exposures = max_exposures
+        self.score = score
+
+        self.scores = {}
+        self.history = []
+        self._roi = None
+
+    def measure(self, focus: int) -> float:
+        """Set the diffraction focus and score the image, measurements are
+        cached."""
+        focus = int(round(focus))
+        if focus in self.scores:
+            return self.scores[focus]
+
+        self.ctrl.difffocus.set(focus)
+        img, h = self.ctrl.get_image(exposure=self.exposure, binsize=self.binsize, header_keys=None)
+
+        if self.roi:
+            if self._roi is None:
+                self._roi = beam_roi(img, size=self.roi)
+            img = img[self._roi]
+
+        score = self.score(img)
+        self.scores[focus] = score
+        self.history.append((focus, score))
+        logger.debug('Diffraction focus %d: score %s', focus, score)
+        return score
+
+    def _sorted(self) -> tuple:
+        xs = np.array(sorted(self.scores))
+        ys = np.array([self.scores[x] for x in xs])
+        return xs, ys
+
+    def _exhausted(self) -> bool:
+        return len(self.scores) >= self.max_exposures
+
+    def bracket(self, start: int) -> None:
+        """Measure around `start`, and walk downhill with growing steps until
+        the lowest score lies between two measurements."""
+        for focus in (start, start - self.step, start + self.step):
+            self.measure(focus)
+
+        while not self._exhausted():
+            xs, ys = self._sorted()
+            best = int(np.argmin(ys))
+            if 0 < best < len(xs) - 1:
+                break
+            if best == 0:
+                new = xs[0] - (xs[1] - xs[0]) * (1 + GOLDEN) / (1 - GOLDEN)
+            else:
+                new = xs[-1] + (xs[-1] - xs[-2]) * (1 + GOLDEN) / (1 - GOLDEN)
+            self.measure(new)
+
+    def refine(self) -> tuple:
+        """Narrow down the bracketed minimum using parabolic fits, returns
+        the modeled position and score of the minimum."""
+        while True:
+            xs, ys = self._sorted()
+            best = int(np.argmin(ys))
+            lo = xs[max(best - 1, 0)]
+            hi = xs[min(best + 1, len(xs) - 1)]
+
+            sel = slice(max(best - 2, 0), best + 3)
+            vertex = fit_parabola(xs[sel], ys[sel]) if len(xs[sel]) >= 3 else None
+
+            if hi - lo <= 2 * self.tolerance or self._exhausted():
+                break
+
+            new = None
+            if vertex is not None and lo < vertex[0] < hi:
+                new = int(round(vertex[0]))
+                if abs(new - xs[best]) <= self.tolerance:
+                    break  # the model agrees with the best measurement
+
+            if new is None or new in self.scores:
+                # golden-section step into the larger half of the bracket
+                if xs[best] - lo > hi - xs[best]:
+                    new = int(round(xs[best] - GOLDEN * (xs[best] - lo)))
+                else:
+                    new = int(round(xs[best] + GOLDEN * (hi - xs[best])))
+                if new in self.scores:
+                    break
+
+            self.measure(new)
+
+        if vertex is not None and lo <= vertex[0] <= hi:
+            return vertex
+        return xs[best], ys[best]
+
+    def optimize(self, start: int = None) -> FocusResult:
+        """Find the best diffraction focus starting from `start` (the
+        current value if None), and set it on the microscope."""
+        if start is None:
+            start = self.ctrl.difffocus.value
+
+        self.bracket(int(start))
+        focus, score = self.refine()
+        focus = int(round(focus))
+
+        self.ctrl.difffocus.set(focus)
+        logger.info('Optimized diffraction focus: %d (score: %.1f, %d exposures)', focus, score, len(self.scores))
+
+        return FocusResult(focus, score, len(self.scores), list(self.history))
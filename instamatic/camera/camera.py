@@ -14,7 +14,11 @@ def get_cam(interface: str = None):
 
     simulate = config.settings.simulate
 
-    if simulate or interface == 'simulate':
+    if interface == 'synthetic':
+        from instamatic.camera.camera_synthetic import CameraSynthetic as cam
+    elif interface == 'replay':
+        from instamatic.camera.camera_replay import CameraReplay as cam
+    elif simulate or interface == 'simulate':
         from instamatic.camera.camera_simu import CameraSimu as cam
     elif interface == 'simulateDLL':
         from instamatic.camera.camera_gatan import CameraDLL as cam
@@ -48,7 +52,7 @@ def Camera(name: str = None, as_stream: bool = False, use_server: bool = False):
     if use_server:
         from instamatic.camera.camera_client import CamClient
         cam = CamClient(name=name, interface=interface)
-        as_stream = False  # precaution
+        as_stream = as_stream and cam.streamable  # streams through shared memory only
     else:
         cam_cls = get_cam(interface)
 
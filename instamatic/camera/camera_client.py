@@ -4,19 +4,20 @@ import subprocess as sp
 import time
 from functools import wraps
 
-import numpy as np
-
 from instamatic import config
 from instamatic.exceptions import exception_list
+from instamatic.exceptions import TEMCommunicationError
+from instamatic.server.framing import recv_message
+from instamatic.server.framing import send_message
 from instamatic.server.serializer import pickle_dumper as dumper
 from instamatic.server.serializer import pickle_loader as loader
 
 if config.settings.cam_use_shared_memory:
-    from multiprocessing import shared_memory
+    from instamatic.server.ringbuffer import FrameOverwrittenError
+    from instamatic.server.ringbuffer import RingBuffer
 
 HOST = config.settings.cam_server_host
 PORT = config.settings.cam_server_port
-BUFSIZE = 4096
 
 
 class ServerError(Exception):
@@ -51,8 +52,6 @@ class CamClient:
 
         self.name = name
         self.interface = interface
-        self._bufsize = BUFSIZE
-        self.streamable = False  # overrides cam settings
         self.verbose = False
 
         try:
@@ -75,18 +74,18 @@ class CamClient:
         self.use_shared_memory = config.settings.cam_use_shared_memory and self.is_local_connection
         print('Use shared memory:', self.use_shared_memory)
 
-        self.buffers = {}
-        self.shms = {}
+        # frames can be streamed through the shared memory ring buffer
+        self.streamable = self.use_shared_memory  # overrides cam settings
+
+        self.rings = {}
+        self._stream = None
+        self._stream_seq = 0
 
         self._init_dict()
         self._init_attr_dict()
 
         atexit.register(self.s.close)
 
-        xres, yres = self.getImageDimensions()
-        bitdepth = 4
-        self._imagebufsize = bitdepth * xres * yres + self._bufsize
-
     @property
     def is_local_connection(self):
         """Check if the socket connection is a local connection."""
@@ -118,17 +117,19 @@ class CamClient:
 
     def _eval_dct(self, dct):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'."""
-        self.s.send(dumper(dct))
+        send_message(self.s, dct, dumper)
 
         acquiring_image = dct['attr_name'] == 'getImage'
 
-        if acquiring_image and not self.use_shared_memory:
-            response = self.s.recv(self._imagebufsize)
-        else:
-            response = self.s.recv(self._bufsize)
+        response, arr = recv_message(self.s, loader)
 
-        if response:
-            status, data = loader(response)
+        if response is None:
+            raise TEMCommunicationError('Connection to the camera server was closed')
+
+        status, data = response
+
+        if arr is not None:
+            data = arr
 
         if self.use_shared_memory and acquiring_image:
             data = self.get_data_from_shared_memory(**data)
@@ -151,6 +152,8 @@ class CamClient:
 
         self._dct = {key: value for key, value in cam.__dict__.items() if not key.startswith('_')}
         self._dct['get_attrs'] = None
+        self._dct['start_streaming'] = None
+        self._dct['stop_streaming'] = None
 
     def _init_attr_dict(self):
         """Get list of attrs and their types."""
@@ -159,29 +162,82 @@ class CamClient:
     def __dir__(self):
         return tuple(self._dct.keys()) + tuple(self._attr_dct.keys())
 
-    def get_data_from_shared_memory(self, name: str, shape: tuple, dtype: str, **kwargs):
-        """Grab image data from shared buffer."""
-        dtype = getattr(np, dtype)
-
-        # Initialize shared memory object
-        if name not in self.shms:
-            shm = shared_memory.SharedMemory(name=name)
-            self.shms[name] = shm
+    def get_ring(self, name: str):
+        """Attach to the shared memory ring buffer `name`."""
+        if name not in self.rings:
             if self.verbose:
-                print('Read shared memory: `{name}`')
-
-        # Initialize shared memory buffer
-        if name not in self.buffers:
-            if self.verbose:
-                print(f'Connect to buffer: `{name}` | {shape} ({dtype})')
-            shm = self.shms[name]
-            self.buffers[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
-
-        # Copy data from shared image buffer
+                print(f'Attach to ring buffer: `{name}`')
+            self.rings[name] = RingBuffer.attach(name)
+        return self.rings[name]
+
+    def get_data_from_shared_memory(self, name: str, seq: int, copy: bool = True, **kwargs):
+        """Grab image `seq` from the shared ring buffer `name`.
+
+        The data are copied out of the buffer by default. The copy is
+        checked against the sequence number, so that a frame that is
+        overwritten in the meantime raises `FrameOverwrittenError` rather
+        than returning a torn image.
+        """
         if self.verbose:
-            print(f'Retrieve data from buffer `{name}`')
+            print(f'Retrieve frame {seq} from buffer `{name}`')
 
-        buffer = self.buffers[name]
-        data = buffer[:]
+        ring = self.get_ring(name)
+        data, seq, timestamp = ring.read(seq, copy=copy)
 
         return data
+
+    def start_streaming(self, exposure: float = None, binsize: int = None):
+        """Start continuous acquisition on the server side, frames are
+        retrieved from shared memory with `get_next_frame`."""
+        if not self.use_shared_memory:
+            raise RuntimeError('Streaming requires a local connection with `cam_use_shared_memory`')
+
+        dct = {'attr_name': 'start_streaming',
+               'kwargs': {'exposure': exposure, 'binsize': binsize}}
+        info = self._eval_dct(dct)
+
+        self._stream = self.get_ring(info['name'])
+        self._stream_seq = info['seq'] - 1
+
+    def stop_streaming(self):
+        """Stop continuous acquisition on the server side."""
+        self._eval_dct({'attr_name': 'stop_streaming'})
+        self._stream = None
+
+    def get_next_frame(self, timeout: float = None, copy: bool = False):
+        """Return the next frame from the stream without going through the
+        socket, or `None` if no frame arrives within `timeout` seconds.
+
+        Frames that have been overwritten in the meantime are skipped.
+        If `copy` is False, a view into the ring buffer is returned,
+        which is valid until the server has written `n_slots` more
+        frames (check with `is_frame_valid`). If the server replaces the
+        ring buffer (e.g. for larger frames), the stream continues from
+        the new buffer.
+        """
+        ring = self._stream
+        if ring is None:
+            raise RuntimeError('Stream has not been started, call `start_streaming` first')
+
+        while not ring.wait(self._stream_seq + 1, timeout=timeout):
+            if not ring.successor:
+                return None
+            ring = self._stream = self.get_ring(ring.successor)
+            self._stream_seq = 0
+
+        seq = max(self._stream_seq + 1, ring.latest - ring.n_slots + 2)
+        while True:
+            try:
+                data, seq, timestamp = ring.read(seq, copy=copy)
+            except FrameOverwrittenError:
+                seq = ring.latest
+            else:
+                break
+
+        self._stream_seq = seq
+        return data
+
+    def is_frame_valid(self) -> bool:
+        """Check whether the last frame returned by `get_next_frame` is still
+        intact in the ring buffer."""
+        return self._stream is not None and self._stream.is_valid(self._stream_seq)
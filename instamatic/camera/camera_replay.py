@@ -0,0 +1,18 @@
+import logging
+
+from instamatic.TEMController.recording import ReplayBackend
+logger = logging.getLogger(__name__)
+
+
+class CameraReplay(ReplayBackend):
+    """Camera interface replaying a recording, see
+    `instamatic.TEMController.recording`."""
+
+    device = 'cam'
+
+    def __init__(self, name='replay', path=None, time_scale=None):
+        """Initialize camera module."""
+        super().__init__(name=name, path=path, time_scale=time_scale)
+
+        # frames are only returned for recorded calls, so do not start a live stream
+        self.streamable = False
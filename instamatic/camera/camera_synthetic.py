@@ -0,0 +1,336 @@
+import logging
+import time
+
+import numpy as np
+
+from .camera_simu import CameraSimu
+from instamatic import config
+
+logger = logging.getLogger(__name__)
+
+# Crystals are generated per square tile of the stage (nm), so that the
+# sample is the same wherever (and in whatever order) the stage goes
+TILE_SIZE = 10_000
+
+
+def rotation_matrix(axis, angle: float) -> np.ndarray:
+    """Rotation matrix for a rotation of `angle` (radians) around `axis`."""
+    u = np.asarray(axis, dtype=float)
+    u = u / np.linalg.norm(u)
+    ux = np.array([[0, -u[2], u[1]],
+                   [u[2], 0, -u[0]],
+                   [-u[1], u[0], 0]])
+    return np.cos(angle) * np.eye(3) + np.sin(angle) * ux + (1 - np.cos(angle)) * np.outer(u, u)
+
+
+def random_rotation(rng) -> np.ndarray:
+    """Uniformly distributed random rotation matrix."""
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q = q * np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] = -q[:, 0]
+    return q
+
+
+def add_spots(img, rows, cols, heights, sigma: float, size: int = 3) -> None:
+    """Add gaussian spots at the subpixel positions (rows, cols) to `img`
+    in place."""
+    offsets = np.arange(-size, size + 1)
+    r0 = np.round(rows).astype(int)
+    c0 = np.round(cols).astype(int)
+
+    rr = r0[:, None, None] + offsets[None, :, None]
+    cc = c0[:, None, None] + offsets[None, None, :]
+    patch = np.exp(-((rr - rows[:, None, None])**2 + (cc - cols[:, None, None])**2) / (2 * sigma**2))
+    patch *= heights[:, None, None]
+
+    rr, cc = np.broadcast_arrays(rr, cc)
+    inside = (rr >= 0) & (rr < img.shape[0]) & (cc >= 0) & (cc < img.shape[1])
+    np.add.at(img, (rr[inside], cc[inside]), patch[inside])
+
+
+class CameraSynthetic(CameraSimu):
+    """Camera that renders synthetic, reproducible images from the state of
+    the (simulated) microscope, to benchmark the data collection and
+    processing pipelines without hardware.
+
+    In diffraction mode, it renders the direct beam (moved by the
+    diffraction shift), a beamstop, and the Bragg spots of a single crystal
+    that rotate with the stage alpha angle. The beam and the spots are
+    blurred when the diffraction focus is away from the best focus, which
+    lies within `focus_range` of the focus of the first diffraction
+    frame. In imaging mode, it renders
+    dark blob-like crystals at fixed positions on the stage, see
+    `CameraSynthetic.crystals`.
+
+    All randomness is derived from `seed`, so that the same stage position
+    and frame number give the same image. The parameters below are the
+    defaults, and can be overridden in the camera config file.
+    """
+
+    seed = 0
+    frame_rate = None  # maximum frames per second, the exposure time only if None
+    counts = 100_000.0  # counts / s in the direct beam maximum
+
+    # diffraction
+    unit_cell = None  # orthorhombic (a, b, c) in Ångström, random if None
+    dmin = 0.8  # Ångström
+    b_factor = 2.0
+    excitation_error = 0.005  # Ångström^-1
+    spot_sigma = 1.2  # pixels
+    diffshift_scale = 0.002  # pixels / diffshift unit
+    beamstop = True
+    beamstop_radius = 12  # pixels
+    beamstop_transmission = 0.001
+    focus_blur = 0.05  # pixels / diffraction focus unit
+    focus_range = 200  # diffraction focus units
+
+    # imaging
+    crystal_density = 0.2  # crystals / um^2
+    crystal_size = (0.5, 2.0)  # diameter range in um
+    crystal_transmission = 0.3
+
+    def __init__(self, name='synthetic', tem=None):
+        """Initialize camera module."""
+        super().__init__(name=name)
+
+        self.tem = None
+        self._frame_index = 0
+        self._diffshift_ref = (0, 0)
+
+        rng = np.random.default_rng(self.seed)
+        if self.unit_cell is None:
+            self.unit_cell = tuple(rng.uniform(5.0, 20.0, size=3))
+        self.orientation = random_rotation(rng)
+        self.reflections, self.structure_factors = self._make_reflections(rng)
+        self._focus_offset = rng.uniform(-self.focus_range, self.focus_range)
+        self.best_focus = None
+
+        if tem is not None:
+            self.attach_microscope(tem)
+
+    def attach_microscope(self, tem) -> None:
+        """Render the images from the state of `tem`. The current
+        diffraction shift puts the direct beam behind the beamstop."""
+        self.tem = tem
+        self._diffshift_ref = tem.getDiffShift()
+
+    def _make_reflections(self, rng) -> tuple:
+        """Reciprocal lattice vectors (Ångström^-1) up to `dmin`, and their
+        (Wilson-distributed) squared structure factors."""
+        a, b, c = self.unit_cell
+        gmax = 1 / self.dmin
+        h, k, l_ = np.meshgrid(*(np.arange(-int(gmax * x), int(gmax * x) + 1) for x in (a, b, c)), indexing='ij')
+        g = np.stack((h.ravel() / a, k.ravel() / b, l_.ravel() / c), axis=-1)
+
+        norm = np.linalg.norm(g, axis=1)
+        sel = (norm > 0) & (norm <= gmax)
+        g, norm = g[sel], norm[sel]
+
+        f2 = rng.exponential(size=len(g)) * np.exp(-self.b_factor * norm**2 / 2)
+        return g, f2
+
+    def _state(self) -> dict:
+        """Read the state of the microscope relevant for the image."""
+        state = {'mode': 'diff', 'mag': None, 'x': 0.0, 'y': 0.0, 'alpha': 0.0, 'diffshift': self._diffshift_ref, 'focus': None, 'blanked': False}
+        if self.tem is None:
+            return state
+
+        x, y, z, a, b = self.tem.getStagePosition()
+        state.update(
+            mode=self.tem.getFunctionMode(),
+            mag=self.tem.getMagnification(),
+            x=x, y=y, alpha=a,
+            diffshift=self.tem.getDiffShift(),
+            blanked=self.tem.isBeamBlanked(),
+        )
+
+        if state['mode'] == 'diff':
+            state['focus'] = focus = self.tem.getDiffFocus()
+            if self.best_focus is None:
+                self.best_focus = int(focus + self._focus_offset)
+
+        return state
+
+    def pixelsize(self, mode: str, mag: int) -> float:
+        """Pixel size at binning 1 from the calibration (Ångström^-1 / pixel
+        in diffraction mode, nm / pixel otherwise), estimated from the
+        physical pixel size if not calibrated."""
+        try:
+            return config.calibration[mode]['pixelsize'][mag]
+        except (KeyError, TypeError):
+            if mode == 'diff':
+                return 0.005
+            return self.physical_pixelsize * 1e6 / (mag or 2500)
+
+    def beam_center(self, binsize: int = 1, diffshift: tuple = None) -> np.ndarray:
+        """Position (row, column) of the direct beam in pixels."""
+        if diffshift is None:
+            diffshift = self._state()['diffshift']
+        shape = np.array(self.getCameraDimensions()) / binsize
+        shift = (np.array(diffshift, dtype=float) - self._diffshift_ref) * self.diffshift_scale / binsize
+        return shape / 2 + shift
+
+    def reflection_positions(self, alpha: float, binsize: int = 1, mag: int = None, diffshift: tuple = None) -> tuple:
+        """Positions (row, column) in pixels and excitation errors of all
+        reflections at stage angle `alpha` (degrees)."""
+        phi = self.camera_rotation_vs_stage_xy
+        rot = rotation_matrix((np.cos(phi), np.sin(phi), 0), np.radians(alpha))
+        g = self.reflections @ (rot @ self.orientation).T
+
+        pixelsize = self.pixelsize('diff', mag) * binsize
+        center = self.beam_center(binsize=binsize, diffshift=diffshift)
+        rows = center[0] + g[:, 0] / pixelsize
+        cols = center[1] + g[:, 1] / pixelsize
+        return rows, cols, g[:, 2]
+
+    def render_diffraction(self, exposure: float, binsize: int = 1, alpha: float = 0.0, mag: int = None, diffshift: tuple = None, focus: int = None) -> np.ndarray:
+        """Render the noise-free diffraction pattern, in focus if `focus` is
+        None."""
+        shape = tuple(int(n / binsize) for n in self.getCameraDimensions())
+        scale = self.counts * exposure * binsize**2
+        center = self.beam_center(binsize=binsize, diffshift=diffshift)
+
+        rr, cc = np.ogrid[:shape[0], :shape[1]]
+        r = np.hypot(rr - center[0], cc - center[1]) * binsize
+
+        # defocus spreads the intensity of the beam and spots
+        blur = 0.0 if focus is None or self.best_focus is None else self.focus_blur * (focus - self.best_focus)
+        beam_sigma = np.hypot(3 * self.spot_sigma, blur)
+        spot_sigma = np.hypot(self.spot_sigma, blur)
+
+        # direct beam and diffuse background
+        beam = (3 * self.spot_sigma / beam_sigma)**2 * np.exp(-r**2 / (2 * beam_sigma**2))
+        img = scale * (beam + 0.01 / (1 + (r / 20)**2))
+
+        rows, cols, s = self.reflection_positions(alpha, binsize=binsize, mag=mag, diffshift=diffshift)
+        heights = 0.05 * scale * (self.spot_sigma / spot_sigma)**2 * self.structure_factors * np.exp(-(s / self.excitation_error)**2)
+        sigma = max(spot_sigma / binsize, 0.7)
+        sel = (heights > 1e-3 * scale) & (rows > -5) & (rows < shape[0] + 5) & (cols > -5) & (cols < shape[1] + 5)
+        add_spots(img, rows[sel], cols[sel], heights[sel], sigma=sigma, size=int(3 * sigma) + 1)
+
+        if self.beamstop:
+            # fixed at the center of the detector, with an arm to the edge
+            r0, c0 = shape[0] / 2, shape[1] / 2
+            radius = self.beamstop_radius / binsize
+            mask = np.hypot(rr - r0, cc - c0) < radius
+            mask |= (np.abs(rr - r0) < 0.5 * radius) & (cc > c0)
+            img[mask] *= self.beamstop_transmission
+
+        return img
+
+    def crystals(self, x0: float, x1: float, y0: float, y1: float) -> np.ndarray:
+        """Return the crystals on the stage in the area `x0`-`x1`, `y0`-`y1`
+        (nm) as an array of (x, y, diameter, aspect, angle), with x, y and
+        the diameter in nm."""
+        crystals = []
+        for i in range(int(np.floor(x0 / TILE_SIZE)), int(np.floor(x1 / TILE_SIZE)) + 1):
+            for j in range(int(np.floor(y0 / TILE_SIZE)), int(np.floor(y1 / TILE_SIZE)) + 1):
+                rng = np.random.default_rng([self.seed, i % 2**32, j % 2**32])
+                n = rng.poisson(self.crystal_density * (TILE_SIZE / 1000)**2)
+                xy = (np.array((i, j)) + rng.random((n, 2))) * TILE_SIZE
+                size = rng.uniform(*self.crystal_size, size=n) * 1000
+                aspect = rng.uniform(1.0, 2.0, size=n)
+                angle = rng.uniform(0, np.pi, size=n)
+                crystals.append(np.column_stack((xy, size, aspect, angle)))
+
+        crystals = np.vstack(crystals)
+        sel = (crystals[:, 0] >= x0) & (crystals[:, 0] < x1) & (crystals[:, 1] >= y0) & (crystals[:, 1] < y1)
+        return crystals[sel]
+
+    def crystals_in_view(self, binsize: int = 1, x: float = None, y: float = None, mode: str = None, mag: int = None) -> np.ndarray:
+        """Return the crystals in the field of view as an array of (row,
+        column, diameter, aspect, angle), with the position and diameter in
+        pixels. The stage position and magnification are read from the
+        microscope if not given."""
+        state = self._state()
+        x = state['x'] if x is None else x
+        y = state['y'] if y is None else y
+        mode = mode or state['mode']
+        mag = mag or state['mag']
+
+        shape = np.array(self.getCameraDimensions()) / binsize
+        pixelsize = self.pixelsize(mode, mag) * binsize
+        half = np.hypot(*shape) / 2 * pixelsize
+        crystals = self.crystals(x - half, x + half, y - half, y + half)
+
+        phi = self.camera_rotation_vs_stage_xy
+        rot = np.array([[np.cos(phi), -np.sin(phi)], [np.sin(phi), np.cos(phi)]])
+        pos = (crystals[:, :2] - (x, y)) @ rot.T / pixelsize + shape / 2
+
+        ret = np.column_stack((pos, crystals[:, 2] / pixelsize, crystals[:, 3], crystals[:, 4] + phi))
+        margin = ret[:, 2]
+        sel = np.all((pos > -margin[:, None]) & (pos < shape + margin[:, None]), axis=1)
+        return ret[sel]
+
+    def render_image(self, exposure: float, binsize: int = 1, x: float = 0.0, y: float = 0.0, mag: int = None, mode: str = 'mag1') -> np.ndarray:
+        """Render the noise-free image of the crystals at stage position
+        `x`, `y` (nm)."""
+        shape = tuple(int(n / binsize) for n in self.getCameraDimensions())
+        img = np.full(shape, 0.1 * self.counts * exposure * binsize**2)
+
+        for row, col, diameter, aspect, angle in self.crystals_in_view(binsize=binsize, x=x, y=y, mode=mode, mag=mag):
+            radius = diameter / 2
+            extent = int(radius * aspect) + 2
+            r0, r1 = max(int(row) - extent, 0), min(int(row) + extent + 1, shape[0])
+            c0, c1 = max(int(col) - extent, 0), min(int(col) + extent + 1, shape[1])
+            if r0 >= r1 or c0 >= c1:
+                continue
+
+            rr, cc = np.ogrid[r0:r1, c0:c1]
+            u = (rr - row) * np.cos(angle) + (cc - col) * np.sin(angle)
+            v = -(rr - row) * np.sin(angle) + (cc - col) * np.cos(angle)
+            d = np.hypot(u / aspect, v) / radius
+            inside = 1 / (1 + np.exp(np.clip((d - 1) * radius, -50, 50)))  # soft edge of about 1 pixel
+            img[r0:r1, c0:c1] *= 1 - (1 - self.crystal_transmission) * inside
+
+        return img
+
+    def render(self, exposure: float, binsize: int = 1) -> np.ndarray:
+        """Render the frame for the current state of the microscope with
+        counting noise."""
+        state = self._state()
+
+        if state['blanked']:
+            img = np.zeros(tuple(int(n / binsize) for n in self.getCameraDimensions()))
+        elif state['mode'] == 'diff':
+            img = self.render_diffraction(exposure, binsize=binsize, alpha=state['alpha'], mag=state['mag'], diffshift=state['diffshift'], focus=state['focus'])
+        else:
+            img = self.render_image(exposure, binsize=binsize, x=state['x'], y=state['y'], mag=state['mag'], mode=state['mode'])
+
+        rng = np.random.default_rng([self.seed, self._frame_index])
+        self._frame_index += 1
+
+        img = rng.poisson(img)
+        return np.clip(img, 0, self.dynamic_range).astype(np.uint16)
+
+    def getImage(self, exposure=None, binsize=None, **kwargs) -> np.ndarray:
+        """Image acquisition routine. If the exposure and binsize are not
+        given, the default values are read from the config file.
+
+        The call takes the exposure time, or the frame time if
+        `frame_rate` is set and slower.
+
+        exposure:
+            Exposure time in seconds.
+        binsize:
+            Which binning to use.
+        """
+        t0 = time.perf_counter()
+
+        if exposure is None:
+            exposure = self.default_exposure
+        if not binsize:
+            binsize = self.default_binsize
+
+        arr = self.render(exposure, binsize=binsize)
+
+        frame_time = max(exposure, 1 / self.frame_rate) if self.frame_rate else exposure
+        remaining = frame_time - (time.perf_counter() - t0)
+        if remaining > 0:
+            time.sleep(remaining)
+
+        return arr
+
+    def getCameraType(self) -> str:
+        return 'SyntheticType'
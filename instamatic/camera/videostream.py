@@ -10,6 +10,8 @@ class ImageGrabber:
     When the continousCollectionEvent is set, the camera will set the exposure to `frametime`, otherwise, the default camera exposure is used.
 
     The callback function is used to send the frame back to the parent routine.
+
+    If the camera is accessed through the camera server with shared memory, the live frames are acquired continuously by the server and read from the shared memory ring buffer, without a request per frame. These frames are views into the buffer, and remain valid until the slot is reused.
     """
 
     def __init__(self, cam, callback, frametime: float = 0.05):
@@ -35,6 +37,9 @@ class ImageGrabber:
 
         self.lock = threading.Lock()
 
+        self.use_stream = hasattr(self.cam, 'get_next_frame')
+        self.stream_kwargs = None
+
         self.stopEvent = threading.Event()
         self.acquireInitiateEvent = threading.Event()
         self.acquireCompleteEvent = threading.Event()
@@ -50,8 +55,28 @@ class ImageGrabber:
                 self.callback(frame, acquire=True)
 
             elif not self.continuousCollectionEvent.is_set():
-                frame = self.cam.getImage(exposure=self.frametime, binsize=self.binsize)
-                self.callback(frame)
+                if self.use_stream:
+                    frame = self.get_stream_frame()
+                    if frame is not None:
+                        self.callback(frame)
+                else:
+                    frame = self.cam.getImage(exposure=self.frametime, binsize=self.binsize)
+                    self.callback(frame)
+
+        if self.stream_kwargs:
+            self.cam.stop_streaming()
+
+    def get_stream_frame(self):
+        """Get the next live frame from the camera stream, (re)starts the
+        stream if the frame time or binning have changed."""
+        kwargs = {'exposure': self.frametime, 'binsize': self.binsize}
+
+        # frametime is set to 0 temporarily during acquisition
+        if kwargs != self.stream_kwargs and self.frametime > 0:
+            self.cam.start_streaming(**kwargs)
+            self.stream_kwargs = kwargs
+
+        return self.cam.get_next_frame(timeout=0.1)
 
     def start_loop(self):
         self.thread = threading.Thread(target=self.run, args=(), daemon=True)
@@ -165,6 +190,9 @@ class VideoStream(threading.Thread):
         callback: function
             This function is called on every iteration with the image as first argument
             Should return True or False if data collection is to continue
+
+        The frames are copies, and can be kept by the callback. Raises
+        TimeoutError if the camera stream stops delivering frames.
         """
         buffer = []
 
@@ -172,18 +200,31 @@ class VideoStream(threading.Thread):
         i = 0
 
         self.block()
-        while go_on:
-            i += 1
-
-            img = self.getImage(exposure=exposure)
 
-            if callback:
-                go_on = callback(img)
-            else:
-                buffer.append(img)
-                go_on = i < n
-
-        self.unblock()
+        try:
+            if self.grabber.use_stream:
+                # frames are taken from the shared memory stream
+                self.cam.start_streaming(exposure=exposure, binsize=self.grabber.binsize)
+                self.grabber.stream_kwargs = None  # restart live stream after collection
+                timeout = max(1.0, 10 * exposure)
+
+            while go_on:
+                i += 1
+
+                if self.grabber.use_stream:
+                    img = self.cam.get_next_frame(timeout=timeout, copy=True)
+                    if img is None:
+                        raise TimeoutError(f'No frame received from the camera stream in {timeout} s')
+                else:
+                    img = self.getImage(exposure=exposure)
+
+                if callback:
+                    go_on = callback(img)
+                else:
+                    buffer.append(img)
+                    go_on = i < n
+        finally:
+            self.unblock()
 
         if not callback:
             return buffer
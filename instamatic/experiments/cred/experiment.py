@@ -9,7 +9,7 @@ import numpy as np
 import instamatic
 from instamatic import config
 from instamatic.formats import write_tiff
-from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
+from instamatic.processing.ImgConversionStream import ImgConversionStream
 
 # degrees to rotate before activating data collection procedure
 ACTIVATION_THRESHOLD = 0.2
@@ -244,163 +244,164 @@ class Experiment:
         self.setup_paths()
         self.log_start_status()
 
-        buffer = []
-        image_buffer = []
-
-        if self.ctrl.mode != 'diff':
-            self.ctrl.mode.set('diff')
+        # frames are written in the background while they are collected
+        img_conv = ImgConversionStream(tiff_path=self.tiff_path,
+                                       mrc_path=self.mrc_path,
+                                       smv_path=self.smv_path,
+                                       flatfield=self.flatfield,
+                                       )
+        try:
+            nframes_diff = 0
+            image_buffer = []
 
-        self.diff_focus_proper = self.ctrl.difffocus.value
-        self.diff_focus_defocused = self.diff_defocus + self.diff_focus_proper
-        exposure_image = self.exposure_image
+            if self.ctrl.mode != 'diff':
+                self.ctrl.mode.set('diff')
 
-        if self.relax_beam_before_experiment:
-            self.relax_beam()
+            self.diff_focus_proper = self.ctrl.difffocus.value
+            self.diff_focus_defocused = self.diff_defocus + self.diff_focus_proper
+            exposure_image = self.exposure_image
 
-        self.start_angle = self.start_rotation()
-        self.ctrl.cam.block()
+            if self.relax_beam_before_experiment:
+                self.relax_beam()
 
-        i = 1
+            self.start_angle = self.start_rotation()
+            self.ctrl.cam.block()
 
-        t0 = time.perf_counter()
+            i = 1
 
-        while not self.stopEvent.is_set():
-            if i % self.image_interval == 0:
-                t_start = time.perf_counter()
-                acquisition_time = (t_start - t0) / (i - 1)
+            t0 = time.perf_counter()
 
-                self.ctrl.difffocus.set(self.diff_focus_defocused, confirm_mode=False)
-                img, h = self.ctrl.get_image(exposure_image, header_keys=None)
-                self.ctrl.difffocus.set(self.diff_focus_proper, confirm_mode=False)
+            while not self.stopEvent.is_set():
+                if i % self.image_interval == 0:
+                    t_start = time.perf_counter()
+                    acquisition_time = (t_start - t0) / (i - 1)
 
-                image_buffer.append((i, img, h))
+                    self.ctrl.difffocus.set(self.diff_focus_defocused, confirm_mode=False)
+                    img, h = self.ctrl.get_image(exposure_image, header_keys=None)
+                    self.ctrl.difffocus.set(self.diff_focus_proper, confirm_mode=False)
 
-                next_interval = t_start + acquisition_time
-                # print(f"{i} BLOOP! {next_interval-t_start:.3f} {acquisition_time:.3f} {t_start-t0:.3f}")
+                    image_buffer.append((i, img, h))
 
-                while time.perf_counter() > next_interval:
-                    next_interval += acquisition_time
-                    i += 1
-                    # print(f"{i} "SKIP!  {next_interval-t_start:.3f} {acquisition_time:.3f}")
+                    next_interval = t_start + acquisition_time
+                    # print(f"{i} BLOOP! {next_interval-t_start:.3f} {acquisition_time:.3f} {t_start-t0:.3f}")
 
-                diff = next_interval - time.perf_counter()  # seconds
+                    while time.perf_counter() > next_interval:
+                        next_interval += acquisition_time
+                        i += 1
+                        # print(f"{i} "SKIP!  {next_interval-t_start:.3f} {acquisition_time:.3f}")
 
-                if self.track_stage_position and diff > 0.1:
-                    self.stage_positions.append((i, self.ctrl.stage.get()))
+                    diff = next_interval - time.perf_counter()  # seconds
 
-                time.sleep(diff)
+                    if self.track_stage_position and diff > 0.1:
+                        self.stage_positions.append((i, self.ctrl.stage.get()))
 
-            else:
-                img, h = self.ctrl.get_image(self.exposure, header_keys=None)
-                # print(f"{i} Image!")
-                buffer.append((i, img, h))
+                    time.sleep(diff)
 
-            i += 1
+                else:
+                    img, h = self.ctrl.get_image(self.exposure, header_keys=None)
+                    # print(f"{i} Image!")
+                    img_conv.put(i, img, h)
+                    nframes_diff += 1
 
-        t1 = time.perf_counter()
+                i += 1
 
-        if self.mode == 'footfree':
-            self.ctrl.stage.stop()
+            t1 = time.perf_counter()
 
-        self.stopEvent.clear()
+            if self.mode == 'footfree':
+                self.ctrl.stage.stop()
 
-        self.ctrl.cam.unblock()
+            self.stopEvent.clear()
 
-        if self.mode == 'simulate':
-            # simulate somewhat realistic end numbers
-            self.ctrl.stage.x += np.random.randint(-5000, 5000)
-            self.ctrl.stage.y += np.random.randint(-5000, 5000)
-            self.ctrl.stage.a += np.random.randint(-100, 100)
-            self.ctrl.magnification.set(300)
+            self.ctrl.cam.unblock()
 
-        self.end_position = self.ctrl.stage.get()
-        self.end_angle = self.end_position[3]
-        self.camera_length = int(self.ctrl.magnification.get())
-        self.stage_positions.append((99999, self.end_position))
+            if self.mode == 'simulate':
+                # simulate somewhat realistic end numbers
+                self.ctrl.stage.x += np.random.randint(-5000, 5000)
+                self.ctrl.stage.y += np.random.randint(-5000, 5000)
+                self.ctrl.stage.a += np.random.randint(-100, 100)
+                self.ctrl.magnification.set(300)
 
-        is_moving = bool(self.ctrl.stage.is_moving())
-        self.logger.info(f'Experiment finished, stage is moving: {is_moving}')
+            self.end_position = self.ctrl.stage.get()
+            self.end_angle = self.end_position[3]
+            self.camera_length = int(self.ctrl.magnification.get())
+            self.stage_positions.append((99999, self.end_position))
 
-        if self.unblank_beam:
-            print('Blanking beam')
-            self.ctrl.beam.blank()
+            is_moving = bool(self.ctrl.stage.is_moving())
+            self.logger.info(f'Experiment finished, stage is moving: {is_moving}')
 
-        # in case something went wrong starting data collection, return gracefully
-        if i == 1:
-            print_and_log(f'Data collection interrupted', logger=self.logger)
-            return False
+            if self.unblank_beam:
+                print('Blanking beam')
+                self.ctrl.beam.blank()
 
-        self.spotsize = self.ctrl.spotsize
-        self.nframes = i - 1  # len(buffer) can lie in case of frame skipping
-        self.osc_angle = abs(self.end_angle - self.start_angle) / self.nframes
-        self.t_start = t0
-        self.t_end = t1
-        self.total_time = t1 - t0
-        self.acquisition_time = self.total_time / self.nframes
-        self.total_angle = abs(self.end_angle - self.start_angle)
-        self.rotation_axis = config.camera.camera_rotation_vs_stage_xy
+            # in case something went wrong starting data collection, return gracefully
+            if i == 1:
+                print_and_log(f'Data collection interrupted', logger=self.logger)
+                return False
 
-        self.pixelsize = config.calibration['diff']['pixelsize'][self.camera_length]  # px / Angstrom
-        self.physical_pixelsize = config.camera.physical_pixelsize  # mm
-        self.wavelength = config.microscope.wavelength  # angstrom
-        self.stretch_azimuth = config.camera.stretch_azimuth  # deg
-        self.stretch_amplitude = config.camera.stretch_amplitude  # %
+            self.spotsize = self.ctrl.spotsize
+            self.nframes = i - 1  # nframes_diff can lie in case of frame skipping
+            self.osc_angle = abs(self.end_angle - self.start_angle) / self.nframes
+            self.t_start = t0
+            self.t_end = t1
+            self.total_time = t1 - t0
+            self.acquisition_time = self.total_time / self.nframes
+            self.total_angle = abs(self.end_angle - self.start_angle)
+            self.rotation_axis = config.camera.camera_rotation_vs_stage_xy
 
-        self.nframes_diff = len(buffer)
-        self.nframes_image = len(image_buffer)
+            self.pixelsize = config.calibration['diff']['pixelsize'][self.camera_length]  # px / Angstrom
+            self.physical_pixelsize = config.camera.physical_pixelsize  # mm
+            self.wavelength = config.microscope.wavelength  # angstrom
+            self.stretch_azimuth = config.camera.stretch_azimuth  # deg
+            self.stretch_amplitude = config.camera.stretch_amplitude  # %
 
-        self.log_end_status()
+            self.nframes_diff = nframes_diff
+            self.nframes_image = len(image_buffer)
 
-        if self.nframes <= 3:
-            print_and_log(f'Not enough frames collected. Data will not be written (nframes={self.nframes})', logger=self.logger)
-            return False
+            self.log_end_status()
 
-        self.write_data(buffer)
-        self.write_image_data(image_buffer)
+            if self.nframes <= 3:
+                print_and_log(f'Not enough frames collected. Data will not be written (nframes={self.nframes})', logger=self.logger)
+                return False
 
-        print('Data Collection and Conversion Done.')
+            self.write_data(img_conv)
+            self.write_image_data(image_buffer)
 
-        pathsmv_str = str(self.smv_path)
-        msg = {'path': pathsmv_str,
-               'rotrange': self.total_angle,
-               'nframes': self.nframes,
-               'osc': self.osc_angle}
-        msg_tosend = json.dumps(msg).encode('utf8')
+            print('Data Collection and Conversion Done.')
 
-        if self.s2_c:
-            self.s2.send(msg_tosend)
-            print('SMVs sent to XDS for processing.')
+            pathsmv_str = str(self.smv_path)
+            msg = {'path': pathsmv_str,
+                   'rotrange': self.total_angle,
+                   'nframes': self.nframes,
+                   'osc': self.osc_angle}
+            msg_tosend = json.dumps(msg).encode('utf8')
 
-        return True
+            if self.s2_c:
+                self.s2.send(msg_tosend)
+                print('SMVs sent to XDS for processing.')
 
-    def write_data(self, buffer: list):
-        """Write diffraction data in the buffer.
+            return True
+        finally:
+            # stop the writer threads, also if the collection fails
+            img_conv.close()
 
-        The image buffer is passed as a list of tuples, where each tuple contains the
-        index (int), image data (2D numpy array), metadata/header (dict).
+    def write_data(self, img_conv: ImgConversionStream):
+        """Finish writing the diffraction data, and write the input files.
 
-        The buffer index must start at 1.
+        The frames have already been passed to `img_conv` during data
+        collection, and most of them will have been written by now.
         """
-
-        img_conv = ImgConversion(buffer=buffer,
-                                 osc_angle=self.osc_angle,
-                                 start_angle=self.start_angle,
-                                 end_angle=self.end_angle,
-                                 rotation_axis=self.rotation_axis,
-                                 acquisition_time=self.acquisition_time,
-                                 flatfield=self.flatfield,
-                                 pixelsize=self.pixelsize,
-                                 physical_pixelsize=self.physical_pixelsize,
-                                 wavelength=self.wavelength,
-                                 stretch_amplitude=self.stretch_amplitude,
-                                 stretch_azimuth=self.stretch_azimuth,
-                                 )
-
         print('Writing data files...')
-        img_conv.threadpoolwriter(tiff_path=self.tiff_path,
-                                  mrc_path=self.mrc_path,
-                                  smv_path=self.smv_path,
-                                  workers=8)
+        img_conv.finalize(osc_angle=self.osc_angle,
+                          start_angle=self.start_angle,
+                          end_angle=self.end_angle,
+                          rotation_axis=self.rotation_axis,
+                          acquisition_time=self.acquisition_time,
+                          pixelsize=self.pixelsize,
+                          physical_pixelsize=self.physical_pixelsize,
+                          wavelength=self.wavelength,
+                          stretch_amplitude=self.stretch_amplitude,
+                          stretch_azimuth=self.stretch_azimuth,
+                          )
 
         print('Writing input files...')
         if self.write_dials:
@@ -1,6 +1,7 @@
 import datetime
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -8,9 +9,113 @@ from tqdm.auto import tqdm
 
 from instamatic import config
 from instamatic.formats import write_tiff
+from instamatic.image_utils import rotate_image
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
 
 
+class StepwiseTiltSeries:
+    """Stepwise tilt series where the goniometer step to the next angle is
+    started as soon as the readout of the previous frame has finished.
+
+    The microscope state for the headers is taken once from the cached
+    snapshot (`ctrl.snapshot`), and only the stage position is updated
+    for every frame from the settled position of the stage movement.
+    Rotating the images and assembling the headers is done on a
+    background thread, which hands the frames to `writer`. The time per
+    step is then the exposure plus the stage step and settling time.
+
+    ctrl:
+        Instance of instamatic.TEMController.TEMController
+    exposure_time: float
+        Exposure time for each image in seconds
+    binsize: int
+        Binning to use for the images
+    writer: callable
+        Called as `writer(i, img, h)` on the background thread for every
+        frame, in order
+    settle_delay: float
+        Additional delay after each step in seconds. By default, the stage
+        is considered settled once its position has converged (see
+        `StageMove`)
+    """
+
+    def __init__(self, ctrl, exposure_time: float, binsize: int = None, writer=None, settle_delay: float = None):
+        super().__init__()
+        self.ctrl = ctrl
+        self.exposure_time = exposure_time
+        self.binsize = binsize or ctrl.cam.default_binsize
+        self.writer = writer
+        self.settle_delay = settle_delay
+
+        self.timings = []
+
+    def store(self, i: int, img, state: dict, position, t_start: float, t_end: float, t_get: float) -> None:
+        """Rotate the image, assemble the header, and pass the frame to the
+        writer."""
+        img = rotate_image(img, mode=state.get('FunctionMode'), mag=state.get('Magnification'))
+
+        h = dict(state)
+        h['StagePosition'] = position
+        h['ImageGetTimeStart'] = t_start
+        h['ImageGetTimeEnd'] = t_end
+        h['ImageGetTime'] = t_get
+        h['ImageExposureTime'] = self.exposure_time
+        h['ImageBinsize'] = self.binsize
+        h['ImageResolution'] = img.shape
+        h['ImageComment'] = ''
+        h['ImageCameraName'] = self.ctrl.cam.name
+        h['ImageCameraDimensions'] = self.ctrl.cam.getCameraDimensions()
+
+        if self.writer:
+            self.writer(i, img, h)
+
+    def run(self, angles, offset: int = 1) -> None:
+        """Collect a frame at every angle in `angles` (degrees), frames are
+        numbered from `offset`."""
+        ctrl = self.ctrl
+        state = ctrl.snapshot.get()
+        stage = ctrl.stage
+
+        move = stage.set_async(a=angles[0])
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            futures = []
+            for i, angle in enumerate(tqdm(angles)):
+                t0 = time.perf_counter()
+                position = move.result()
+                if self.settle_delay:
+                    time.sleep(self.settle_delay)
+
+                if ctrl.autoblank:
+                    ctrl.beam.unblank()
+
+                t_start = time.perf_counter()
+                img = ctrl.get_raw_image(exposure=self.exposure_time, binsize=self.binsize)
+                t_end = time.perf_counter()
+
+                if ctrl.autoblank:
+                    ctrl.beam.blank()
+
+                # readout done, start the next step right away
+                if i + 1 < len(angles):
+                    move = stage.set_async(a=angles[i + 1])
+
+                futures.append(executor.submit(self.store, i + offset, img, state, position, t_start, t_end, time.time()))
+                self.timings.append((t_start - t0, t_end - t_start))
+
+                # raise errors from the background thread early
+                while futures and futures[0].done():
+                    futures.pop(0).result()
+
+            for future in futures:
+                future.result()
+
+    def overhead(self) -> float:
+        """Average time per step spent waiting for the stage, in
+        seconds."""
+        return float(np.mean([wait for wait, exposure in self.timings])) if self.timings else 0.0
+
+
 class Experiment:
     """Initialize stepwise rotation electron diffraction experiment.
 
@@ -46,7 +151,7 @@ class Experiment:
         self.current_angle = None
         self.buffer = []
 
-    def start_collection(self, exposure_time: float, tilt_range: float, stepsize: float):
+    def start_collection(self, exposure_time: float, tilt_range: float, stepsize: float, pipeline: bool = True):
         """Start or continue data collection for `tilt_range` degrees with
         steps given by `stepsize`, To finalize data collection and write data
         files, run `self.finalize`.
@@ -59,6 +164,9 @@ class Experiment:
             Tilt range starting from the current angle in degrees. Must be positive.
         stepsize:
             Step size for the angle in degrees, controls the direction and can be positive or negative
+        pipeline:
+            Start each goniometer step as soon as the previous frame has been read out,
+            and assemble the headers in the background (see `StepwiseTiltSeries`)
         """
         self.spotsize = self.ctrl.spotsize
         self.now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -92,15 +200,21 @@ class Experiment:
         if ctrl.cam.streamable:
             ctrl.cam.block()
 
-        # for i, a in enumerate(tilt_positions):
-        for i, angle in enumerate(tqdm(tilt_positions)):
-            ctrl.stage.a = angle
+        if pipeline:
+            series = StepwiseTiltSeries(ctrl, exposure_time, writer=lambda j, img, h: self.buffer.append((j, img, h)))
+            series.run(tilt_positions, offset=self.offset)
+            angle = tilt_positions[-1]
+            j = self.offset + len(tilt_positions) - 1
+            self.logger.info(f'Average wait for the stage: {series.overhead():.3f} s per step')
+        else:
+            for i, angle in enumerate(tqdm(tilt_positions)):
+                ctrl.stage.a = angle
 
-            j = i + self.offset
+                j = i + self.offset
 
-            img, h = self.ctrl.get_image(exposure_time)
+                img, h = self.ctrl.get_image(exposure_time)
 
-            self.buffer.append((j, img, h))
+                self.buffer.append((j, img, h))
 
         self.offset += len(tilt_positions)
         self.nframes = j
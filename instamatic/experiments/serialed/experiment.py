@@ -1,6 +1,7 @@
 import json
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import matplotlib.pyplot as plt
@@ -11,10 +12,10 @@ from instamatic import config
 from instamatic.calibrate import CalibBeamShift
 from instamatic.calibrate import CalibDirectBeam
 from instamatic.formats import *
-from instamatic.processing.find_crystals import find_crystals
-from instamatic.processing.find_crystals import find_crystals_timepix
-from instamatic.processing.flatfield import apply_flatfield_correction
-from instamatic.processing.flatfield import remove_deadpixels
+from instamatic.processing.find_crystals import CrystalFinder
+from instamatic.processing.flatfield import FlatfieldCorrector
+from instamatic.stage_route import StageModel
+from instamatic.stage_route import plan_route
 
 
 def make_grid_on_stage(startpoint, endpoint, padding=2.0):
@@ -169,10 +170,9 @@ class Experiment:
 
         self.expdir = expdir
         self.calibdir = self.expdir / 'calib'
-        self.imagedir = self.expdir / 'images'
-        self.datadir = self.expdir / 'data'
+        self.container = self.expdir / 'serialed.h5'
 
-        for drc in self.expdir, self.calibdir, self.imagedir, self.datadir:
+        for drc in self.expdir, self.calibdir:
             drc.mkdir(exist_ok=True, parents=True)
 
         return self.expdir
@@ -208,7 +208,7 @@ class Experiment:
             self.ctrl.mode.set('mag1')
             self.ctrl.store('image')
             self.ctrl.brightness.set(image_brightness)
-            self.ctrl.tem.setSpotSize(self.image_spotsize)
+            self.ctrl.spotsize = self.image_spotsize
 
             self.calib_beamshift = CalibBeamShift.live(self.ctrl, outdir=self.calibdir)
 
@@ -230,7 +230,7 @@ class Experiment:
         except OSError:
             self.ctrl.mode.set('diff')
             self.ctrl.store('diffraction')
-            self.ctrl.tem.setSpotSize(self.diff_spotsize)
+            self.ctrl.spotsize = self.diff_spotsize
 
             self.calib_directbeam = CalibDirectBeam.live(self.ctrl, outdir=self.calibdir)
 
@@ -243,15 +243,14 @@ class Experiment:
         self.crystal_spread = kwargs.get('crystal_spread', 0.6)
 
         if self.ctrl.cam.name == 'timepix':
-            self.find_crystals = find_crystals_timepix
+            self.timepix = True
             self.flatfield = kwargs.get('flatfield', 'flatfield.tiff')
         else:
-            self.find_crystals = find_crystals
+            self.timepix = False
             self.flatfield = None
 
         if self.flatfield is not None:
-            self.flatfield, h_flatfield = read_tiff(self.flatfield)
-            self.deadpixels = h_flatfield['deadpixels']
+            self.corrector = FlatfieldCorrector(self.flatfield)
 
         # self.sample_rotation_angles = ( -10, -5, 5, 10 )
         # self.sample_rotation_angles = (-5, 5)
@@ -265,13 +264,24 @@ class Experiment:
         box_x, box_y = self.image_dimensions
 
         offsets = get_offsets_in_scan_area(box_x, box_y, self.scan_radius, k=border_k, padding=2, angle=self.camera_rotation_angle, plot=False)
-        self.offsets = offsets * 1000
+        offsets = offsets * 1000
+
+        # optionally, order the grid points to minimize the stage travel time,
+        # the stage is moved without backlash correction
+        self.scan_route = kwargs.get('scan_route')
+        if self.scan_route:
+            route = plan_route(offsets, model=StageModel.from_tem(self.ctrl.tem), method=self.scan_route,
+                               backlash=False, angle=-self.camera_rotation_angle)
+            offsets = offsets[route.order]
+            self.log.info('Scan route (%s): %d positions, estimated stage time %.1f s', self.scan_route, len(offsets), route.time)
+        self.offsets = offsets
 
         # store kwargs to experiment drc
         kwargs['diff_brightness'] = self.diff_brightness
         kwargs['diff_cameralength'] = self.diff_cameralength
         kwargs['diff_difffocus'] = self.diff_difffocus
         kwargs['scan_radius'] = self.scan_radius
+        kwargs['scan_route'] = self.scan_route
         kwargs['scan_centers'] = self.scan_centers.tolist()
         kwargs['stage_positions'] = len(self.offsets)
         kwargs['image_dimensions'] = self.image_dimensions
@@ -289,7 +299,7 @@ class Experiment:
         self.ctrl.mode.set('diff')
         self.ctrl.brightness.set(self.diff_brightness)
         self.ctrl.difffocus.set(self.diff_difffocus)
-        self.ctrl.tem.setSpotSize(self.diff_spotsize)
+        self.ctrl.spotsize = self.diff_spotsize
         input('\nPress <ENTER> to get neutral diffraction shift')
         self.neutral_diffshift = np.array(self.ctrl.diffshift.get())
         self.log.info('DiffShift(x=%d, y=%d)', *self.neutral_diffshift)
@@ -299,7 +309,7 @@ class Experiment:
         self.ctrl.brightness.max()
         self.calib_beamshift.center(self.ctrl)
         self.neutral_beamshift = self.ctrl.beamshift.get()
-        self.ctrl.tem.setSpotSize(self.image_spotsize)
+        self.ctrl.spotsize = self.image_spotsize
 
     def image_mode(self, delay=0.2):
         """Switch to image mode (mag1), reset beamshift/diffshift, spread
@@ -433,12 +443,18 @@ class Experiment:
 
     def apply_corrections(self, img, h):
         if self.flatfield is not None:
-            img = remove_deadpixels(img, deadpixels=self.deadpixels)
+            img = self.corrector(img)
             h['DeadPixelCorrection'] = True
-            img = apply_flatfield_correction(img, flatfield=self.flatfield)
             h['FlatfieldCorrection'] = True
         return img, h
 
+    def write(self, writer, series: str, img, h: dict, correct: bool = False, **kwargs) -> None:
+        """Append `img` to `series` in the container `writer`, applying the
+        corrections first if `correct` is True."""
+        if correct:
+            img, h = self.apply_corrections(img, h)
+        writer.append(series, img, header=h, **kwargs)
+
     def run(self, ctrl=None, **kwargs):
         """Run serial electron diffraction experiment."""
 
@@ -468,47 +484,79 @@ class Experiment:
 
         input("\nPress <ENTER> to start experiment ('Ctrl-C' to interrupt)\n")
 
-        for i, d_pos in enumerate(self.loop_positions()):
+        finder = CrystalFinder(self.magnification, spread=self.crystal_spread, timepix=self.timepix, processes=1)
+
+        # single worker, so that the frames are written in order
+        with H5ContainerWriter(self.container) as writer, finder, ThreadPoolExecutor(max_workers=1) as store:
+            self.collect(writer, finder, d_image, d_diff, header_keys=header_keys, store=store)
+
+        print('\n\nData collection finished.')
+
+    def collect(self, writer, finder, d_image: dict, d_diff: dict, header_keys=None, store=None):
+        """Loop over all positions and crystals, and append the images to
+        the `images` series and the diffraction patterns to the `data`
+        series of the container `writer`.
+
+        Crystals are located by `finder` (`CrystalFinder`) in a worker
+        process, while the microscope switches to the diffraction spot
+        size. If `store` (a single worker executor) is given, the
+        corrections and writing of the frames run on the worker while
+        the microscope moves on to the next crystal or position.
+        """
+        futures = []
+
+        def submit(func, *args, **kwargs):
+            if store is None:
+                func(*args, **kwargs)
+            else:
+                futures.append(store.submit(func, *args, **kwargs))
 
-            outfile = self.imagedir / f'image_{i:04d}'
+        for i, d_pos in enumerate(self.loop_positions()):
+            # raise errors from the writer
+            for future in [future for future in futures if future.done()]:
+                future.result()
+                futures.remove(future)
 
             if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
+                self.ctrl.spotsize = self.image_spotsize
 
             img, h = self.ctrl.get_image(exposure=self.image_exposure, binsize=self.image_binsize, header_keys=header_keys)
 
             if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
-
-            self.ctrl.tem.setSpotSize(self.diff_spotsize)
+                self.ctrl.spotsize = self.image_spotsize
 
             im_mean = img.mean()
             if im_mean < self.image_threshold:
                 # self.log.debug("Dark image detected (mean=%f)", im_mean)
+                self.ctrl.spotsize = self.diff_spotsize
                 continue
 
             img, h = self.apply_corrections(img, h)
 
-            crystal_positions = self.find_crystals(img, self.magnification, spread=self.crystal_spread) * self.image_binsize
+            future = finder.submit(img)
+
+            self.ctrl.spotsize = self.diff_spotsize
+
+            crystal_positions = [crystal._replace(x=crystal.x * self.image_binsize, y=crystal.y * self.image_binsize)
+                                 for crystal in future.result()]
             crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
 
             for d in (d_image, d_pos):
                 h.update(d)
-            h['exp_crystal_coords'] = crystal_coords
+            h['exp_image_index'] = i
 
-            write_hdf5(outfile, img, header=h)
+            stage_position = d_pos['exp_stage_position']
+            submit(self.write, writer, 'images', img, h, stage_position=stage_position, crystal_coords=crystal_coords)
 
             ncrystals = len(crystal_coords)
             if ncrystals == 0:
                 continue
 
-            self.log.info('%d crystals found in %s', ncrystals, outfile)
+            self.log.info('%d crystals found in image %d', ncrystals, i)
 
             for k, d_cryst in enumerate(self.loop_crystals(crystal_coords)):
-                outfile = self.datadir / f'image_{i:04d}_{k:04d}'
                 comment = f'Image {i} Crystal {k}'
                 img, h = self.ctrl.get_image(binsize=self.diff_binsize, exposure=self.diff_exposure, comment=comment, header_keys=header_keys)
-                img, h = self.apply_corrections(img, h)
 
                 for d in (d_diff, d_pos, d_cryst):
                     h.update(d)
@@ -517,32 +565,38 @@ class Experiment:
                 h['crystal_clusters'] = crystal_positions[k].n_clusters
                 h['total_area_micrometer'] = crystal_positions[k].area_micrometer
                 h['total_area_pixel'] = crystal_positions[k].area_pixel
+                h['exp_image_index'] = i
+                h['exp_crystal_index'] = k
 
                 # img_processed = neural_network.preprocess(img.astype(np.float))
                 # quality = neural_network.predict(img_processed)
                 # h["crystal_quality"] = quality
 
-                write_hdf5(outfile, img, header=h)
+                submit(self.write, writer, 'data', img, h, correct=True, stage_position=stage_position, crystal_coords=[crystal_coords[k]])
 
                 if self.sample_rotation_angles:
                     for rotation_angle in self.sample_rotation_angles:
                         self.log.debug('Rotation angle = %f', rotation_angle)
                         self.ctrl.stage.a = rotation_angle
 
-                        outfile = self.datadir / f'image_{i:04d}_{k:04d}_{rotation_angle}'
                         img, h = self.ctrl.get_image(exposure=self.diff_exposure, binsize=self.diff_binsize, comment=comment, header_keys=header_keys)
-                        img, h = self.apply_corrections(img, h)
 
                         for d in (d_diff, d_pos, d_cryst):
                             h.update(d)
+                        h['exp_image_index'] = i
+                        h['exp_crystal_index'] = k
+                        h['exp_rotation_angle'] = rotation_angle
 
-                        write_hdf5(outfile, img, header=h)
+                        submit(self.write, writer, 'data', img, h, correct=True,
+                               stage_position=(*stage_position, np.nan, rotation_angle), crystal_coords=[crystal_coords[k]])
 
                     self.ctrl.stage.a = 0
 
             self.image_mode()
+            submit(writer.flush)
 
-        print('\n\nData collection finished.')
+        for future in futures:
+            future.result()
 
 
 def main():
@@ -8,13 +8,19 @@ import tifffile
 import yaml
 
 from .adscimage import read_adsc
+from .adscimage import update_adsc_header
 from .adscimage import write_adsc
 from .csvIO import read_csv
 from .csvIO import read_ycsv
 from .csvIO import write_csv
 from .csvIO import write_ycsv
+from .framestack import FrameStack
+from .h5container import H5ContainerReader
+from .h5container import H5ContainerWriter
+from .h5container import is_h5container
 from .mrc import read_image as read_mrc
 from .mrc import write_image as write_mrc
+from .xdscbf import read as read_cbf
 from .xdscbf import write as write_cbf
 
 
@@ -116,10 +122,5 @@ def read_hdf5(fname: str) -> (np.array, dict):
     if not os.path.exists(fname):
         raise FileNotFoundError(f"No such file: '{fname}'")
 
-    f = h5py.File(fname, 'r')
-    return np.array(f['data']), dict(f['data'].attrs)
-
-
-def read_cbf(fname: str):
-    """CBF reader not implemented."""
-    raise NotImplementedError('CBF reader not implemented.')
+    with h5py.File(fname, 'r') as f:
+        return np.array(f['data']), dict(f['data'].attrs)
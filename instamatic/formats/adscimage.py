@@ -19,10 +19,10 @@ def swap_needed(header: dict) -> bool:
         return True
 
 
-def write_adsc(fname: str, data: np.array, header: dict = {}):
-    """Write adsc format."""
+def format_header(header: dict, shape: tuple = None) -> bytes:
+    """Format the adsc header, padded to a multiple of 512 bytes."""
     if 'SIZE1' not in header and 'SIZE2' not in header:
-        dim2, dim1 = data.shape
+        dim2, dim1 = shape
         header['SIZE1'] = dim1
         header['SIZE2'] = dim2
 
@@ -39,6 +39,13 @@ def write_adsc(fname: str, data: np.array, header: dict = {}):
     out += b'}' + (pad + 1) * b'\x00'
     assert len(out) % 512 == 0, 'Header is not multiple of 512'
 
+    return out
+
+
+def write_adsc(fname: str, data: np.array, header: dict = {}):
+    """Write adsc format."""
+    out = format_header(header, data.shape)
+
     # NOTE: XDS can handle only "SMV" images of TYPE=unsigned_short.
     dtype = np.uint16
     data = np.round(data, 0).astype(dtype, copy=False)  # copy=False ensures that no copy is made if dtype is already satisfied
@@ -50,6 +57,23 @@ def write_adsc(fname: str, data: np.array, header: dict = {}):
         outf.write(data.tostring())
 
 
+def update_adsc_header(fname: str, header: dict):
+    """Overwrite the header of an existing adsc file in place, without
+    touching the image data.
+
+    The new header must have the same size (`HEADER_BYTES`) as the
+    old one.
+    """
+    out = format_header(header)
+
+    with open(fname, 'r+b') as outf:
+        old = readheader(outf)
+        if int(old['HEADER_BYTES']) != len(out):
+            raise ValueError(f'Header size does not match: {len(out)} != {old["HEADER_BYTES"]} ({fname})')
+        outf.seek(0)
+        outf.write(out)
+
+
 def readheader(infile):
     """read an adsc header."""
     header = {}
@@ -0,0 +1,333 @@
+"""Lazy access to stacks of frames, either a directory of images or a single
+multi-frame file (MRC stack, multi-page TIFF, HDF5).
+
+Frames are only read when they are accessed. Uncompressed payloads
+(SMV, MRC, uncompressed TIFF pages) are memory-mapped, so scrubbing
+through a large dataset does not load it into memory. Headers are parsed
+separately from the image data, and cached.
+
+Usage:
+    with FrameStack('SMV/data') as stack:
+        print(len(stack), stack.shape)
+        img = stack[10]
+        h = stack.header(10)
+        for img in stack[::10]:
+            ...
+"""
+from pathlib import Path
+
+import h5py
+import numpy as np
+import tifffile
+import yaml
+
+from . import mrc
+from .adscimage import readheader as read_adsc_header
+from .adscimage import swap_needed
+from .h5container import H5Series
+from .xdscbf import read as read_cbf
+
+EXTENSIONS = ('.tif', '.tiff', '.h5', '.hdf5', '.img', '.smv', '.mrc', '.cbf')
+
+
+def _memmap(fname, dtype, shape, offset: int) -> np.ndarray:
+    """Read-only memory map of the array at `offset` in `fname`."""
+    return np.memmap(fname, dtype=dtype, mode='r', shape=shape, offset=offset)
+
+
+def _tiff_header(tiff: tifffile.TiffFile, page) -> dict:
+    if page.software == 'instamatic':
+        return yaml.load(page.tags['ImageDescription'].value, Loader=yaml.Loader)
+    elif tiff.is_tvips:
+        return tiff.tvips_metadata
+    return {}
+
+
+def _tiff_page_data(tiff: tifffile.TiffFile, page) -> np.ndarray:
+    """Memory-map the page if it is stored uncompressed in one block,
+    otherwise decode it."""
+    if getattr(page, 'is_memmappable', False):
+        contiguous = page.is_contiguous
+        if contiguous is True:
+            offset = page.dataoffsets[0]
+        else:
+            offset = contiguous[0]  # tuple (offset, bytecount) in older versions of tifffile
+        dtype = page.dtype.newbyteorder(tiff.byteorder)
+        return _memmap(tiff.filehandle.path, dtype, page.shape, offset)
+    return page.asarray()
+
+
+class _SingleFrames:
+    """One frame per file, used for directories and lists of files."""
+
+    def __init__(self, fnames: list):
+        super().__init__()
+        self.fnames = [Path(fn) for fn in fnames]
+
+    def __len__(self) -> int:
+        return len(self.fnames)
+
+    def frame(self, i: int) -> np.ndarray:
+        return read_frame(self.fnames[i])
+
+    def header(self, i: int) -> dict:
+        return read_frame_header(self.fnames[i])
+
+    def close(self) -> None:
+        pass
+
+
+class _MRCFrames:
+    """Memory-mapped MRC stack."""
+
+    def __init__(self, fname: str):
+        super().__init__()
+        h = mrc.read_mrc_header(str(fname))
+        nx, ny, nz = int(h['nx'][0]), int(h['ny'][0]), int(h['nz'][0])
+        dtype = np.dtype(mrc.mrc2numpy[h['mode'][0]]).newbyteorder(h.dtype['nx'].byteorder)
+        offset = 1024 + int(h['nsymbt'][0])
+
+        self.data = _memmap(fname, dtype, (nz, ny, nx), offset)
+        self._header = mrc.read_header(h)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def frame(self, i: int) -> np.ndarray:
+        return self.data[i]
+
+    def header(self, i: int) -> dict:
+        return self._header
+
+    def close(self) -> None:
+        self.data = None
+
+
+class _TiffFrames:
+    """All pages of a (multi-page) TIFF file."""
+
+    def __init__(self, fname: str):
+        super().__init__()
+        self.tiff = tifffile.TiffFile(fname)
+
+    def __len__(self) -> int:
+        return len(self.tiff.pages)
+
+    def frame(self, i: int) -> np.ndarray:
+        return _tiff_page_data(self.tiff, self.tiff.pages[i])
+
+    def header(self, i: int) -> dict:
+        return _tiff_header(self.tiff, self.tiff.pages[i])
+
+    def close(self) -> None:
+        self.tiff.close()
+
+
+class _HDF5Frames:
+    """Frames in an HDF5 file, either a container written by
+    `H5ContainerWriter` (a single series) or the `data` dataset written by
+    `write_hdf5`.
+
+    Only the requested frames are read from the file.
+    """
+
+    def __init__(self, fname: str, series: str = None):
+        super().__init__()
+        self.f = h5py.File(fname, 'r')
+        if series is None:
+            groups = [key for key, item in self.f.items() if isinstance(item, h5py.Group) and 'header' in item]
+            series = 'data' if 'data' in groups else (groups[0] if groups else None)
+
+        if series is None:
+            self.series = None
+            self.data = self.f['data']
+            self._header = dict(self.data.attrs)
+        else:
+            self.series = H5Series(self.f[series])
+            self.data = self.series.data
+
+    def __len__(self) -> int:
+        return len(self.data) if self.data.ndim == 3 else 1
+
+    def frame(self, i: int) -> np.ndarray:
+        if self.data.ndim == 2:
+            return self.data[()]
+        return self.data[i]
+
+    def header(self, i: int) -> dict:
+        if self.series is None:
+            return self._header
+        return self.series.header(i)
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def read_frame(fname: str) -> np.ndarray:
+    """Read the (first) frame from `fname`, memory-mapped if possible."""
+    fname = Path(fname)
+    ext = fname.suffix.lower()
+    if ext in ('.img', '.smv'):
+        with open(fname, 'rb') as f:
+            h = read_adsc_header(f)
+        dtype = np.dtype(np.uint16)
+        if swap_needed(h):
+            dtype = dtype.newbyteorder()
+        return _memmap(fname, dtype, (int(h['SIZE2']), int(h['SIZE1'])), int(h['HEADER_BYTES']))
+    elif ext == '.mrc':
+        return _MRCFrames(fname).frame(0)
+    elif ext in ('.tif', '.tiff'):
+        with tifffile.TiffFile(fname) as tiff:
+            return _tiff_page_data(tiff, tiff.pages[0])
+    elif ext in ('.h5', '.hdf5'):
+        frames = _HDF5Frames(fname)
+        try:
+            return frames.frame(0)
+        finally:
+            frames.close()
+    elif ext == '.cbf':
+        return read_cbf(fname)[0]
+    raise OSError(f'Cannot open file {fname}, unknown extension: {ext}')
+
+
+def read_frame_header(fname: str) -> dict:
+    """Read the header of the (first) frame from `fname` without decoding
+    the image data."""
+    fname = Path(fname)
+    ext = fname.suffix.lower()
+    if ext in ('.img', '.smv'):
+        with open(fname, 'rb') as f:
+            return read_adsc_header(f)
+    elif ext == '.mrc':
+        return mrc.read_header(str(fname))
+    elif ext in ('.tif', '.tiff'):
+        with tifffile.TiffFile(fname) as tiff:
+            return _tiff_header(tiff, tiff.pages[0])
+    elif ext in ('.h5', '.hdf5'):
+        frames = _HDF5Frames(fname)
+        try:
+            return frames.header(0)
+        finally:
+            frames.close()
+    elif ext == '.cbf':
+        return read_cbf(fname)[1]
+    raise OSError(f'Cannot open file {fname}, unknown extension: {ext}')
+
+
+class FrameStack:
+    """Lazy, indexable stack of frames.
+
+    source: str, pathlib.Path, or list
+        Directory with images (one frame per file, sorted by name), a
+        glob pattern, a list of files, or a single multi-frame file
+        (MRC, TIFF, HDF5)
+    series: str
+        Series to read from an HDF5 container (defaults to `data`)
+
+    Indexing with an integer returns the frame as a numpy array
+    (memory-mapped when possible), indexing with a slice or a list of
+    indices returns a new `FrameStack`. Headers are available through
+    `header(i)`.
+    """
+
+    def __init__(self, source, series: str = None, _indices=None):
+        super().__init__()
+        if isinstance(source, (_SingleFrames, _MRCFrames, _TiffFrames, _HDF5Frames)):
+            self._frames = source
+        else:
+            self._frames = self._open(source, series)
+
+        if _indices is None:
+            _indices = np.arange(len(self._frames))
+        self._indices = _indices
+        self._headers = {}
+
+    @staticmethod
+    def _open(source, series: str = None):
+        if isinstance(source, (list, tuple)):
+            return _SingleFrames(source)
+
+        path = Path(source)
+        if path.is_dir():
+            fnames = sorted(fn for fn in path.iterdir() if fn.suffix.lower() in EXTENSIONS)
+            return _SingleFrames(fnames)
+        elif not path.exists():
+            fnames = sorted(path.parent.glob(path.name))
+            if not fnames:
+                raise FileNotFoundError(f"No such file or directory: '{source}'")
+            return _SingleFrames(fnames)
+
+        ext = path.suffix.lower()
+        if ext == '.mrc':
+            return _MRCFrames(path)
+        elif ext in ('.tif', '.tiff'):
+            return _TiffFrames(path)
+        elif ext in ('.h5', '.hdf5'):
+            return _HDF5Frames(path, series=series)
+        elif ext in EXTENSIONS:
+            return _SingleFrames([path])
+        raise OSError(f'Cannot open file {path}, unknown extension: {ext}')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(n={len(self)}, frames={self._frames.__class__.__name__})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._frames.frame(self._indices[key])
+        return FrameStack(self._frames, _indices=self._indices[key])
+
+    def __iter__(self):
+        for i in self._indices:
+            yield self._frames.frame(i)
+
+    def __array__(self, dtype=None):
+        return self.asarray(dtype=dtype)
+
+    @property
+    def fnames(self) -> list:
+        """File names of the frames, if the stack consists of single
+        files."""
+        if isinstance(self._frames, _SingleFrames):
+            return [self._frames.fnames[i] for i in self._indices]
+        return None
+
+    @property
+    def shape(self) -> tuple:
+        """(n, ny, nx), assumes that all frames have the shape of the first
+        frame."""
+        if len(self) == 0:
+            return (0,)
+        return (len(self), *self[0].shape)
+
+    def header(self, i: int) -> dict:
+        """Return the header of frame `i`, parsed without reading the image
+        data."""
+        j = self._indices[i]
+        if j not in self._headers:
+            self._headers[j] = self._frames.header(j)
+        return self._headers[j]
+
+    def headers(self) -> list:
+        """Return the headers of all frames."""
+        return [self.header(i) for i in range(len(self))]
+
+    def asarray(self, dtype=None) -> np.ndarray:
+        """Load all frames into a 3D numpy array."""
+        if isinstance(self._frames, _MRCFrames):
+            return np.array(self._frames.data[self._indices], dtype=dtype)
+        out = np.empty(self.shape, dtype=dtype or self[0].dtype)
+        for k, img in enumerate(self):
+            out[k] = img
+        return out
+
+    def close(self) -> None:
+        self._frames.close()
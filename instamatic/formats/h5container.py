@@ -0,0 +1,348 @@
+"""Appendable HDF5 container for series of images (e.g. serialED).
+
+All images of an acquisition are stored in a single file, grouped into
+named series (e.g. `images` and `data`). Each series is a group with
+the following datasets:
+
+- `data`: (n, ny, nx) image stack, chunked per frame and optionally compressed
+- `header`: (n,) structured table with one row of metadata per frame
+- `stage_position`: (n, 5) stage position (x, y, z, a, b) per frame, NaN if unknown
+- `crystal_coords`: (m, 2) crystal coordinates of all frames
+- `crystal_index`: (n, 2) start/stop indices into `crystal_coords` per frame
+
+The fields of the header table are determined by the header of the
+first frame. Values that do not fit in a fixed-size field (nested or
+variable-length data) are stored as json, and keys that are missing from
+the table are stored as json in the `_extra` field.
+
+Frames are read lazily through `H5ContainerReader`, so only the frames
+that are accessed are loaded from disk.
+"""
+import json
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+STAGE_POSITION_SIZE = 5
+EXTRA_FIELD = '_extra'
+JSON_FIELDS_ATTR = 'json_fields'
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def _to_json(obj) -> str:
+    return json.dumps(obj, default=_json_default)
+
+
+def _field_dtype(value):
+    """Return the dtype of the header field for `value`, or None if it
+    should be stored as json."""
+    if isinstance(value, (bool, np.bool_)):
+        return np.dtype('?')
+    elif isinstance(value, (int, np.integer)):
+        return np.dtype('<i8')
+    elif isinstance(value, (float, np.floating)):
+        return np.dtype('<f8')
+    elif isinstance(value, str):
+        return h5py.string_dtype()
+    elif isinstance(value, (tuple, list, np.ndarray)):
+        try:
+            arr = np.asarray(value)
+        except ValueError:
+            return None
+        if arr.size == 0 or arr.dtype.kind not in 'biuf':
+            return None
+        return np.dtype(('<f8', arr.shape))
+    return None
+
+
+def _fits_field(value, field: np.dtype) -> bool:
+    """Check whether `value` can be stored in `field` without loss."""
+    dtype = _field_dtype(value)
+    if dtype is None:
+        return False
+    elif dtype == field:
+        return True
+    # integers and booleans can be stored in float fields
+    return field.kind == 'f' and dtype.kind in 'bi'
+
+
+def make_header_dtype(header: dict) -> (np.dtype, list):
+    """Derive the structured dtype of the header table from `header`.
+
+    Returns the dtype and the list of fields that are stored as json.
+    """
+    fields = []
+    json_fields = []
+    for key, value in header.items():
+        dtype = _field_dtype(value)
+        if dtype is None:
+            dtype = h5py.string_dtype()
+            json_fields.append(key)
+        fields.append((key, dtype))
+    fields.append((EXTRA_FIELD, h5py.string_dtype()))
+    return np.dtype(fields), json_fields
+
+
+def _empty_row(dtype: np.dtype) -> np.ndarray:
+    """Header row with fill values (NaN/0/empty)."""
+    row = np.zeros((), dtype=dtype)
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        if field.base.kind == 'f':
+            row[name] = np.nan
+        elif h5py.check_string_dtype(field):
+            row[name] = ''
+    return row
+
+
+class H5ContainerWriter:
+    """Write a series of images with their headers to a single HDF5 file.
+
+    fname: str or pathlib.Path
+        File to write to, it is opened in append mode, so that an
+        existing container can be extended
+    compression: str
+        Compression filter for the image data (i.e. 'gzip', 'lzf'), or None
+    chunk_frames: int
+        Number of frames per chunk of the image stack
+
+    Usage:
+        with H5ContainerWriter('serialed.h5') as writer:
+            writer.append('images', img, header=h, crystal_coords=coords)
+    """
+
+    def __init__(self, fname: str, compression: str = 'gzip', chunk_frames: int = 1):
+        super().__init__()
+        self.fname = Path(fname).with_suffix('.h5')
+        self.compression = compression
+        self.chunk_frames = chunk_frames
+        self.f = h5py.File(self.fname, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def _create_series(self, name: str, img: np.ndarray, header: dict) -> h5py.Group:
+        grp = self.f.create_group(name)
+
+        chunks = (self.chunk_frames, *img.shape)
+        grp.create_dataset('data', shape=(0, *img.shape), maxshape=(None, *img.shape),
+                           dtype=img.dtype, chunks=chunks, compression=self.compression)
+
+        dtype, json_fields = make_header_dtype(header)
+        table = grp.create_dataset('header', shape=(0,), maxshape=(None,), dtype=dtype, chunks=True)
+        table.attrs[JSON_FIELDS_ATTR] = _to_json(json_fields)
+
+        grp.create_dataset('stage_position', shape=(0, STAGE_POSITION_SIZE), maxshape=(None, STAGE_POSITION_SIZE),
+                           dtype=np.float64, chunks=True)
+        grp.create_dataset('crystal_coords', shape=(0, 2), maxshape=(None, 2), dtype=np.float64, chunks=True)
+        grp.create_dataset('crystal_index', shape=(0, 2), maxshape=(None, 2), dtype=np.int64, chunks=True)
+
+        return grp
+
+    def _make_row(self, table: h5py.Dataset, header: dict) -> np.ndarray:
+        json_fields = json.loads(table.attrs[JSON_FIELDS_ATTR])
+        row = _empty_row(table.dtype)
+        extra = {}
+
+        for key, value in header.items():
+            if key not in table.dtype.names or key == EXTRA_FIELD:
+                extra[key] = value
+            elif key in json_fields:
+                row[key] = _to_json(value)
+            elif _fits_field(value, table.dtype.fields[key][0]):
+                row[key] = value
+            else:
+                # does not match the field from the first frame
+                extra[key] = value
+
+        if extra:
+            row[EXTRA_FIELD] = _to_json(extra)
+
+        return row
+
+    def append(self, series: str, img: np.ndarray, header: dict = None,
+               stage_position: tuple = None, crystal_coords: list = None) -> int:
+        """Append image `img` to `series`, returns the index of the frame.
+
+        header: dict
+            Metadata of the frame, stored in the header table
+        stage_position: tuple
+            Stage position (x, y, z, a, b) of the frame, may be shorter
+        crystal_coords: list
+            List of (x, y) crystal coordinates in the image
+        """
+        if header is None:
+            header = {}
+
+        grp = self.f.get(series)
+        if grp is None:
+            grp = self._create_series(series, img, header)
+
+        data = grp['data']
+        n = data.shape[0]
+
+        if img.shape != data.shape[1:]:
+            raise ValueError(f'Image shape {img.shape} does not match series `{series}` {data.shape[1:]}')
+
+        data.resize(n + 1, axis=0)
+        data[n] = img
+
+        table = grp['header']
+        table.resize(n + 1, axis=0)
+        table[n] = self._make_row(table, header)
+
+        pos = np.full(STAGE_POSITION_SIZE, np.nan)
+        if stage_position is not None:
+            pos[:len(stage_position)] = stage_position
+        dset = grp['stage_position']
+        dset.resize(n + 1, axis=0)
+        dset[n] = pos
+
+        coords = np.asarray(crystal_coords if crystal_coords is not None else [], dtype=np.float64).reshape(-1, 2)
+        dset = grp['crystal_coords']
+        start = dset.shape[0]
+        stop = start + len(coords)
+        if len(coords):
+            dset.resize(stop, axis=0)
+            dset[start:stop] = coords
+        dset = grp['crystal_index']
+        dset.resize(n + 1, axis=0)
+        dset[n] = (start, stop)
+
+        return n
+
+
+class H5Series:
+    """Lazy access to a single series in an HDF5 container.
+
+    Indexing returns a tuple `(img, header)`, only the requested frame
+    is read from disk. The image stack itself is available as `data`
+    (an h5py dataset, which supports slicing).
+    """
+
+    def __init__(self, grp: h5py.Group):
+        super().__init__()
+        self.name = grp.name.strip('/')
+        self.data = grp['data']
+        self._table = grp['header']
+        self._json_fields = set(json.loads(self._table.attrs[JSON_FIELDS_ATTR]))
+        self._stage_position = grp['stage_position']
+        self._crystal_coords = grp['crystal_coords']
+        self._crystal_index = grp['crystal_index']
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name!r}, n={len(self)}, shape={self.data.shape[1:]})'
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __getitem__(self, i: int) -> (np.ndarray, dict):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f'Frame {i} out of range for series `{self.name}` with {len(self)} frames')
+        return self.data[i], self.header(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def header(self, i: int) -> dict:
+        """Return the header of frame `i` as a dict."""
+        row = self._table[i]
+        header = {}
+        for key in self._table.dtype.names:
+            value = row[key]
+            if isinstance(value, bytes):
+                value = value.decode()
+            if key == EXTRA_FIELD:
+                if value:
+                    header.update(json.loads(value))
+            elif key in self._json_fields:
+                header[key] = json.loads(value) if value else None
+            elif isinstance(value, np.generic):
+                header[key] = value.item()
+            else:
+                header[key] = value
+        return header
+
+    @property
+    def headers(self) -> np.ndarray:
+        """The complete header table as a structured array."""
+        return self._table[:]
+
+    @property
+    def stage_positions(self) -> np.ndarray:
+        """(n, 5) array with the stage position of every frame."""
+        return self._stage_position[:]
+
+    def crystal_coords(self, i: int) -> np.ndarray:
+        """(m, 2) array with the crystal coordinates in frame `i`."""
+        start, stop = self._crystal_index[i]
+        return self._crystal_coords[start:stop]
+
+
+class H5ContainerReader:
+    """Read an HDF5 container written by `H5ContainerWriter`.
+
+    Series are accessed by name, i.e. `reader['images']`, see `H5Series`.
+    """
+
+    def __init__(self, fname: str):
+        super().__init__()
+        self.fname = Path(fname)
+        if not self.fname.exists():
+            raise FileNotFoundError(f"No such file: '{fname}'")
+        self.f = h5py.File(self.fname, 'r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({str(self.fname)!r}, series={self.keys()})'
+
+    def __getitem__(self, series: str) -> H5Series:
+        return H5Series(self.f[series])
+
+    def __contains__(self, series: str) -> bool:
+        return series in self.f
+
+    def keys(self) -> list:
+        return list(self.f.keys())
+
+    def close(self) -> None:
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+def is_h5container(fname: str) -> bool:
+    """Check whether `fname` is an HDF5 container (and not a single image
+    written by `write_hdf5`)."""
+    try:
+        with h5py.File(fname, 'r') as f:
+            return any(isinstance(grp, h5py.Group) and 'header' in grp for grp in f.values())
+    except OSError:
+        return False
@@ -17,6 +17,32 @@ DATA_TYPES = {'signed 8-bit integer': 'int8',
 STARTER = b'\x0c\x1a\x04\xd5'
 
 
+# Lengths of the byte_offset elements: 1 byte for small deltas, otherwise
+# a marker (0x80) followed by the delta as int16, int32 or int64, where the
+# lower levels are filled with the marker for the next level
+INT8_MAX = 127
+INT16_MAX = 32767
+INT32_MAX = 2147483647
+
+MARKER_INT16 = b'\x80'
+MARKER_INT32 = b'\x80\x00\x80'
+MARKER_INT64 = b'\x80\x00\x80\x00\x00\x00\x80'
+
+
+def _scatter(out, offsets, values, dtype):
+    """Write `values` as little endian `dtype` at the byte `offsets` in
+    `out`."""
+    raw = values.astype(np.dtype(dtype).newbyteorder('<')).view(np.uint8).reshape(len(values), -1)
+    out[offsets[:, None] + np.arange(raw.shape[1])] = raw
+
+
+def _gather(raw, offsets, dtype):
+    """Read little endian `dtype` values at the byte `offsets` in `raw`."""
+    dtype = np.dtype(dtype).newbyteorder('<')
+    idx = offsets[:, None] + np.arange(dtype.itemsize)
+    return raw[idx].copy().view(dtype).reshape(-1).astype(np.int64)
+
+
 def compByteOffset(data):
     """Compress a dataset into a string using the byte_offet algorithm.
 
@@ -26,44 +52,99 @@ def compByteOffset(data):
     test = np.array([0,1,2,127,0,1,2,128,0,1,2,32767,0,1,2,32768,0,1,2,2147483647,0,1,2,2147483648,0,1,2,128,129,130,32767,32768,128,129,130,32768,2147483647,2147483648])
     """
     flat = np.ascontiguousarray(data.ravel(), np.int64)
-    delta = np.zeros_like(flat)
-    delta[0] = flat[0]
-    delta[1:] = flat[1:] - flat[:-1]
-    mask = abs(delta) > 127
-    exceptions = np.nonzero(mask)[0]
-    if np.little_endian:
-        byteswap = False
-    else:
-        byteswap = True
-    start = 0
-    binary_blob = b''
-    for stop in exceptions:
-        if stop - start > 0:
-            binary_blob += delta[start:stop].astype(np.int8).tostring()
-        exc = delta[stop]
-        absexc = abs(exc)
-        if absexc > 2147483647:  # 2**31-1
-            binary_blob += b'\x80\x00\x80\x00\x00\x00\x80'
-            if byteswap:
-                binary_blob += delta[stop:stop + 1].byteswap().tostring()
-            else:
-                binary_blob += delta[stop:stop + 1].tostring()
-        elif absexc > 32767:  # 2**15-1
-            binary_blob += b'\x80\x00\x80'
-            if byteswap:
-                binary_blob += delta[stop:stop + 1].astype(np.int32).byteswap().tostring()
-            else:
-                binary_blob += delta[stop:stop + 1].astype(np.int32).tostring()
-        else:  # >127
-            binary_blob += b'\x80'
-            if byteswap:
-                binary_blob += delta[stop:stop + 1].astype(np.int16).byteswap().tostring()
-            else:
-                binary_blob += delta[stop:stop + 1].astype(np.int16).tostring()
-        start = stop + 1
-    if start < delta.size:
-        binary_blob += delta[start:].astype(np.int8).tostring()
-    return binary_blob
+    delta = np.empty_like(flat)
+    delta[:1] = flat[:1]
+    np.subtract(flat[1:], flat[:-1], out=delta[1:])
+
+    absdelta = np.abs(delta)
+    is16 = absdelta > INT8_MAX
+    is32 = absdelta > INT16_MAX
+    is64 = absdelta > INT32_MAX
+
+    # number of bytes for every element
+    sizes = np.ones(flat.size, dtype=np.int64)
+    sizes[is16] = 1 + 2
+    sizes[is32] = 1 + 2 + 4
+    sizes[is64] = 1 + 2 + 4 + 8
+
+    offsets = np.zeros(flat.size, dtype=np.int64)
+    np.cumsum(sizes[:-1], out=offsets[1:])
+    out = np.empty(int(offsets[-1] + sizes[-1]) if flat.size else 0, dtype=np.uint8)
+
+    is8 = ~is16
+    out[offsets[is8]] = delta[is8].astype(np.int8).view(np.uint8)
+
+    only16 = is16 & ~is32
+    only32 = is32 & ~is64
+
+    for mask, marker, dtype in ((only16, MARKER_INT16, np.int16),
+                                (only32, MARKER_INT32, np.int32),
+                                (is64, MARKER_INT64, np.int64)):
+        if not mask.any():
+            continue
+        off = offsets[mask]
+        out[off[:, None] + np.arange(len(marker))] = np.frombuffer(marker, dtype=np.uint8)
+        _scatter(out, off + len(marker), delta[mask], dtype)
+
+    return out.tobytes()
+
+
+def decByteOffset(stream, size: int = None, dtype=np.int64):
+    """Decompress the byte_offset `stream` (bytes).
+
+    :param size: number of elements, used to check the decoded data
+    :param dtype: dtype of the returned array
+    :return: 1D ndarray
+    """
+    raw = np.frombuffer(stream, dtype=np.uint8)
+    n = raw.size
+
+    # Find the exception markers. Only the 0x80 bytes are visited, the
+    # bulk of the 1-byte deltas are decoded in one go below.
+    markers = []
+    lengths = []
+    end = 0
+    for pos in np.flatnonzero(raw == 0x80):
+        if pos < end:
+            continue  # part of the previous exception
+        if bytes(raw[pos:pos + 3]) != MARKER_INT32:
+            length = 1 + 2
+        elif bytes(raw[pos:pos + 7]) != MARKER_INT64:
+            length = 1 + 2 + 4
+        else:
+            length = 1 + 2 + 4 + 8
+        markers.append(pos)
+        lengths.append(length)
+        end = pos + length
+
+    markers = np.array(markers, dtype=np.int64)
+    lengths = np.array(lengths, dtype=np.int64)
+
+    if len(markers) and markers[-1] + lengths[-1] > n:
+        raise ValueError('Byte offset stream is truncated')
+
+    # bytes that are the start of an element
+    covered = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(covered, markers + 1, 1)
+    np.add.at(covered, markers + lengths, -1)
+    is_start = np.cumsum(covered[:-1]) == 0
+
+    starts = np.flatnonzero(is_start)
+    delta = raw[starts].view(np.int8).astype(np.int64)
+
+    if len(markers):
+        element = np.searchsorted(starts, markers)
+        for length, marker, level in ((1 + 2, MARKER_INT16, np.int16),
+                                      (1 + 2 + 4, MARKER_INT32, np.int32),
+                                      (1 + 2 + 4 + 8, MARKER_INT64, np.int64)):
+            sel = lengths == length
+            if sel.any():
+                delta[element[sel]] = _gather(raw, markers[sel] + len(marker), level)
+
+    if size is not None and delta.size != size:
+        raise ValueError(f'Expected {size} elements, decoded {delta.size}')
+
+    return np.cumsum(delta).astype(dtype)
 
 
 def write(fname, data, header={}):
@@ -113,6 +194,45 @@ def write(fname, data, header={}):
         out_file.write(cbf)
 
 
+def read(fname):
+    """Read a CBF file with byte_offset compressed data, such as those
+    written by `write`.
+
+    :param str fname: name of the file
+    :return: tuple of ndarray and dict with the binary section header
+    """
+    with open(fname, 'rb') as f:
+        cbf = f.read()
+
+    start = cbf.find(STARTER)
+    if start < 0:
+        raise ValueError(f'No binary data section found in {fname}')
+
+    header = {}
+    section = cbf.find(b'--CIF-BINARY-FORMAT-SECTION--')
+    for line in cbf[section:start].splitlines():
+        key, sep, value = line.decode(errors='replace').partition(':')
+        if sep:
+            header[key.strip()] = value.strip().strip('"')
+
+    if b'x-CBF_BYTE_OFFSET' not in cbf[section:start]:
+        raise NotImplementedError(f'Only byte_offset compression is supported ({fname})')
+
+    size = int(header['X-Binary-Size'])
+    dim1 = int(header['X-Binary-Size-Fastest-Dimension'])
+    dim2 = int(header['X-Binary-Size-Second-Dimension'])
+    dtype = DATA_TYPES.get(header.get('X-Binary-Element-Type'), 'int32')
+
+    start += len(STARTER)
+    stream = cbf[start:start + size]
+    if len(stream) != size:
+        raise ValueError(f'Binary data section is truncated ({len(stream)}/{size} bytes)')
+
+    data = decByteOffset(stream, size=dim1 * dim2, dtype=dtype)
+
+    return data.reshape(dim2, dim1), header
+
+
 if __name__ == '__main__':
     arr = np.arange(128 * 128).reshape(128, 128)
     write('a.cbf', arr)
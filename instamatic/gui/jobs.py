@@ -6,7 +6,6 @@ Should be generally applicable.
 import time
 from datetime import datetime
 
-from instamatic.formats import read_tiff
 from instamatic.formats import write_tiff
 
 
@@ -30,6 +29,8 @@ def collect_flatfield(controller, **kwargs):
 
 
 def save_image(controller, **kwargs):
+    from instamatic.processing.flatfield import get_flatfield_corrector
+
     frame = kwargs.get('frame')
 
     module_io = controller.app.get_module('io')
@@ -41,8 +42,9 @@ def save_image(controller, **kwargs):
     outfile = drc / f'frame_{timestamp}.tiff'
 
     try:
-        flatfield, h = read_tiff(module_io.get_flatfield())
-        frame = apply_flatfield_correction(frame, flatfield)
+        corrector = get_flatfield_corrector(module_io.get_flatfield())
+        frame = corrector(frame)
+        h = {'FlatfieldCorrection': True}
     except BaseException:
         frame = frame
         h = {}
@@ -1,6 +1,10 @@
+from collections import namedtuple
+from functools import lru_cache
+
 import numpy as np
-from numpy.fft import fft2
-from numpy.fft import ifft2
+from scipy.fft import fft2
+from scipy.fft import fftfreq
+from scipy.fft import ifft2
 
 
 def translation(im0,
@@ -48,3 +52,187 @@ def translation(im0,
         return [t0, t1], ir
     else:
         return [t0, t1]
+
+
+class RegistrationResult(namedtuple('RegistrationResult', ['shift', 'error', 'phasediff'])):
+    """Result of `ImageRegistration`, unpacks like the return value of
+    `skimage.registration.phase_cross_correlation`.
+
+    shift: np.array
+        Shift (in pixels) required to register the moving image with the
+        reference image
+    error: float
+        Translation invariant normalized RMS error between the images
+    phasediff: float
+        Global phase difference between the images
+
+    The correlation quality is available as `quality`: the normalized
+    height of the correlation peak (0-1), where 1 is a perfect match.
+    """
+
+    def __new__(cls, shift, error, phasediff, quality=None):
+        self = super().__new__(cls, shift, error, phasediff)
+        self.quality = quality
+        return self
+
+
+@lru_cache(maxsize=16)
+def _hann_window(shape: tuple) -> np.ndarray:
+    return np.outer(np.hanning(shape[0]), np.hanning(shape[1]))
+
+
+@lru_cache(maxsize=16)
+def _upsampling_kernel(n: int, upsample_factor: int, size: int) -> (np.ndarray, np.ndarray):
+    """Shift-independent parts of the matrix multiply DFT kernel for an axis
+    of length `n`: exp(-2πi u f) for the `size` output samples `u`, and the
+    frequencies `f`."""
+    freqs = fftfreq(n, upsample_factor)
+    kernel = np.exp(-2j * np.pi * np.arange(size)[:, None] * freqs)
+    return kernel, freqs
+
+
+class ImageRegistration:
+    """Register images against a fixed reference image with subpixel
+    precision (phase cross correlation, Guizar-Sicairos et al., 2008), the
+    same algorithm as `skimage.registration.phase_cross_correlation`.
+
+    The spectrum of the reference image is computed once. The window
+    and the upsampling kernels are cached per image shape, so that
+    repeated registration against the same reference (drift tracking,
+    calibration grids) only needs the FFT of the moving image. Stacks of
+    images can be registered in one go with `register_batch`.
+
+    reference: np.array
+        Reference image
+    upsample_factor: int
+        Images are registered to within 1 / upsample_factor of a pixel
+    normalization: str
+        'phase' for phase correlation, or None for the unnormalized
+        cross correlation
+    window: bool
+        Apply a Hann window to the images to suppress edge effects
+
+    Usage:
+        reg = ImageRegistration(img_ref, upsample_factor=10)
+        shift, error, phasediff = reg.register(img)
+        result = reg.register_batch(stack)  # result.shift is (n, 2)
+    """
+
+    def __init__(self, reference, upsample_factor: int = 10, normalization: str = 'phase', window: bool = False):
+        super().__init__()
+        if normalization not in ('phase', None):
+            raise ValueError('normalization must be either phase or None')
+
+        self.upsample_factor = upsample_factor
+        self.normalization = normalization
+        self.window = window
+        self._last = (None, None)
+
+        self.set_reference(reference)
+
+    def _spectrum(self, images: np.ndarray) -> np.ndarray:
+        images = np.asarray(images, dtype=float)
+        if self.window:
+            images = images * _hann_window(images.shape[-2:])
+        return fft2(images, axes=(-2, -1))
+
+    def set_reference(self, reference) -> None:
+        """Set a new reference image.
+
+        If it is the last image passed to `register`, its spectrum is
+        reused.
+        """
+        last_img, last_spectrum = self._last
+        if reference is last_img:
+            spectrum = last_spectrum
+        else:
+            spectrum = self._spectrum(reference)
+
+        self.reference = reference
+        self.shape = spectrum.shape
+        self._ref_spectrum = spectrum
+        self._ref_amp = np.sum(np.abs(spectrum)**2)
+
+    def register(self, img) -> RegistrationResult:
+        """Register image `img` against the reference."""
+        if np.shape(img) != self.shape:
+            raise ValueError(f'Image shape {np.shape(img)} does not match the reference {self.shape}')
+        spectrum = self._spectrum(img)
+        self._last = (img, spectrum)
+        result = self._register(spectrum[np.newaxis])
+        return RegistrationResult(result.shift[0], result.error[0], result.phasediff[0], result.quality[0])
+
+    def register_batch(self, images) -> RegistrationResult:
+        """Register a stack (n, ny, nx) or list of images against the
+        reference.
+
+        Returns a `RegistrationResult` with arrays: shift (n, 2), error
+        (n,), phasediff (n,), and quality (n,).
+        """
+        images = np.asarray(images)
+        if images.shape[1:] != self.shape:
+            raise ValueError(f'Image shape {images.shape[1:]} does not match the reference {self.shape}')
+        return self._register(self._spectrum(images))
+
+    def _register(self, spectra: np.ndarray) -> RegistrationResult:
+        n = len(spectra)
+        shape = np.array(self.shape)
+
+        product = self._ref_spectrum * spectra.conj()
+        if self.normalization == 'phase':
+            eps = np.finfo(product.real.dtype).eps
+            product /= np.maximum(np.abs(product), 100 * eps)
+
+        # whole-pixel shift from the cross correlation
+        cc = np.abs(ifft2(product, axes=(-2, -1))).reshape(n, -1)
+        maxima = np.stack(np.unravel_index(np.argmax(cc, axis=1), self.shape), axis=1).astype(float)
+        midpoint = np.fix(shape / 2)
+        shift = np.where(maxima > midpoint, maxima - shape, maxima)
+
+        size = product[0].size
+
+        if self.upsample_factor == 1:
+            cc_max = ifft2(product, axes=(-2, -1)).reshape(n, -1)[np.arange(n), np.argmax(cc, axis=1)]
+            peak_height = np.abs(cc_max)
+            ref_amp = self._ref_amp / size
+            amp = np.sum(np.abs(spectra)**2, axis=(1, 2)) / size
+        else:
+            # refine the shift with the matrix multiply DFT around the estimate
+            uf = self.upsample_factor
+            shift = np.round(shift * uf) / uf
+            region_size = int(np.ceil(uf * 1.5))
+            dftshift = np.fix(region_size / 2.0)
+            offsets = dftshift - shift * uf  # (n, 2)
+
+            ky, fy = _upsampling_kernel(self.shape[0], uf, region_size)
+            kx, fx = _upsampling_kernel(self.shape[1], uf, region_size)
+
+            # exp(-2πi (u - offset) f) = exp(-2πi u f) * exp(2πi offset f)
+            ky = ky[np.newaxis] * np.exp(2j * np.pi * offsets[:, 0, None, None] * fy)
+            kx = kx[np.newaxis] * np.exp(2j * np.pi * offsets[:, 1, None, None] * fx)
+
+            data = product.conj()
+            upsampled = (ky @ data @ kx.transpose(0, 2, 1)).conj()  # (n, region_size, region_size)
+
+            flat = np.abs(upsampled).reshape(n, -1)
+            idx = np.argmax(flat, axis=1)
+            cc_max = upsampled.reshape(n, -1)[np.arange(n), idx]
+
+            peak = np.stack(np.unravel_index(idx, upsampled.shape[1:]), axis=1).astype(float)
+            shift = shift + (peak - dftshift) / uf
+            peak_height = np.abs(cc_max) / size  # the matrix multiply DFT is not normalized
+
+            ref_amp = self._ref_amp
+            amp = np.sum(np.abs(spectra)**2, axis=(1, 2))
+
+        shift[:, shape == 1] = 0
+
+        error = np.sqrt(np.abs(1.0 - np.abs(cc_max)**2 / (ref_amp * amp)))
+        phasediff = np.arctan2(cc_max.imag, cc_max.real)
+
+        if self.normalization == 'phase':
+            quality = peak_height
+        else:
+            quality = 1.0 - error**2
+
+        return RegistrationResult(shift, error, phasediff, quality)
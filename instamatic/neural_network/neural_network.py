@@ -2,23 +2,46 @@ import pickle
 from pathlib import Path
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
 with open(Path(__file__).parent / 'weights-py3.p', 'rb') as p_file:
     weights = pickle.load(p_file)
 
+BATCH_SIZE = 16
+
+
+def im2col(in_layer, k=3):
+    """Strided (N, H-k+1, W-k+1, k, k, C) view of the k*k patches of a batch
+    of (N, H, W, C) layers, no data are copied."""
+    n, h, w, c = in_layer.shape
+    s0, s1, s2, s3 = in_layer.strides
+    return as_strided(in_layer,
+                      shape=(n, h - k + 1, w - k + 1, k, k, c),
+                      strides=(s0, s1, s2, s1, s2, s3),
+                      writeable=False)
+
+
+def conv_layer_batch(in_layer, weight, offset):
+    """3x3 convolution (valid) of a batch of (N, H, W, C) layers with `weight`
+    (3, 3, C, K), returns (N, H-2, W-2, K)."""
+    patches = im2col(np.ascontiguousarray(in_layer))
+    n, h, w = patches.shape[:3]
+    cols = patches.reshape(n * h * w, -1)  # copies the patches into a single matrix
+    convoluted = cols @ weight.reshape(cols.shape[1], -1)
+    convoluted += offset
+    return convoluted.reshape(n, h, w, -1)
+
+
+def max_pooling_batch(convoluted):
+    """2x2 max pooling of a batch of (N, H, W, C) layers."""
+    n, h, w, c = convoluted.shape
+    h2, w2 = h // 2, w // 2
+    blocks = convoluted[:, :h2 * 2, :w2 * 2].reshape(n, h2, 2, w2, 2, c)
+    return blocks.max(axis=(2, 4))
 
-def conv_layer(in_layer, weight, offset):
-    first_layer = np.ones([(in_layer.shape[0] - 2) * (in_layer.shape[1] - 2), in_layer.shape[2], 3, 3])
-    q = 0
-    for n in range(in_layer.shape[0] - 2):
-        for p in range(in_layer.shape[1] - 2):
-            first_layer[q] = np.transpose(in_layer[n:n + 3, p:p + 3], [2, 0, 1])
-            q += 1
-    convoluted = np.tensordot(first_layer, weight, axes=(((2, 3, 1), (0, 1, 2))))
-    convoluted_reshaped = convoluted.reshape([in_layer.shape[0] - 2, in_layer.shape[1] - 2, 64])
-    convoluted_reshaped += offset
 
-    return convoluted_reshaped
+def conv_layer(in_layer, weight, offset):
+    return conv_layer_batch(in_layer[np.newaxis], weight, offset)[0]
 
 
 def relu(convoluted):
@@ -27,29 +50,42 @@ def relu(convoluted):
 
 
 def max_pooling(convoluted):
-    pooled = np.ones((convoluted.shape[0] // 2, convoluted.shape[1] // 2, convoluted.shape[2]))
-    for n in range(convoluted.shape[0] // 2):
-        for p in range(convoluted.shape[1] // 2):
-            pooled[n, p] = np.amax(convoluted[n * 2:n * 2 + 2, p * 2:p * 2 + 2], axis=(0, 1))
-    return pooled
+    return max_pooling_batch(convoluted[np.newaxis])[0]
 
 
 def logistic(x):
     return 1 / (1 + np.exp(-x))
 
 
+def _predict_batch(images, weights):
+    layer = images
+    for i in range(0, 8, 2):
+        layer = max_pooling_batch(relu(conv_layer_batch(layer, weights[i], weights[i + 1])))
+    convoluted5 = relu(conv_layer_batch(layer, weights[8], weights[9]))
+    flattened = convoluted5.reshape((len(images), 1600))
+    dense1 = relu(flattened @ weights[10] + weights[11])
+    dense2 = relu(dense1 @ weights[12] + weights[13])
+    dense3 = dense2 @ weights[14] + weights[15]
+    return logistic(dense3)[:, 0]
+
+
+def predict_batch(images, weights=weights, batch_size: int = BATCH_SIZE):
+    """Predict the crystal quality for a batch of preprocessed images (N, 150,
+    150, 1), see `preprocess`.
+
+    The images are processed in chunks of `batch_size` to limit the
+    memory used by the patch matrices. Returns an array with N
+    predictions.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    if images.ndim == 3:
+        images = images[..., np.newaxis]
+
+    ret = np.empty(len(images))
+    for start in range(0, len(images), batch_size):
+        ret[start:start + batch_size] = _predict_batch(images[start:start + batch_size], weights)
+    return ret
+
+
 def predict(image, weights=weights):
-    convoluted1 = relu(conv_layer(image, weights[0], weights[1]))
-    pooled1 = max_pooling(convoluted1)
-    convoluted2 = relu(conv_layer(pooled1, weights[2], weights[3]))
-    pooled2 = max_pooling(convoluted2)
-    convoluted3 = relu(conv_layer(pooled2, weights[4], weights[5]))
-    pooled3 = max_pooling(convoluted3)
-    convoluted4 = relu(conv_layer(pooled3, weights[6], weights[7]))
-    pooled4 = max_pooling(convoluted4)
-    convoluted5 = relu(conv_layer(pooled4, weights[8], weights[9]))
-    flattened = convoluted5.reshape((1, 1600))
-    dense1 = relu(np.tensordot(flattened, weights[10], axes=(1, 0)) + weights[11])
-    dense2 = relu(np.tensordot(dense1, weights[12], axes=(1, 0)) + weights[13])
-    dense3 = np.tensordot(dense2, weights[14], axes=(1, 0)) + weights[15]
-    return logistic(dense3)[0][0]
+    return predict_batch(image[np.newaxis], weights=weights)[0]
@@ -1,6 +1,8 @@
 import collections
+import concurrent.futures
 import logging
 import time
+import weakref
 from datetime import datetime
 from math import cos
 
@@ -12,9 +14,11 @@ from instamatic.formats import write_adsc
 from instamatic.formats import write_mrc
 from instamatic.formats import write_tiff
 from instamatic.processing.flatfield import apply_flatfield_correction
+from instamatic.processing.flatfield import FlatfieldCorrector
 from instamatic.processing.stretch_correction import affine_transform_ellipse_to_circle
 from instamatic.tools import find_beam_center
 from instamatic.tools import find_beam_center_with_beamstop
+from instamatic.tools import find_beam_centers
 from instamatic.tools import find_subranges
 from instamatic.tools import to_xds_untrusted_area
 
@@ -101,6 +105,76 @@ def get_calibrated_rotation_speed(val):
     return calibrated_value
 
 
+def _attach_stack(name: str, shape: tuple, dtype: str):
+    """Attach to the image stack in shared memory `name`."""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    stack = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shm, stack
+
+
+def _release_stack(shm) -> None:
+    """Free the shared memory block holding the image stack."""
+    try:
+        shm.close()
+    except BufferError:
+        pass  # still referenced by views into the data, freed with the process
+    shm.unlink()
+
+
+def _flatfield_chunk(name: str, shape: tuple, dtype: str, start: int, stop: int, corrector: FlatfieldCorrector) -> None:
+    """Apply the flatfield correction to frames `start:stop` of the shared
+    stack in place."""
+    shm, stack = _attach_stack(name, shape, dtype)
+    try:
+        chunk = stack[start:stop]
+        corrector.correct(chunk, out=chunk)
+    finally:
+        del stack, chunk
+        shm.close()
+
+
+def _beam_centers_chunk(name: str, shape: tuple, dtype: str, start: int, stop: int, use_beamstop: bool) -> np.ndarray:
+    """Find the beam centers for frames `start:stop` of the shared stack."""
+    shm, stack = _attach_stack(name, shape, dtype)
+    try:
+        chunk = stack[start:stop]
+        if use_beamstop:
+            return np.array([find_beam_center_with_beamstop(img, z=99) for img in chunk])
+        else:
+            return find_beam_centers(chunk, sigma=10)
+    finally:
+        del stack, chunk
+        shm.close()
+
+
+def _write_chunk(img_conv, name: str, shape: tuple, dtype: str, items: list,
+                 tiff_path=None, smv_path=None, mrc_path=None) -> None:
+    """Write frames `items` (list of (stack index, sequence number)) of the
+    shared stack using the writers of `img_conv`."""
+    shm, stack = _attach_stack(name, shape, dtype)
+    try:
+        img_conv.data = {i: stack[k] for k, i in items}
+        for k, i in items:
+            if tiff_path is not None:
+                img_conv.write_tiff(tiff_path, i)
+            if mrc_path is not None:
+                img_conv.write_mrc(mrc_path, i)
+            if smv_path is not None:
+                img_conv.write_smv(smv_path, i)
+    finally:
+        img_conv.data = {}
+        del stack
+        shm.close()
+
+
+def _chunks(n: int, workers: int) -> list:
+    """Split `n` frames into (start, stop) chunks for `workers` processes."""
+    nchunks = min(n, workers * 4)
+    bounds = np.linspace(0, n, nchunks + 1).astype(int)
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
 class ImgConversion:
     """This class is for post RED/cRED data collection image conversion. Files
     can be generated for REDp, DIALS, XDS, and PETS.
@@ -108,6 +182,11 @@ class ImgConversion:
     The image buffer is passed as a list of tuples, where each tuple
     contains the index (int), image data (2D numpy array),
     metadata/header (dict). The buffer index must start at 1.
+
+    The frames are stacked in a single 3D array. If `processes` is
+    given, the stack is placed in shared memory, and the flatfield
+    correction, beam center search, and writing of the data files are
+    distributed over a pool of `processes` worker processes.
     """
 
     def __init__(self,
@@ -119,25 +198,16 @@ class ImgConversion:
                  rotation_axis: float,           # radians, specifies the position of the rotation axis
                  acquisition_time: float,        # seconds, acquisition time (exposure time + overhead)
                  flatfield: str = 'flatfield.tiff',
+                 processes: int = None,          # number of worker processes, None to run in this process
                  ):
         if flatfield is not None:
             flatfield, h = read_tiff(flatfield)
         self.flatfield = flatfield
 
-        self.headers = {}
-        self.data = {}
-
         self.smv_subdrc = 'data'
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
-
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
+        self.processes = processes
+        self.load_buffer(buffer)
 
         self.untrusted_areas = []
 
@@ -145,7 +215,6 @@ class ImgConversion:
         self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
         self.missing_range = self.observed_range ^ self.complete_range
 
-        self.data_shape = img.shape
         try:
             self.pixelsize = config.calibration['diff']['pixelsize'][camera_length]  # px / Angstrom
         except KeyError:
@@ -179,6 +248,89 @@ class ImgConversion:
         self.mean_beam_center, self.beam_center_std = self.get_beam_centers()
         logger.debug(f'Primary beam at: {self.mean_beam_center}')
 
+    def __getstate__(self):
+        """Leave out the image data when sending the object to the worker
+        processes."""
+        state = self.__dict__.copy()
+        for key in ('data', '_stack', '_shm', '_executor', '_finalizer'):
+            state.pop(key, None)
+        return state
+
+    def _get_executor(self):
+        if getattr(self, '_executor', None) is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.processes)
+        return self._executor
+
+    def load_buffer(self, buffer: list) -> None:
+        """Stack the frames from `buffer` into a single 3D array, and apply
+        the flatfield correction.
+
+        Sets `self.data` (views into the stack) and `self.headers`,
+        the buffer is emptied.
+        """
+        self.headers = {}
+        self.data = {}
+
+        i, img, h = buffer[0]
+        n = len(buffer)
+        shape = img.shape
+
+        apply_flatfield = self.flatfield is not None
+        if apply_flatfield and self.flatfield.shape != shape:
+            logger.warning(f'Flatfield not applied: image {shape} and flatfield {self.flatfield.shape} do not match shapes.')
+            apply_flatfield = False
+
+        dtype = np.result_type(img.dtype, self.flatfield.dtype, float) if apply_flatfield else img.dtype
+
+        if self.processes:
+            from multiprocessing import shared_memory
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, n * img.nbytes // img.dtype.itemsize * dtype.itemsize))
+            self._finalizer = weakref.finalize(self, _release_stack, self._shm)
+            self._stack = np.ndarray((n, *shape), dtype=dtype, buffer=self._shm.buf)
+        else:
+            self._shm = None
+            self._stack = np.empty((n, *shape), dtype=dtype)
+
+        k = 0
+        while len(buffer) != 0:
+            i, img, h = buffer.pop(0)
+            if img.shape != shape:
+                raise ValueError(f'Frame {i} has a different shape ({img.shape}) than the first frame ({shape})')
+
+            self.headers[i] = h
+            self._stack[k] = img
+            self.data[i] = self._stack[k]
+            k += 1
+
+        if apply_flatfield:
+            corrector = FlatfieldCorrector(self.flatfield, deadpixels=[])
+            if self._shm:
+                self._map_stack(_flatfield_chunk, corrector)
+            else:
+                corrector.correct(self._stack, out=self._stack)
+
+        self.data_shape = shape
+
+    def _map_stack(self, func, *args) -> list:
+        """Run `func` on chunks of the shared stack in the process pool,
+        returns the results in order."""
+        stack = self._stack
+        executor = self._get_executor()
+        futures = [executor.submit(func, self._shm.name, stack.shape, stack.dtype.str, start, stop, *args)
+                   for start, stop in _chunks(len(stack), self.processes)]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        """Shut down the worker processes and free the shared memory."""
+        if getattr(self, '_executor', None) is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if getattr(self, '_shm', None) is not None:
+            self.data = {}
+            self._stack = None
+            self._finalizer()
+            self._shm = None
+
     def check_settings(self) -> None:
         """Check for the presence of all required attributes.
 
@@ -232,22 +384,32 @@ class ImgConversion:
         """Obtain beam centers from the diffraction data Returns a tuple with
         the median beam center and its standard deviation."""
         shape_x, shape_y = self.data_shape
-        centers = []
-        for i, h in self.headers.items():
-            if self.use_beamstop:
-                cx, cy = find_beam_center_with_beamstop(self.data[i], z=99)
-            else:
-                cx, cy = find_beam_center(self.data[i], sigma=10)
 
-            if invert_x:
-                cx = shape_x - cx
-            if invert_y:
-                cy = shape_y - cy
+        stack = getattr(self, '_stack', None)
+        if stack is None:
+            # data set by a subclass without `load_buffer`
+            keys = list(self.headers.keys())
+            stack = np.stack([self.data[i] for i in keys])
+        else:
+            keys = list(self.data.keys())
+
+        if getattr(self, '_shm', None) is not None:
+            beam_centers = np.concatenate(self._map_stack(_beam_centers_chunk, self.use_beamstop))
+        elif self.use_beamstop:
+            beam_centers = np.array([find_beam_center_with_beamstop(img, z=99) for img in stack])
+        else:
+            beam_centers = find_beam_centers(stack, sigma=10)
 
-            h['beam_center'] = (cx, cy)
-            centers.append((cx, cy))
+        beam_centers = beam_centers.astype(float)
+        if invert_x:
+            beam_centers[:, 0] = shape_x - beam_centers[:, 0]
+        if invert_y:
+            beam_centers[:, 1] = shape_y - beam_centers[:, 1]
 
-        self._beam_centers = beam_centers = np.array(centers)
+        for i, (cx, cy) in zip(keys, beam_centers):
+            self.headers[i]['beam_center'] = (float(cx), float(cy))
+
+        self._beam_centers = beam_centers
 
         # avg_center = np.mean(centers, axis=0)
         median_center = np.median(beam_centers, axis=0)
@@ -335,6 +497,8 @@ class ImgConversion:
 
         If a path is given, write data in the corresponding format, i.e.
         if `tiff_path` is specified TIFF files are written to that path.
+        In process pool mode (`processes`), the files are written by the
+        worker processes instead.
         """
         write_tiff = tiff_path is not None
         write_smv = smv_path is not None
@@ -353,7 +517,17 @@ class ImgConversion:
             mrc_path.mkdir(exist_ok=True, parents=True)
             logger.debug(f'MRC files saved in folder: {mrc_path}')
 
-        import concurrent.futures
+        if getattr(self, '_shm', None) is not None:
+            # frames are in shared memory, write them from the process pool
+            items = list(enumerate(self.data.keys()))
+            executor = self._get_executor()
+            futures = [executor.submit(_write_chunk, self, self._shm.name, self._stack.shape, self._stack.dtype.str,
+                                       items[start:stop], tiff_path, smv_path, mrc_path)
+                       for start, stop in _chunks(len(items), self.processes)]
+            for future in futures:
+                future.result()
+            return
+
         with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
             futures = []
             for i in self.observed_range:
@@ -384,7 +558,7 @@ class ImgConversion:
         path = smv_path / self.smv_subdrc
 
         i = min(observed_range)
-        empty = np.zeros_like(self.data[i])
+        empty = np.zeros(self.data_shape, dtype=np.uint16)
         # copy header from first frame
         h = self.headers[i].copy()
         h['ImageGetTime'] = time.time()
@@ -425,10 +599,20 @@ class ImgConversion:
         Returns the path to the written image.
         """
         img = self.data[i]
-        h = self.headers[i]
 
         img = np.ushort(img)
-        shape_x, shape_y = img.shape
+
+        header = self.get_smv_header(i, img.shape)
+        fn = path / f'{i:05d}.img'
+        write_adsc(fn, img, header=header)
+        return fn
+
+    def get_smv_header(self, i: int, shape: tuple) -> dict:
+        """Return the SMV header for the image with sequence number `i` and
+        shape `shape`."""
+        h = self.headers[i]
+
+        shape_x, shape_y = shape
 
         phi = self.start_angle + self.osc_angle * (i - 1)
 
@@ -459,7 +643,7 @@ class ImgConversion:
         header['TIME'] = str(h['ImageExposureTime'])
         header['DISTANCE'] = f'{self.distance:.4f}'
         header['TWOTHETA'] = 0.00
-        header['PHI'] = '{phi:.4f}'
+        header['PHI'] = f'{phi:.4f}'
         header['OSC_START'] = f'{phi:.4f}'
         header['OSC_RANGE'] = f'{self.osc_angle:.4f}'
         header['WAVELENGTH'] = f'{self.wavelength:.4f}'
@@ -468,9 +652,7 @@ class ImgConversion:
         header['BEAM_CENTER_Y'] = f'{mean_beam_center[0]:.4f}'
         header['DENZO_X_BEAM'] = f'{mean_beam_center[0]*self.physical_pixelsize:.4f}'
         header['DENZO_Y_BEAM'] = f'{mean_beam_center[1]*self.physical_pixelsize:.4f}'
-        fn = path / f'{i:05d}.img'
-        write_adsc(fn, img, header=header)
-        return fn
+        return header
 
     def write_mrc(self, path: str, i: int) -> str:
         """Write the image+header with sequence number `i` to the directory
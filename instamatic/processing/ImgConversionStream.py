@@ -0,0 +1,188 @@
+import concurrent.futures
+import threading
+
+from .ImgConversionTPX import *
+from instamatic.formats import update_adsc_header
+
+
+class ImgConversionStream(ImgConversionTPX):
+    """Streaming version of `ImgConversionTPX` for cRED data collection.
+
+    Instead of passing the complete image buffer at the end of the
+    experiment, frames are passed to `ImgConversionStream.put` as they
+    are collected. They are corrected and written to TIFF/SMV/MRC in a
+    pool of background threads, after which the image data are
+    discarded, so that at most `max_pending` frames are held in memory.
+    `put` blocks if the writers cannot keep up.
+
+    Parameters that are only known at the end of the rotation (angles,
+    timings) are passed to `ImgConversionStream.finalize` once the last
+    frame has been collected. This also updates the SMV headers in
+    place. Afterwards, the input files for XDS/DIALS/PETS/REDp can be
+    written with the usual methods (`write_xds_inp`, `to_dials`, ...).
+
+    If writing a frame fails, the error is raised by the next call to
+    `put`. Call `close` (also done by `finalize`) to stop the writer
+    threads if the collection is aborted.
+    """
+
+    def __init__(self,
+                 tiff_path: str = None,
+                 smv_path: str = None,
+                 mrc_path: str = None,
+                 flatfield: str = 'flatfield.tiff',
+                 workers: int = 4,
+                 max_pending: int = 32,
+                 ):
+        self.setup_detector(flatfield)
+        if self.flatfield is not None:
+            self.corrector = FlatfieldCorrector(self.flatfield, deadpixels=[])
+        else:
+            self.corrector = None
+
+        self.headers = {}
+        self.data = {}
+        self.data_shape = None
+
+        self.tiff_path = tiff_path
+        self.smv_path = smv_path
+        self.mrc_path = mrc_path
+
+        if tiff_path is not None:
+            tiff_path.mkdir(exist_ok=True, parents=True)
+            logger.debug(f'Tiff files saved in folder: {tiff_path}')
+
+        if smv_path is not None:
+            self.smv_data_path = smv_path / self.smv_subdrc
+            self.smv_data_path.mkdir(exist_ok=True, parents=True)
+            logger.debug(f'SMV files saved in folder: {self.smv_data_path}')
+
+        if mrc_path is not None:
+            mrc_path.mkdir(exist_ok=True, parents=True)
+            logger.debug(f'MRC files saved in folder: {mrc_path}')
+
+        self._lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._error = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        # provisional values for the SMV headers, updated in `finalize`
+        self.start_angle = 0.0
+        self.osc_angle = 0.0
+        self.mean_beam_center = (0.0, 0.0)
+        self.physical_pixelsize = config.camera.physical_pixelsize
+        self.wavelength = config.microscope.wavelength
+        self.distance = 0.0
+
+    def put(self, i: int, img, h: dict) -> None:
+        """Add the image `img` with header `h` and sequence number `i` (must
+        start at 1). Raises the error of a frame that could not be written."""
+        if self._error is not None:
+            raise self._error
+        self._pending.acquire()
+        future = self._executor.submit(self._process, i, img, h)
+        future.add_done_callback(self._done)
+        self._futures.append(future)
+
+    def _done(self, future) -> None:
+        self._pending.release()
+        if not future.cancelled() and future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def _process(self, i: int, img, h: dict) -> None:
+        """Correct the frame, find the beam center, and write it to all
+        requested formats."""
+        if self.corrector is not None:
+            img = self.corrector(img)
+
+        cx, cy = find_beam_center(img, sigma=10)
+        h['beam_center'] = (cx, cy)
+
+        with self._lock:
+            self.headers[i] = h
+            self.data_shape = img.shape
+            self.data[i] = img
+
+        try:
+            if self.tiff_path is not None:
+                self.write_tiff(self.tiff_path, i)
+            if self.mrc_path is not None:
+                self.write_mrc(self.mrc_path, i)
+            if self.smv_path is not None:
+                self.write_smv(self.smv_data_path, i)
+        finally:
+            with self._lock:
+                del self.data[i]
+
+    def wait(self) -> None:
+        """Wait for all frames to be written, re-raises the first error."""
+        for future in self._futures:
+            future.result()
+
+    def close(self) -> None:
+        """Wait for all frames to be written and stop the writer threads, can
+        be called more than once."""
+        if self._executor is None:
+            return
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+
+    def finalize(self,
+                 osc_angle: float,                  # degrees, oscillation angle of the rotation
+                 start_angle: float,                # degrees, start angle of the rotation
+                 end_angle: float,                  # degrees, end angle of the rotation
+                 rotation_axis: float,              # radians, specifies the position of the rotation axis
+                 acquisition_time: float,           # seconds, acquisition time (exposure time + overhead)
+                 pixelsize: float = None,           # p/Angstrom, size of the pixels (overrides camera_length)
+                 physical_pixelsize: float = None,  # mm, physical size of the pixels (overrides camera length)
+                 wavelength: float = None,          # Angstrom, relativistic wavelength of the electron beam
+                 stretch_amplitude=0.0,             # Stretch correction amplitude, %
+                 stretch_azimuth=0.0,               # Stretch correction azimuth, degrees
+                 ) -> None:
+        """Wait for the last frames to be written, and set the parameters of
+        the rotation.
+
+        The SMV headers are updated with the final values.
+        """
+        self.close()
+
+        if not self.headers:
+            raise ValueError('No frames have been collected')
+
+        self.observed_range = set(self.headers.keys())
+        self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
+        self.missing_range = self.observed_range ^ self.complete_range
+
+        self.pixelsize = pixelsize
+        self.physical_pixelsize = physical_pixelsize
+        self.wavelength = wavelength
+
+        centers = [self.headers[i]['beam_center'] for i in sorted(self.observed_range)]
+        self._beam_centers = beam_centers = np.array(centers)
+        self.mean_beam_center = np.median(beam_centers, axis=0)
+        self.beam_center_std = np.std(beam_centers, axis=0)
+
+        self.stretch_azimuth = stretch_azimuth
+        self.stretch_amplitude = stretch_amplitude
+        self.do_stretch_correction = self.stretch_amplitude != 0
+
+        self.distance = (1 / self.wavelength) * (self.physical_pixelsize / self.pixelsize)
+        self.osc_angle = osc_angle
+        self.start_angle = start_angle
+        self.end_angle = end_angle
+        self.rotation_axis = rotation_axis
+
+        self.acquisition_time = acquisition_time
+
+        logger.debug(f'Primary beam at: {self.mean_beam_center}')
+
+        self.check_settings()
+
+        if self.smv_path is not None:
+            for i in self.observed_range:
+                fn = self.smv_data_path / f'{i:05d}.img'
+                update_adsc_header(fn, self.get_smv_header(i, self.data_shape))
@@ -23,40 +23,21 @@ class ImgConversionTPX(ImgConversion):
                  wavelength: float = None,          # Angstrom, relativistic wavelength of the electron beam
                  stretch_amplitude=0.0,             # Stretch correction amplitude, %
                  stretch_azimuth=0.0,               # Stretch correction azimuth, degrees
+                 processes: int = None,             # number of worker processes, None to run in this process
                  ):
-        if flatfield is not None:
-            flatfield, h = read_tiff(flatfield)
-        self.flatfield = flatfield
-
-        self.headers = {}
-        self.data = {}
-
-        self.smv_subdrc = 'data'
-
-        self.untrusted_areas = [('rectangle', ((0, 255), (517, 262))),
-                                ('rectangle', ((255, 0), (262, 517)))]
-
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
+        self.setup_detector(flatfield)
 
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
+        self.processes = processes
+        self.load_buffer(buffer)
 
         self.observed_range = set(self.data.keys())
         self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
         self.missing_range = self.observed_range ^ self.complete_range
 
-        self.data_shape = img.shape
-
         self.pixelsize = pixelsize
         self.physical_pixelsize = physical_pixelsize
         self.wavelength = wavelength
 
-        self.use_beamstop = False
         self.mean_beam_center, self.beam_center_std = self.get_beam_centers()
 
         # Stretch correction parameters
@@ -75,9 +56,23 @@ class ImgConversionTPX(ImgConversion):
 
         logger.debug(f'Primary beam at: {self.mean_beam_center}')
 
+        self.check_settings()
+
+    def setup_detector(self, flatfield: str = None) -> None:
+        """Set up the TimePix specific parameters, and read the `flatfield`
+        image."""
+        if flatfield is not None:
+            flatfield, h = read_tiff(flatfield)
+        self.flatfield = flatfield
+
+        self.smv_subdrc = 'data'
+
+        self.untrusted_areas = [('rectangle', ((0, 255), (517, 262))),
+                                ('rectangle', ((255, 0), (262, 517)))]
+
+        self.use_beamstop = False
+
         self.name = 'TimePix_SU'
 
         from .XDS_templateTPX import XDS_template
         self.XDS_template = XDS_template
-
-        self.check_settings()
@@ -21,25 +21,16 @@ class ImgConversionTVIPS(ImgConversion):
                  pixelsize: float = None,          # p/Angstrom, size of the pixels (overrides camera_length)
                  physical_pixelsize: float = None,  # mm, physical size of the pixels (overrides camera length)
                  wavelength: float = None,         # Angstrom, relativistic wavelength of the electron beam
+                 processes: int = None,            # number of worker processes, None to run in this process
                  ):
         if flatfield is not None:
             flatfield, h = read_tiff(flatfield)
         self.flatfield = flatfield
 
-        self.headers = {}
-        self.data = {}
-
         self.smv_subdrc = 'data'
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
-
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
+        self.processes = processes
+        self.load_buffer(buffer)
 
         self.untrusted_areas = []
 
@@ -47,8 +38,6 @@ class ImgConversionTVIPS(ImgConversion):
         self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
         self.missing_range = self.observed_range ^ self.complete_range
 
-        self.data_shape = img.shape
-
         self.pixelsize = pixelsize
         self.physical_pixelsize = physical_pixelsize
         self.wavelength = wavelength
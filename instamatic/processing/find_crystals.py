@@ -1,5 +1,7 @@
+import concurrent.futures
 import sys
 from collections import namedtuple
+from functools import lru_cache
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -49,6 +51,12 @@ def whiten(obs, check_finite=False):
     return obs / std_dev, std_dev
 
 
+@lru_cache(maxsize=8)
+def disk(radius: int) -> np.ndarray:
+    """Cached structuring element for the morphology operations."""
+    return morphology.disk(radius)
+
+
 def segment_crystals(img, r=101, offset=5, footprint=5, remove_carbon_lacing=True):
     """
     r: `int`
@@ -73,17 +81,17 @@ def segment_crystals(img, r=101, offset=5, footprint=5, remove_carbon_lacing=Tru
     arr = morphology.remove_small_objects(arr, min_size=4 * 4, connectivity=0)  # remove noise
 
     # magic
-    arr = morphology.binary_closing(arr, morphology.disk(footprint))  # dilation + erosion
-    arr = morphology.binary_erosion(arr, morphology.disk(footprint))  # erosion
+    arr = morphology.binary_closing(arr, disk(footprint))  # dilation + erosion
+    arr = morphology.binary_erosion(arr, disk(footprint))  # erosion
 
     # remove carbon lines
     if remove_carbon_lacing:
         arr = morphology.remove_small_objects(arr, min_size=8 * 8, connectivity=0)
         arr = morphology.remove_small_holes(arr, min_size=32 * 32, connectivity=0)
-    arr = morphology.binary_dilation(arr, morphology.disk(footprint))  # dilation
+    arr = morphology.binary_dilation(arr, disk(footprint))  # dilation
 
     # get background pixels
-    bkg = np.invert(morphology.binary_dilation(arr, morphology.disk(footprint * 2)) | arr)
+    bkg = np.invert(morphology.binary_dilation(arr, disk(footprint * 2)) | arr)
 
     # 2: features
     # 1: background
@@ -97,8 +105,9 @@ def segment_crystals(img, r=101, offset=5, footprint=5, remove_carbon_lacing=Tru
     return arr, segmented
 
 
-def find_crystals_timepix(img, magnification, spread=0.6, plot=False, **kwargs):
-    """Specialized function with better defaults for timepix camera."""
+def timepix_kwargs(**kwargs) -> dict:
+    """Keywords for `segment_crystals` with better defaults for the timepix
+    camera."""
     r = kwargs.get('r', 75)
 
     # 'offset' determines sensitivity of thresholding
@@ -107,43 +116,42 @@ def find_crystals_timepix(img, magnification, spread=0.6, plot=False, **kwargs):
     offset = kwargs.get('offset', 15)
     footprint = kwargs.get('footprint', 3)
 
+    return {'footprint': footprint, 'offset': offset, 'r': r, 'remove_carbon_lacing': False}
+
+
+def find_crystals_timepix(img, magnification, spread=0.6, plot=False, **kwargs):
+    """Specialized function with better defaults for timepix camera."""
     return find_crystals(img=img,
                          magnification=magnification,
                          spread=spread,
                          plot=plot,
-                         footprint=footprint,
-                         offset=offset,
-                         r=r,
-                         remove_carbon_lacing=False)
+                         **timepix_kwargs(**kwargs))
 
 
-def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
-    """Function for finding crystals in a low contrast images. Used adaptive
-    thresholds to find local features. Edges are detected, and rejected, on the
-    basis of a histogram. Kmeans clustering is used to spread points over the
-    segmented area.
+def locate_crystals(img, scale: float, pixelsize: float, spread: float = 2.0, return_segmentation: bool = False, **kwargs):
+    """Segment the autoscaled image `img` and locate the crystals, see
+    `find_crystals`.
 
     img: 2d np.ndarray
-        Input image to locate crystals on
-    magnification: float
-        value indicating the magnification used, needed in order to determine the size of the crystals
+        Image scaled down by `scale` (see `instamatic.image_utils.autoscale`)
+    scale: float
+        Scale of the image, used to return the coordinates in the original image
+    pixelsize: float
+        Size of the pixels in the original image in micrometer
     spread: float
         Value in micrometer to roughly indicate the desired spread of centroids over individual regions
-    plot: bool
-        Whether to plot the results or not
+    return_segmentation: bool
+        Also return the segmented image
     **kwargs:
     keywords to pass to segment_crystals
     """
-    img, scale = autoscale(img, maxdim=256)  # scale down for faster
-
     # segment the image, and find objects
     arr, seg = segment_crystals(img, **kwargs)
 
     labels, numlabels = ndimage.label(seg)
     props = measure.regionprops(labels, img)
 
-    # calculate the pixel dimensions in micrometer
-    px = py = calibration['mag1']['pixelsize'][magnification] / 1000  # nm -> um
+    px = py = pixelsize
 
     iters = 20
 
@@ -179,6 +187,35 @@ def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
             x, y = prop.centroid
             crystals.append(CrystalPosition(x / scale, y / scale, True, nclust, area, prop.area))
 
+    if return_segmentation:
+        return crystals, seg
+    return crystals
+
+
+def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
+    """Function for finding crystals in a low contrast images. Used adaptive
+    thresholds to find local features. Edges are detected, and rejected, on the
+    basis of a histogram. Kmeans clustering is used to spread points over the
+    segmented area.
+
+    img: 2d np.ndarray
+        Input image to locate crystals on
+    magnification: float
+        value indicating the magnification used, needed in order to determine the size of the crystals
+    spread: float
+        Value in micrometer to roughly indicate the desired spread of centroids over individual regions
+    plot: bool
+        Whether to plot the results or not
+    **kwargs:
+    keywords to pass to segment_crystals
+    """
+    img, scale = autoscale(img, maxdim=256)  # scale down for faster
+
+    # calculate the pixel dimensions in micrometer
+    pixelsize = calibration['mag1']['pixelsize'][magnification] / 1000  # nm -> um
+
+    crystals, seg = locate_crystals(img, scale, pixelsize, spread=spread, return_segmentation=True, **kwargs)
+
     if plot:
         plt.imshow(img)
         plt.contour(seg, [0.5], linewidths=1.2, colors='yellow')
@@ -192,6 +229,90 @@ def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
     return crystals
 
 
+class CrystalFinder:
+    """Find crystals in batches of images using a pool of worker processes.
+
+    The setup (calibrated pixelsize, segmentation parameters) is shared
+    between all images, and stacks of images are scaled down in a single
+    pass before they are sent to the workers, where the segmentation and
+    clustering run in parallel. Results are returned as lists of
+    `CrystalPosition`, in the same coordinates as `find_crystals`.
+
+    magnification: float
+        Magnification of the images, determines the size of the crystals
+    spread: float
+        Value in micrometer to roughly indicate the desired spread of centroids over individual regions
+    timepix: bool
+        Use the defaults of `find_crystals_timepix`
+    processes: int
+        Number of worker processes, defaults to the number of cores
+    **kwargs:
+    keywords to pass to segment_crystals
+
+    Usage:
+        with CrystalFinder(magnification=2500, timepix=True) as finder:
+            future = finder.submit(img)   # does not block
+            ...
+            crystals = future.result()
+
+            for i, crystals in finder.find_all(stack):   # in order of completion
+                ...
+    """
+
+    def __init__(self, magnification, spread: float = None, timepix: bool = False, processes: int = None, **kwargs):
+        super().__init__()
+        if timepix:
+            kwargs = timepix_kwargs(**kwargs)
+        if spread is None:
+            spread = 0.6 if timepix else 2.0
+
+        self.magnification = magnification
+        self.spread = spread
+        self.kwargs = kwargs
+        self.pixelsize = calibration['mag1']['pixelsize'][magnification] / 1000  # nm -> um
+        self.maxdim = 256
+
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def _submit_scaled(self, img, scale: float) -> concurrent.futures.Future:
+        return self._executor.submit(locate_crystals, img, scale, self.pixelsize, spread=self.spread, **self.kwargs)
+
+    def submit(self, img) -> concurrent.futures.Future:
+        """Start looking for crystals in `img`, returns a future with the
+        list of `CrystalPosition`."""
+        img, scale = autoscale(img, maxdim=self.maxdim)
+        return self._submit_scaled(img, scale)
+
+    def find(self, img) -> list:
+        """Find the crystals in `img` (blocking)."""
+        return self.submit(img).result()
+
+    def find_all(self, images):
+        """Find the crystals in a stack (3D array) or list of images.
+
+        Yields tuples `(i, crystals)` as soon as each image has been
+        processed, so the order is not guaranteed.
+        """
+        if isinstance(images, np.ndarray) and images.ndim == 3:
+            scale = float(self.maxdim) / max(images.shape[1:])
+            scaled = ndimage.zoom(images, (1, scale, scale), order=1)
+            futures = {self._submit_scaled(img, scale): i for i, img in enumerate(scaled)}
+        else:
+            futures = {self.submit(img): i for i, img in enumerate(images)}
+
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+
+
 def main_entry():
     import argparse
     description = """Find crystals in images."""
@@ -2,6 +2,7 @@ import glob
 import os
 import time
 import warnings
+from functools import lru_cache
 from pathlib import Path
 
 import numpy as np
@@ -24,13 +25,38 @@ def apply_corrections(img, deadpixels=None):
 def remove_deadpixels(img, deadpixels, d=1):
     """Remove dead pixels from the images by replacing them with the average of
     neighbouring pixels."""
-    d = 1
-    for (i, j) in deadpixels:
-        neighbours = img[i - d:i + d + 1, j - d:j + d + 1].flatten()
-        img[i, j] = np.mean(neighbours)
+    deadpixels = np.asarray(deadpixels, dtype=int).reshape(-1, 2)
+    if len(deadpixels) == 0:
+        return img
+    index = get_deadpixel_index(deadpixels, img.shape[-2:], d=d)
+    img[..., deadpixels[:, 0], deadpixels[:, 1]] = _neighbour_mean(img, *index)
     return img
 
 
+def get_deadpixel_index(deadpixels, shape: tuple, d: int = 1) -> tuple:
+    """Precompute the neighbours of the dead pixels in an image of `shape`.
+
+    Returns the rows and columns (n, (2d+1)**2) of the pixels in the
+    window around each dead pixel, and the weights to average them
+    (pixels outside of the image have weight 0).
+    """
+    deadpixels = np.asarray(deadpixels, dtype=int).reshape(-1, 2)
+    offsets = np.arange(-d, d + 1)
+    rows = (deadpixels[:, 0, None, None] + offsets[:, None]).repeat(len(offsets), axis=2).reshape(len(deadpixels), -1)
+    cols = (deadpixels[:, 1, None, None] + offsets[None, :]).repeat(len(offsets), axis=1).reshape(len(deadpixels), -1)
+
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    weights = inside / inside.sum(axis=1, keepdims=True)
+
+    return np.where(inside, rows, 0), np.where(inside, cols, 0), weights
+
+
+def _neighbour_mean(img, rows, cols, weights):
+    """Weighted average of the pixels at `rows`/`cols` in the last two axes of
+    `img`."""
+    return np.sum(img[..., rows, cols] * weights, axis=-1)
+
+
 def get_deadpixels(img):
     """Get coordinates of dead pixels in the image."""
     return np.argwhere(img == 0)
@@ -76,6 +102,96 @@ def apply_flatfield_correction(img, flatfield, darkfield=None):
     return ret
 
 
+class FlatfieldCorrector:
+    """Reusable flatfield (and darkfield/dead pixel) correction.
+
+    The flatfield is loaded once, and the multiplicative gain map and
+    the neighbours of the dead pixels are precomputed, so that a frame
+    or a stack of frames is corrected in a single vectorized pass.
+
+    flatfield: str or np.ndarray
+        Flatfield image or path to a TIFF file, the dead pixels are
+        taken from its header if `deadpixels` is not given
+    darkfield: str or np.ndarray
+        Darkfield image or path to a TIFF file (optional)
+    deadpixels: np.ndarray
+        (n, 2) array with the coordinates of the dead pixels, pass an
+        empty list to skip the dead pixel correction
+    """
+
+    def __init__(self, flatfield, darkfield=None, deadpixels=None):
+        super().__init__()
+        if isinstance(flatfield, (str, Path)):
+            flatfield, h = read_tiff(flatfield)
+            if deadpixels is None:
+                deadpixels = h.get('deadpixels')
+        if isinstance(darkfield, (str, Path)):
+            darkfield, _ = read_tiff(darkfield)
+
+        flatfield = np.asarray(flatfield, dtype=float)
+        self.shape = flatfield.shape
+
+        if darkfield is None:
+            self.offset = None
+        else:
+            self.offset = np.asarray(darkfield, dtype=float)
+            flatfield = flatfield - self.offset
+
+        # avoid division by zero for dead pixels in the flatfield
+        valid = flatfield != 0
+        self.gain = np.divide(np.mean(flatfield), flatfield, out=np.ones_like(flatfield), where=valid)
+
+        if deadpixels is None:
+            deadpixels = []
+        self.deadpixels = np.asarray(deadpixels, dtype=int).reshape(-1, 2)
+        self._deadpixel_index = get_deadpixel_index(self.deadpixels, self.shape)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(shape={self.shape}, darkfield={self.offset is not None}, deadpixels={len(self.deadpixels)})'
+
+    def __call__(self, img, out=None):
+        return self.correct(img, out=out)
+
+    def correct(self, img: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Correct a frame or a stack of frames (..., ny, nx).
+
+        The result is written to `out` if given (may be `img` itself
+        for in-place correction of a float array), otherwise a new float
+        array is returned. Images that do not match the shape of the
+        flatfield are returned unchanged with a warning.
+        """
+        if img.shape[-2:] != self.shape:
+            msg = f'Flatfield not applied: image {img.shape} and flatfield {self.shape} do not match shapes.'
+            warnings.warn(msg)
+            return img
+
+        if out is None:
+            out = np.array(img, dtype=np.result_type(img.dtype, float))
+        elif out is not img:
+            out[...] = img
+
+        if len(self.deadpixels):
+            out[..., self.deadpixels[:, 0], self.deadpixels[:, 1]] = _neighbour_mean(out, *self._deadpixel_index)
+
+        if self.offset is not None:
+            out -= self.offset
+        out *= self.gain
+
+        return out
+
+
+@lru_cache(maxsize=4)
+def _load_flatfield_corrector(fname: str, mtime: float) -> FlatfieldCorrector:
+    return FlatfieldCorrector(fname)
+
+
+def get_flatfield_corrector(fname: str) -> FlatfieldCorrector:
+    """Return a `FlatfieldCorrector` for the flatfield file `fname`, the
+    corrector is cached until the file is modified."""
+    fname = Path(fname).absolute()
+    return _load_flatfield_corrector(str(fname), fname.stat().st_mtime)
+
+
 def collect_flatfield(ctrl=None, frames=100, save_images=False, collect_darkfield=True, drc='.', **kwargs):
     """Routine to collect flatfield correction files.
 
@@ -203,17 +319,11 @@ This will apply the flatfield correction (`-f`) and optionally the darkfield cor
         exit()
 
     if options.flatfield:
-        flatfield, h = read_tiff(options.flatfield)
-        deadpixels = h['deadpixels']
+        corrector = FlatfieldCorrector(options.flatfield, darkfield=options.darkfield)
     else:
         print('No flatfield file specified')
         exit()
 
-    if options.darkfield:
-        darkfield, h = read_tiff(options.darkfield)
-    else:
-        darkfield = np.zeros_like(flatfield)
-
     if len(args) == 1:
         fobj = args[0]
         if not os.path.exists(fobj):
@@ -225,8 +335,8 @@ This will apply the flatfield correction (`-f`) and optionally the darkfield cor
     for f in args:
         img, h = read_tiff(f)
 
-        img = apply_corrections(img, deadpixels=deadpixels)
-        img = apply_flatfield_correction(img, flatfield, darkfield=darkfield)
+        img = corrector(img)
+        img = apply_center_pixel_correction(img)
 
         name = Path(f).name
         fout = drc / name
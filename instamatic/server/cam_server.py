@@ -3,27 +3,34 @@ import logging
 import pickle
 import queue
 import socket
+import sys
 import threading
 import traceback
 
-import numpy as np
-
-from .serializer import dumper
-from .serializer import loader
+from .framing import can_send_raw
+from .framing import FramingError
+from .framing import recv_message
+from .framing import send_message
+from .serializer import pickle_dumper as dumper
+from .serializer import pickle_loader as loader
 from instamatic import config
 from instamatic.camera import Camera
-from instamatic.utils import high_precision_timers
-high_precision_timers.enable()
+
+if sys.platform == 'win32':
+    from instamatic.utils import high_precision_timers
+    high_precision_timers.enable()
 
 if config.settings.cam_use_shared_memory:
-    from multiprocessing import shared_memory
+    from .ringbuffer import RingBuffer
+
+logger = logging.getLogger(__name__)
 
 condition = threading.Condition()
 box = []
 
 HOST = config.settings.cam_server_host
 PORT = config.settings.cam_server_port
-BUFSIZE = 4096
+N_SLOTS = config.settings.cam_shared_memory_slots
 
 
 is_local_connection = HOST in ('127.0.0.1', 'localhost')
@@ -48,45 +55,78 @@ class CamServer(threading.Thread):
         # self.name is a reserved parameter for threads
         self._name = name
 
-        self._bufsize = BUFSIZE
-
         self.verbose = False
 
-        self.buffers = {}
+        self.ring = None
+        self.streaming = False
+        self.stream_kwargs = {}
 
         self.use_shared_memory = config.settings.cam_use_shared_memory
         print('Use shared memory:', self.use_shared_memory)
 
-    def setup_shared_buffer(self, arr):
-        """Set up shared memory buffer.
+    def write_to_ring(self, arr) -> int:
+        """Write image `arr` to the shared memory ring buffer, returns the
+        sequence number of the frame.
 
-        Make a buffer for each binsize, and store the buffers to a dict.
+        The ring buffer is (re)created if the image does not fit in the
+        slots, e.g. after changing the binning.
         """
-        self.shmem = shared_memory.SharedMemory(create=True, size=arr.nbytes)
-        buffer = np.ndarray(arr.shape, dtype=arr.dtype, buffer=self.shmem.buf)
-        self.buffers[arr.shape] = buffer
-        if self.verbose:
-            print(f'Created new buffer: `{self.shmem.name}` | {arr.shape} ({arr.dtype})')
-
-    def copy_data_to_shared_buffer(self, arr):
-        """Copy numpy image array to shared memory."""
-        if arr.shape not in self.buffers:
-            self.setup_shared_buffer(arr)
-
-        buffer = self.buffers[arr.shape]
-        buffer[:] = arr[:]  # copy data to buffer
+        if self.ring is None or arr.nbytes > self.ring.slot_size:
+            old = self.ring
+            self.ring = RingBuffer.create(n_slots=N_SLOTS, slot_size=arr.nbytes)
+            if old is not None:
+                old.retire(self.ring.name)  # streaming clients reattach to the new buffer
+                old.close()
+            if self.verbose:
+                print(f'Created new ring buffer: {self.ring}')
+
+        return self.ring.write(arr)
+
+    def start_streaming(self, exposure: float = None, binsize: int = None) -> dict:
+        """Continuously acquire images into the ring buffer in between
+        commands. Returns the name of the ring buffer and the sequence
+        number of the first frame."""
+        if not self.use_shared_memory:
+            raise RuntimeError('Streaming requires `cam_use_shared_memory`')
+
+        self.stream_kwargs = {'exposure': exposure, 'binsize': binsize}
+        seq = self.acquire_stream_frame()
+        self.streaming = True
+        return {'name': self.ring.name, 'seq': seq}
+
+    def stop_streaming(self) -> None:
+        """Stop continuous acquisition."""
+        self.streaming = False
+
+    def acquire_stream_frame(self) -> int:
+        """Acquire a single frame of the stream into the ring buffer."""
+        arr = self.cam.getImage(**self.stream_kwargs)
+        return self.write_to_ring(arr)
 
     def run(self):
         """Start server thread."""
         self.cam = Camera(name=self._name, use_server=False)
         self.cam.get_attrs = self.get_attrs
+        self.cam.start_streaming = self.start_streaming
+        self.cam.stop_streaming = self.stop_streaming
 
         print(f'Initialized camera: {self.cam.interface}')
 
         while True:
             now = datetime.datetime.now().strftime('%H:%M:%S.%f')
 
-            cmd = self.q.get()
+            # while streaming, commands are handled in between frames
+            try:
+                cmd = self.q.get(block=not self.streaming)
+            except queue.Empty:
+                try:
+                    self.acquire_stream_frame()
+                except Exception as e:
+                    traceback.print_exc()
+                    if self.log:
+                        self.log.exception(e)
+                    self.stop_streaming()
+                continue
 
             with condition:
                 attr_name = cmd['attr_name']
@@ -105,11 +145,10 @@ class CamServer(threading.Thread):
                 else:
                     if self.use_shared_memory:
                         if attr_name == 'getImage':
-                            self.copy_data_to_shared_buffer(ret)
+                            seq = self.write_to_ring(ret)
                             ret = {
-                                'shape': ret.shape,
-                                'dtype': str(ret.dtype),
-                                'name': self.shmem.name,
+                                'name': self.ring.name,
+                                'seq': seq,
                             }
 
                 box.append((status, ret))
@@ -146,11 +185,15 @@ def handle(conn, q):
     handled by TEMServer."""
     with conn:
         while True:
-            data = conn.recv(BUFSIZE)
-            if not data:
+            try:
+                data, _ = recv_message(conn, loader)
+            except (FramingError, ConnectionError) as e:
+                print(f'Closing connection: {e}')
+                logger.error('Closing connection: %s', e)
                 break
 
-            data = loader(data)
+            if data is None:
+                break
 
             if data == 'exit':
                 break
@@ -161,8 +204,13 @@ def handle(conn, q):
             with condition:
                 q.put(data)
                 condition.wait()
-                response = box.pop()
-                conn.sendall(dumper(response))
+                status, ret = box.pop()
+
+            if can_send_raw(ret):
+                # send image data as raw bytes instead of pickling them
+                send_message(conn, (status, None), dumper, array=ret)
+            else:
+                send_message(conn, (status, ret), dumper)
 
 
 def main():
@@ -175,13 +223,15 @@ This program initializes a connection to the camera as defined in the config. Th
 
 The host and port are defined in `config/settings.yaml`.
 
-The data sent over the socket is a pickled dictionary with the following elements:
+The data sent over the socket (framed as described in `instamatic.server.framing`) is a pickled dictionary with the following elements:
 
 - `attr_name`: Name of the function to call or attribute to return (str)
 - `args`: (Optional) List of arguments for the function (list)
 - `kwargs`: (Optiona) Dictionary of keyword arguments for the function (dict)
 
-The response is returned as a pickle object.
+The response is returned as a pickle object, image data are sent as raw bytes.
+
+If `cam_use_shared_memory` is set and the connection is local, images are written to a ring buffer in shared memory (see `instamatic.server.ringbuffer`) instead, and only the name of the buffer and the sequence number of the frame are returned. Call `start_streaming` to acquire frames into the ring buffer continuously.
 """
 
     parser = argparse.ArgumentParser(
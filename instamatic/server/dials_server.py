@@ -1,39 +1,48 @@
 import ast
 import datetime
+import json
 import logging
 import subprocess as sp
-import sys
 import threading
 from pathlib import Path
 from socket import *
 
+from .job_queue import Executor
+from .job_queue import handle_command
+from .job_queue import JobQueue
+from .job_queue import PRIORITY_DEFAULT
+from .job_queue import ResultCache
 from instamatic import config
 
 
-try:
-    EXE = Path(sys.argv[1])
-except BaseException:
-    EXE = Path(config.settings.dials_script)
-
-CWD = EXE.parent
+EXE = Path(config.settings.dials_script)
 
 HOST = config.settings.indexing_server_host
 PORT = config.settings.indexing_server_port
 BUFF = 1024
 
 
-def run_dials_indexing(data):
+def dials_inputs(path, **kwargs) -> list:
+    """Input files and parameters of the DIALS job in `path`."""
+    return [kwargs, *sorted(Path(path).rglob('*.img'))]
+
+
+def run_dials_indexing(data, exe: str = None) -> dict:
+    """Run the DIALS script `exe` on the data. Returns a dict with the unit
+    cell found (`unit_cell`), raises RuntimeError if no unit cell was
+    found."""
     path = data['path']
     rotrange = data['rotrange']
     nframes = data['nframes']
     osc = data['osc']
 
-    cmd = [str(EXE), path]
+    exe = Path(exe or EXE)
+    cmd = [str(exe), path]
     date = datetime.datetime.now().strftime('%Y-%m-%d')
     fn = config.locations['logs'] / f'Dials_indexing_{date}.log'
     unitcelloutput = []
 
-    p = sp.Popen(cmd, cwd=CWD, stdout=sp.PIPE)
+    p = sp.Popen(cmd, cwd=exe.parent, stdout=sp.PIPE)
     for line in p.stdout:
         if b'Unit cell:' in line:
             print(line.decode('utf-8'))
@@ -49,13 +58,31 @@ def run_dials_indexing(data):
             print(f'Indexing result written to dials indexing log file; path: {path}')
 
     p.wait()
-    unitcelloutput = []
     now = datetime.datetime.now().strftime('%H:%M:%S.%f')
     print(f'{now} | DIALS indexing has finished')
 
+    if not unitcelloutput:
+        raise RuntimeError(f'No unit cell found (DIALS exit code {p.returncode})')
+
+    unit_cell = unitcelloutput[4:].decode('utf-8').strip()
+    return {'unit_cell': unit_cell, 'returncode': p.returncode}
+
+
+def get_executor(exe: str = None) -> Executor:
+    """Executor for the job queue running the DIALS script `exe`."""
+    def run(path, **kwargs):
+        return run_dials_indexing({'path': path, **kwargs}, exe=exe)
+
+    return Executor(run, inputs=dials_inputs)
+
 
-def handle(conn):
-    """Handle incoming connection."""
+def handle(conn, jobs):
+    """Handle incoming connection.
+
+    Jobs are submitted to the job queue `jobs`, and the connection
+    waits for them to finish. Status queries are answered as json, see
+    `instamatic.server.job_queue.handle_command`.
+    """
     ret = 0
 
     while True:
@@ -75,10 +102,21 @@ def handle(conn):
             ret = 1
             break
 
+        try:
+            data = json.loads(data)
+        except ValueError:
+            data = ast.literal_eval(data)
+
+        if 'task' in data:
+            response = handle_command(jobs, data)
+            conn.send(json.dumps(response).encode())
+
         else:
             conn.send(b'OK')
-            data = ast.literal_eval(data)
-            run_dials_indexing(data)
+            path = data.pop('path')
+            priority = data.pop('priority', PRIORITY_DEFAULT)
+            job = jobs.submit(path, priority=priority, **data)
+            job.wait()
 
     conn.send(b'Connection closed')
     conn.close()
@@ -99,12 +137,23 @@ The data sent to the server is a dict containing the following elements:
 - `rotrange`: Total rotation range in degrees (float)
 - `nframes`: Number of data frames (int)
 - `osc`: Oscillation range in degrees (float)
+- `priority`: (Optional) Jobs with a lower number are run first (int)
+
+Jobs are queued and run by a pool of workers (`indexing_server_workers` in `config/settings.yaml`). A dataset that is submitted again while it is being processed is not run twice, and the results of finished jobs are kept in a persistent cache (`indexing_server_cache`).
+
+The status of the queue can be requested by sending `{{"task": "status"}}` (json), or of a single job with `{{"task": "status", "id": ...}}`.
 """
 
     parser = argparse.ArgumentParser(
         description=description,
         formatter_class=argparse.RawDescriptionHelpFormatter)
 
+    parser.add_argument('exe', nargs='?', default=str(EXE),
+                        help="""DIALS script to run on the data (default: `dials_script` in `config/settings.yaml`).""")
+    parser.add_argument('-w', '--workers', action='store', type=int, dest='workers',
+                        help="""Number of DIALS jobs to run at the same time.""")
+
+    parser.set_defaults(workers=config.settings.indexing_server_workers)
     options = parser.parse_args()
 
     date = datetime.datetime.now().strftime('%Y-%m-%d')
@@ -115,21 +164,25 @@ The data sent to the server is a dict containing the following elements:
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
+    cache = ResultCache(config.locations['base'] / config.settings.indexing_server_cache)
+    jobs = JobQueue(get_executor(options.exe), workers=options.workers, cache=cache)
+    jobs.start()
+
     s = socket(AF_INET, SOCK_STREAM)
     s.bind((HOST, PORT))
     s.listen(5)
 
-    log.info(f'Indexing server (DIALS) listening on {HOST}:{PORT}')
-    log.info(f'Running command: {EXE}')
-    print(f'Indexing server (DIALS) listening on {HOST}:{PORT}')
-    print(f'Running command: {EXE}')
+    log.info(f'Indexing server (DIALS) listening on {HOST}:{PORT}, {options.workers} workers')
+    log.info(f'Running command: {options.exe}')
+    print(f'Indexing server (DIALS) listening on {HOST}:{PORT}, {options.workers} workers')
+    print(f'Running command: {options.exe}')
 
     with s:
         while True:
             conn, addr = s.accept()
             log.info('Connected by %s', addr)
             print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+            threading.Thread(target=handle, args=(conn, jobs)).start()
 
 
 if __name__ == '__main__':
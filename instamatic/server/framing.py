@@ -0,0 +1,133 @@
+"""Message framing for the TEM and camera servers.
+
+Every message is sent as a single frame: a fixed-size header giving the
+length of the payload, followed by the payload itself. This way, the
+receiving side always knows how many bytes to expect, and large replies
+are never truncated. The frame consists of:
+
+- header:  magic bytes (`IMTC`) followed by the sizes of the parts below
+- meta:    the serialized object (e.g. the command dict or the response)
+- info:    json description (dtype/shape) of the array, empty if no array
+- payload: raw array data
+
+Numeric arrays are sent as raw bytes straight from the array memory, and
+received directly into a freshly allocated array, so they are never
+pickled.
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'IMTC'
+HEADER = struct.Struct('!4sIIQ')
+
+# Only plain numeric data can be sent as raw bytes
+RAW_DTYPE_KINDS = 'biufc'
+
+
+class FramingError(Exception):
+    pass
+
+
+def can_send_raw(obj) -> bool:
+    """Check whether `obj` is an array that can be sent as raw bytes."""
+    return isinstance(obj, np.ndarray) and obj.dtype.kind in RAW_DTYPE_KINDS
+
+
+def recv_exactly(sock, nbytes: int, buffer=None, allow_eof: bool = False):
+    """Receive exactly `nbytes` from `sock`.
+
+    The data are written into `buffer` (a writable bytes-like object)
+    if given, otherwise a new `bytearray` is allocated. If `allow_eof`
+    is set, `None` is returned if the connection is closed before any
+    data arrives, otherwise a closed connection raises `FramingError`.
+    """
+    if buffer is None:
+        buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+
+    received = 0
+    while received < nbytes:
+        n = sock.recv_into(view[received:], nbytes - received)
+        if n == 0:
+            if received == 0 and allow_eof:
+                return None
+            raise FramingError(f'Connection closed after {received}/{nbytes} bytes')
+        received += n
+
+    return buffer
+
+
+def _sendall_parts(sock, parts: list, payload) -> None:
+    """Send the small `parts` followed by `payload` without concatenating
+    the payload to the rest of the frame."""
+    if not hasattr(sock, 'sendmsg'):
+        # Not available on Windows. Send the small parts in one go to
+        # avoid an extra round trip (Nagle), and the payload separately.
+        sock.sendall(b''.join(parts))
+        if len(payload):
+            sock.sendall(payload)
+        return
+
+    views = [memoryview(part).cast('B') for part in (*parts, payload) if len(part)]
+    while views:
+        n = sock.sendmsg(views)
+        while views and n >= len(views[0]):
+            n -= len(views[0])
+            views.pop(0)
+        if n:
+            views[0] = views[0][n:]
+
+
+def send_message(sock, obj, dumper, array: np.ndarray = None) -> None:
+    """Send `obj` serialized with `dumper` over `sock` as a single frame.
+
+    If `array` is given, it is appended to the frame as raw bytes.
+    """
+    meta = dumper(obj)
+
+    if array is None:
+        info = b''
+        payload = b''
+    else:
+        if not can_send_raw(array):
+            raise FramingError(f'Cannot send array with dtype `{array.dtype}` as raw bytes')
+        array = np.ascontiguousarray(array)
+        info = json.dumps({'dtype': array.dtype.str, 'shape': array.shape}).encode()
+        payload = array.reshape(-1).view(np.uint8)
+
+    header = HEADER.pack(MAGIC, len(meta), len(info), len(payload))
+    _sendall_parts(sock, (header, meta, info), payload)
+
+
+def recv_message(sock, loader):
+    """Receive a single frame from `sock`.
+
+    Returns a tuple `(obj, array)`, where `obj` is deserialized with
+    `loader` and `array` is `None` if the frame did not contain an
+    array. Returns `(None, None)` if the connection has been closed
+    cleanly before the start of a new frame.
+    """
+    header = recv_exactly(sock, HEADER.size, allow_eof=True)
+    if header is None:
+        return None, None
+
+    magic, meta_size, info_size, payload_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise FramingError(f'Invalid message header: {bytes(header)!r}')
+
+    meta = recv_exactly(sock, meta_size + info_size)
+    obj = loader(bytes(meta[:meta_size]))
+
+    if not info_size:
+        return obj, None
+
+    info = json.loads(meta[meta_size:].decode())
+    array = np.empty(info['shape'], dtype=np.dtype(info['dtype']))
+    if payload_size != array.nbytes:
+        raise FramingError(f'Payload size ({payload_size}) does not match array size ({array.nbytes})')
+    if payload_size:
+        recv_exactly(sock, payload_size, buffer=array.reshape(-1).view(np.uint8))
+
+    return obj, array
@@ -0,0 +1,384 @@
+"""Job queue for the processing servers (`xds_server`, `dials_server`).
+
+Jobs are run by a pool of worker threads, lowest priority number
+first. A job is identified by the data path and a hash of its input
+files, so that a dataset that is submitted again while it is queued or
+running is not processed twice, and a dataset that has been processed
+before is answered from the persistent result cache.
+
+The work itself is done by an executor (see `Executor`), an object with
+the methods:
+
+- `inputs(path, **kwargs)`: return a list of input files and parameters
+  that define the job, used to compute the input hash
+- `run(path, **kwargs)`: process the data and return the result (dict)
+
+Usage:
+    executor = Executor(run_xds_indexing, inputs=xds_inputs)
+    jobs = JobQueue(executor, workers=2, cache=ResultCache('results.json'))
+    jobs.start()
+    job = jobs.submit('C:/data/experiment_1/SMV', priority=0)
+    result = job.result(timeout=600)
+"""
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Jobs with a lower priority number are run first
+PRIORITY_HIGH = 0
+PRIORITY_DEFAULT = 10
+PRIORITY_LOW = 20
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def input_hash(inputs: list) -> str:
+    """Hash the input files (path, size, and modification time) and
+    parameters of a job."""
+    h = hashlib.sha1()
+    for item in inputs:
+        if isinstance(item, Path):
+            try:
+                stat = item.stat()
+            except OSError:
+                h.update(f'{item}:missing'.encode())
+            else:
+                h.update(f'{item}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        else:
+            h.update(json.dumps(item, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class Job:
+    """Processing job, see `JobQueue.submit`.
+
+    The result is set by the worker using `Job.complete` or `Job.fail`,
+    which wakes up all connections waiting for it.
+    """
+
+    def __init__(self, job_id: int, path: str, key: str, priority: int = PRIORITY_DEFAULT, kwargs: dict = None):
+        super().__init__()
+        self.id = job_id
+        self.path = path
+        self.key = key
+        self.priority = priority
+        self.kwargs = kwargs or {}
+        self.status = QUEUED
+        self.cached = False
+        self.submissions = 1
+        self.output = None
+        self.error = None
+        self.t_submitted = time.time()
+        self.t_started = None
+        self.t_finished = None
+        self._event = threading.Event()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(id={self.id}, path={self.path!r}, status={self.status!r})'
+
+    def complete(self, output: dict, cached: bool = False) -> None:
+        self.output = output
+        self.cached = cached
+        self.status = DONE
+        self.t_finished = time.time()
+        self._event.set()
+
+    def fail(self, error: str) -> None:
+        self.error = error
+        self.status = FAILED
+        self.t_finished = time.time()
+        self._event.set()
+
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the job has finished, returns False on timeout."""
+        return self._event.wait(timeout)
+
+    def result(self, timeout: float = None) -> dict:
+        """Wait for the job to finish and return the output.
+
+        Raises RuntimeError if the job failed.
+        """
+        if not self.wait(timeout):
+            raise TimeoutError(f'Job {self.id} did not finish within {timeout} s')
+        if self.status == FAILED:
+            raise RuntimeError(f'Job {self.id} failed: {self.error}')
+        return self.output
+
+    def to_dict(self) -> dict:
+        """Status of the job as a json serializable dict."""
+        return {
+            'id': self.id,
+            'path': str(self.path),
+            'priority': self.priority,
+            'status': self.status,
+            'cached': self.cached,
+            'submissions': self.submissions,
+            'submitted': self.t_submitted,
+            'started': self.t_started,
+            'finished': self.t_finished,
+            'output': self.output,
+            'error': self.error,
+        }
+
+
+class ResultCache:
+    """Persistent cache of job results, stored as a json file mapping the
+    job key to the result.
+
+    path: str
+        Location of the cache file, the cache is kept in memory only if
+        None
+    """
+
+    def __init__(self, path: str = None):
+        super().__init__()
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._results = {}
+
+        if self.path and self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self._results = json.load(f)
+            except ValueError:
+                logger.warning('Could not read result cache `%s`, starting with an empty cache', self.path)
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._results
+
+    def get(self, key: str) -> dict:
+        return self._results.get(key)
+
+    def put(self, key: str, result: dict) -> None:
+        with self._lock:
+            self._results[key] = result
+            if self.path:
+                tmp = self.path.with_suffix('.tmp')
+                with open(tmp, 'w') as f:
+                    json.dump(self._results, f, default=str)
+                os.replace(tmp, self.path)
+
+
+class JobQueue:
+    """Queue of processing jobs run by a pool of worker threads.
+
+    executor:
+        Object that runs the jobs, see module docstring
+    workers: int
+        Number of jobs to run at the same time
+    cache: ResultCache
+        Results of finished jobs, a dataset with the same key is not
+        processed again. In-memory only if not given
+    keep: int
+        Number of finished jobs to keep for `get` and `status`, older
+        jobs are forgotten (their results stay in the cache)
+    """
+
+    def __init__(self, executor, workers: int = 1, cache: ResultCache = None, keep: int = 100):
+        super().__init__()
+        self.executor = executor
+        self.workers = workers
+        self.cache = cache if cache is not None else ResultCache()
+        self.keep = keep
+
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._jobs = {}    # job id -> active or recently finished job
+        self._active = {}  # key -> queued or running job
+        self._finished = deque()  # ids of the finished jobs in `_jobs`, oldest first
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.stop()
+
+    def key(self, path: str, **kwargs) -> str:
+        """Key to identify identical jobs: the resolved data path and the
+        hash of the job inputs."""
+        path = Path(path).resolve()
+        return f'{path}:{input_hash(self.executor.inputs(path, **kwargs))}'
+
+    def submit(self, path: str, priority: int = PRIORITY_DEFAULT, **kwargs) -> Job:
+        """Submit the data in `path` for processing, keyword arguments are
+        passed to the executor.
+
+        If the same job is queued or running, that job is returned
+        (its priority is raised if necessary). If it has been
+        processed before, a finished job with the cached result is
+        returned.
+        """
+        key = self.key(path, **kwargs)
+
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                job.submissions += 1
+                if job.status == QUEUED and priority < job.priority:
+                    job.priority = priority
+                    self._queue.put((priority, next(self._counter), job))
+                logger.info('Duplicate submission of %s, already %s', path, job.status)
+                return job
+
+            job = Job(next(self._counter), path, key, priority=priority, kwargs=kwargs)
+            self._jobs[job.id] = job
+
+            cached = self.cache.get(key)
+            if cached is not None:
+                job.complete(cached, cached=True)
+                self._retire(job)
+                logger.info('Result for %s taken from the cache', path)
+                return job
+
+            self._active[key] = job
+            self._queue.put((priority, job.id, job))
+            logger.info('Queued job %d: %s (priority %d)', job.id, path, priority)
+
+        return job
+
+    def get(self, job_id: int) -> Job:
+        return self._jobs[job_id]
+
+    def _retire(self, job: Job) -> None:
+        """Keep the finished `job` for the status requests, and forget the
+        oldest finished jobs beyond `keep`. Must be called with the lock
+        held."""
+        self._active.pop(job.key, None)
+        self._finished.append(job.id)
+        while len(self._finished) > self.keep:
+            self._jobs.pop(self._finished.popleft(), None)
+
+    def status(self, job_id: int = None) -> dict:
+        """Return the status of job `job_id`, or a summary of the queue."""
+        if job_id is not None:
+            return self._jobs[job_id].to_dict()
+
+        with self._lock:
+            jobs = list(self._jobs.values())
+
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        for job in jobs:
+            counts[job.status] += 1
+
+        return {
+            'workers': self.workers,
+            'cached': len(self.cache),
+            'jobs': counts,
+            'active': [job.to_dict() for job in jobs if job.status in (QUEUED, RUNNING)],
+        }
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'JobQueue-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, wait: bool = True) -> None:
+        """Stop the workers after the jobs that are running."""
+        for thread in self._threads:
+            self._queue.put((float('inf'), next(self._counter), None))
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _worker(self) -> None:
+        while True:
+            priority, _, job = self._queue.get()
+            if job is None:
+                break
+
+            with self._lock:
+                if job.status != QUEUED:
+                    continue  # resubmitted with a higher priority, already taken
+                job.status = RUNNING
+                job.t_started = time.time()
+
+            logger.info('Running job %d: %s', job.id, job.path)
+
+            try:
+                output = self.executor.run(job.path, **job.kwargs)
+            except Exception as e:
+                logger.error('Job %d failed: %s', job.id, traceback.format_exc())
+                job.fail(repr(e))
+            else:
+                self.cache.put(job.key, output)
+                job.complete(output)
+
+            with self._lock:
+                self._retire(job)
+
+            now = datetime.datetime.now().strftime('%H:%M:%S.%f')
+            print(f'{now} | Job {job.id} {job.status} ({job.t_finished - job.t_started:.1f} s): {job.path}')
+
+
+def handle_command(jobs: JobQueue, cmd: dict) -> dict:
+    """Evaluate a command sent to a processing server as a json encoded
+    dict, and return the response (json serializable).
+
+    - `{"task": "submit", "path": ..., "priority": 10, "wait": false}`:
+      queue a job, returns the status of the job
+    - `{"task": "status", "id": ...}`: return the status of the job, or of
+      the queue if `id` is omitted
+    """
+    task = cmd.get('task')
+    try:
+        if task == 'submit':
+            job = jobs.submit(cmd['path'], priority=cmd.get('priority', PRIORITY_DEFAULT))
+            if cmd.get('wait'):
+                job.wait()
+            return job.to_dict()
+        elif task == 'status':
+            return jobs.status(cmd.get('id'))
+        else:
+            return {'error': f'Unknown task: {task}'}
+    except Exception as e:
+        return {'error': repr(e)}
+
+
+class Executor:
+    """Run jobs with the python function `func(path, **kwargs)`, which
+    returns the result as a json serializable dict. This can also be a
+    stub to test the queue without XDS or DIALS.
+
+    inputs: callable
+        Function `inputs(path, **kwargs)` returning the input files (as
+        `Path`) and parameters of the job, by default all files in `path`
+    """
+
+    def __init__(self, func, inputs=None):
+        super().__init__()
+        self.func = func
+        self._inputs = inputs
+
+    def inputs(self, path: Path, **kwargs) -> list:
+        if self._inputs:
+            return self._inputs(path, **kwargs)
+        return [kwargs, *sorted(fn for fn in Path(path).rglob('*') if fn.is_file())]
+
+    def run(self, path: str, **kwargs) -> dict:
+        return self.func(path, **kwargs)
@@ -0,0 +1,215 @@
+"""Shared-memory ring buffer for streaming camera frames between processes.
+
+The buffer consists of a number of slots, each holding one frame and a
+small header. Frames are numbered with an increasing sequence number
+(starting at 1), and frame `seq` is stored in slot `seq % n_slots`.
+
+Each slot header stores the sequence number twice: `seq_begin` is set
+before the frame data are written, and `seq_end` after. A reader checks
+both before and after copying the data (seqlock). If they differ, the
+slot was overwritten while it was being read, and the frame is
+discarded instead of returning a torn frame.
+
+There is a single writer (the camera server), and any number of readers
+that attach to the buffer by its name. When the writer replaces the buffer
+(e.g. for larger frames), it stores the name of the new buffer in the
+header of the old one (`successor`), so that readers can reattach.
+"""
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAGIC = 0x494d5452494e47  # 'IMTRING'
+MAX_NDIM = 4
+ALIGNMENT = 64
+
+# Global header: magic, number of slots, slot size (bytes), latest sequence number,
+# name of the buffer that replaces this one
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u8'),
+    ('n_slots', '<u8'),
+    ('slot_size', '<u8'),
+    ('latest', '<u8'),
+    ('successor', 'S64'),
+])
+
+SLOT_DTYPE = np.dtype([
+    ('seq_begin', '<u8'),
+    ('seq_end', '<u8'),
+    ('timestamp', '<f8'),
+    ('nbytes', '<u8'),
+    ('ndim', '<u4'),
+    ('shape', '<u4', (MAX_NDIM,)),
+    ('dtype', 'S8'),
+])
+
+
+class FrameOverwrittenError(Exception):
+    pass
+
+
+def _aligned(nbytes: int) -> int:
+    return -(-nbytes // ALIGNMENT) * ALIGNMENT
+
+
+class RingBuffer:
+    """Ring buffer of frames in shared memory.
+
+    Use `RingBuffer.create` on the producer side, and
+    `RingBuffer.attach` to connect to an existing buffer by name.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        super().__init__()
+        self.shm = shm
+        self.owner = owner
+
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        if self._header['magic'] != MAGIC:
+            raise ValueError(f'Shared memory `{shm.name}` does not contain a ring buffer')
+
+        self.n_slots = int(self._header['n_slots'])
+        self.slot_size = int(self._header['slot_size'])
+
+        offset = _aligned(HEADER_DTYPE.itemsize)
+        self._slots = np.ndarray((self.n_slots,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=offset)
+
+        offset += _aligned(SLOT_DTYPE.itemsize * self.n_slots)
+        self._data = np.ndarray((self.n_slots, self.slot_size), dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name!r}, n_slots={self.n_slots}, slot_size={self.slot_size})'
+
+    @classmethod
+    def create(cls, n_slots: int, slot_size: int) -> 'RingBuffer':
+        """Create a new ring buffer with `n_slots` slots that can hold frames
+        up to `slot_size` bytes."""
+        slot_size = _aligned(slot_size)
+        size = _aligned(HEADER_DTYPE.itemsize) + _aligned(SLOT_DTYPE.itemsize * n_slots) + n_slots * slot_size
+        shm = shared_memory.SharedMemory(create=True, size=size)
+
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header['n_slots'] = n_slots
+        header['slot_size'] = slot_size
+        header['latest'] = 0
+        header['successor'] = b''
+        header['magic'] = MAGIC
+        del header
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'RingBuffer':
+        """Attach to an existing ring buffer by its name."""
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def latest(self) -> int:
+        """Sequence number of the most recent frame (0 if empty)."""
+        return int(self._header['latest'])
+
+    @property
+    def successor(self) -> str:
+        """Name of the buffer that replaces this one (empty if the buffer is
+        still in use)."""
+        return self._header['successor'].item().decode()
+
+    def retire(self, successor: str) -> None:
+        """Mark the buffer as replaced by the buffer `successor`, no more
+        frames are written to it."""
+        self._header['successor'] = successor.encode()
+
+    def info(self) -> dict:
+        """Information needed by a reader to attach to the buffer."""
+        return {'name': self.name, 'n_slots': self.n_slots, 'slot_size': self.slot_size}
+
+    def write(self, arr: np.ndarray, timestamp: float = None) -> int:
+        """Copy `arr` into the next slot, returns its sequence number."""
+        arr = np.ascontiguousarray(arr)
+        if arr.nbytes > self.slot_size:
+            raise ValueError(f'Frame ({arr.nbytes} bytes) does not fit in slot ({self.slot_size} bytes)')
+        if arr.ndim > MAX_NDIM:
+            raise ValueError(f'Frame has too many dimensions ({arr.ndim} > {MAX_NDIM})')
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        seq = self.latest + 1
+        i = seq % self.n_slots
+        slot = self._slots[i]
+
+        slot['seq_begin'] = seq
+        self._data[i, :arr.nbytes] = arr.reshape(-1).view(np.uint8)
+        slot['timestamp'] = timestamp
+        slot['nbytes'] = arr.nbytes
+        slot['ndim'] = arr.ndim
+        slot['shape'][:arr.ndim] = arr.shape
+        slot['dtype'] = arr.dtype.str.encode()
+        slot['seq_end'] = seq
+
+        self._header['latest'] = seq
+        return seq
+
+    def is_valid(self, seq: int) -> bool:
+        """Check whether frame `seq` is (still) available in the buffer."""
+        slot = self._slots[seq % self.n_slots]
+        return slot['seq_begin'] == seq and slot['seq_end'] == seq
+
+    def read(self, seq: int = None, copy: bool = True) -> tuple:
+        """Read frame `seq` (defaults to the latest frame).
+
+        Returns a tuple `(arr, seq, timestamp)`. If `copy` is False, `arr`
+        is a view into the shared memory that stays valid until the slot
+        is reused (`n_slots` frames later), check with `is_valid(seq)`
+        after using it. Raises `FrameOverwrittenError` if the frame is no
+        longer available.
+        """
+        if seq is None:
+            seq = self.latest
+        if seq < 1 or seq > self.latest:
+            raise FrameOverwrittenError(f'Frame {seq} is not available (latest={self.latest})')
+
+        i = seq % self.n_slots
+        slot = self._slots[i]
+
+        if not self.is_valid(seq):
+            raise FrameOverwrittenError(f'Frame {seq} has been overwritten (latest={self.latest})')
+
+        ndim = int(slot['ndim'])
+        shape = tuple(int(n) for n in slot['shape'][:ndim])
+        dtype = np.dtype(slot['dtype'].decode())
+        timestamp = float(slot['timestamp'])
+        nbytes = int(slot['nbytes'])
+
+        arr = self._data[i, :nbytes].view(dtype).reshape(shape)
+        if copy:
+            arr = arr.copy()
+
+        if not self.is_valid(seq):
+            raise FrameOverwrittenError(f'Frame {seq} was overwritten while reading (latest={self.latest})')
+
+        return arr, seq, timestamp
+
+    def wait(self, seq: int, timeout: float = None, interval: float = 0.001) -> bool:
+        """Wait until frame `seq` has been written, returns False on
+        timeout, or if the buffer has been replaced (see `successor`)."""
+        t0 = time.perf_counter()
+        while self.latest < seq:
+            if self.successor:
+                return False
+            if timeout is not None and time.perf_counter() - t0 > timeout:
+                return False
+            time.sleep(interval)
+        return True
+
+    def close(self) -> None:
+        """Close the buffer, the owner also frees the shared memory."""
+        self._header = self._slots = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
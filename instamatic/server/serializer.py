@@ -11,6 +11,8 @@ PROTOCOL = settings.tem_communication_protocol
 # - json:    320 µs ± 55.8 µs per loop (mean ± std. dev. of 7 runs, 1000 loops each)
 # - msgpack: 512 µs ± 27.2 µs per loop (mean ± std. dev. of 7 runs, 1000 loops each)
 # - yaml:   4.43 ms ± 13.7 µs per loop (mean ± std. dev. of 7 runs, 1000 loops each)
+#
+# Run `instamatic.benchmark -g serializer -g tem_server` for current numbers
 
 
 def json_loader(data):
@@ -1,23 +1,184 @@
 import datetime
+import itertools
 import json
 import logging
 import pickle
 import queue
 import socket
 import threading
+import time
 import traceback
 
+from .framing import FramingError
+from .framing import recv_message
+from .framing import send_message
 from .serializer import dumper
 from .serializer import loader
 from instamatic import config
 from instamatic.TEMController import Microscope
 
-condition = threading.Condition()
-box = []
+logger = logging.getLogger(__name__)
 
 HOST = config.settings.tem_server_host
 PORT = config.settings.tem_server_port
-BUFSIZE = 1024
+CACHE_TTL = config.settings.tem_server_cache_ttl
+
+# Calls starting with these prefixes do not change the state of the microscope
+READONLY_PREFIXES = ('get', 'is')
+
+# Getters of settings that only change through a setter, their responses can
+# be cached. The live state (stage position and movement, currents, screen)
+# is always read out from the microscope.
+CACHEABLE_GETTERS = frozenset((
+    'getFunctionMode',
+    'getMagnification',
+    'getMagnificationIndex',
+    'getMagnificationAbsoluteIndex',
+    'getMagnificationRanges',
+    'getSpotSize',
+    'getBrightness',
+    'getDiffFocus',
+    'getGunShift',
+    'getGunTilt',
+    'getBeamShift',
+    'getBeamTilt',
+    'getImageShift1',
+    'getImageShift2',
+    'getDiffShift',
+    'getCondensorLensStigmator',
+    'getIntermediateLensStigmator',
+    'getObjectiveLensStigmator',
+    'isBeamBlanked',
+))
+
+
+def is_readonly(cmd: dict) -> bool:
+    """Check whether the command (or all commands in a batch) are read-only
+    getters."""
+    if 'batch' in cmd:
+        return all(is_readonly(item) for item in cmd['batch'])
+    return cmd['func_name'].startswith(READONLY_PREFIXES)
+
+
+def is_cacheable(cmd: dict) -> bool:
+    """Check whether the response to the command (or all commands in a batch)
+    can be cached, see `CACHEABLE_GETTERS`."""
+    if 'batch' in cmd:
+        return all(is_cacheable(item) for item in cmd['batch'])
+    return cmd['func_name'] in CACHEABLE_GETTERS
+
+
+def get_cache_key(cmd: dict) -> str:
+    """Key to identify identical commands."""
+    if 'batch' in cmd:
+        return '|'.join(get_cache_key(item) for item in cmd['batch'])
+    kwargs = sorted(cmd.get('kwargs', {}).items())
+    return f"{cmd['func_name']}{tuple(cmd.get('args', ()))}{kwargs}"
+
+
+class Request:
+    """Command waiting to be evaluated by `TemServer`.
+
+    The response is set by the TEM thread using `Request.complete`,
+    which wakes up all connections waiting for it.
+    """
+
+    def __init__(self, cmd: dict, key: str = None, callback=None):
+        super().__init__()
+        self.cmd = cmd
+        self.key = key
+        self.callback = callback
+        self.response = None
+        self._event = threading.Event()
+
+    def complete(self, response: tuple) -> None:
+        if self.callback:
+            self.callback(self, response)
+        self.response = response
+        self._event.set()
+
+    def wait(self) -> tuple:
+        self._event.wait()
+        return self.response
+
+
+class Dispatcher:
+    """Dispatches commands from all connections to the TEM thread.
+
+    All calls are put on the queue and evaluated one by one, in the order
+    they were submitted. Identical getters of settings (see
+    `CACHEABLE_GETTERS`) that are requested at the same time by different
+    connections are evaluated only once, and their responses are cached
+    for `ttl` seconds. Any mutating call (not a getter) invalidates the
+    cache, and no responses are cached until it has been evaluated.
+
+    The calls themselves are always evaluated on the TEM thread, because
+    the microscope interfaces (COM) are bound to the thread that created
+    them.
+    """
+
+    def __init__(self, q, ttl: float = CACHE_TTL):
+        super().__init__()
+        self.q = q
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._pending = {}
+        self._n_mutating = 0  # mutating calls waiting to be evaluated
+        self._counter = itertools.count()
+
+    def submit(self, cmd: dict) -> tuple:
+        """Evaluate `cmd` and wait for the response `(status, ret)`."""
+        if not is_cacheable(cmd):
+            if is_readonly(cmd):
+                request = Request(cmd)
+            else:
+                request = Request(cmd, callback=self._complete_mutating)
+                with self._lock:
+                    self._n_mutating += 1
+                    self._cache.clear()
+                    self._pending.clear()  # later getters must wait for this call
+            self.q.put((0, next(self._counter), request))
+            return request.wait()
+
+        key = get_cache_key(cmd)
+
+        with self._lock:
+            try:
+                t, response = self._cache[key]
+            except KeyError:
+                pass
+            else:
+                if time.perf_counter() - t < self.ttl:
+                    return response
+
+            request = self._pending.get(key)
+            is_new = request is None
+            if is_new:
+                request = self._pending[key] = Request(cmd, key=key, callback=self._complete)
+
+        if is_new:
+            self.q.put((0, next(self._counter), request))
+
+        return request.wait()
+
+    def _complete(self, request: Request, response: tuple) -> None:
+        """Called from the TEM thread when the getter `request` has been
+        evaluated."""
+        with self._lock:
+            if self._pending.get(request.key) is request:
+                del self._pending[request.key]
+            status, ret = response
+            if self.ttl and status == 200 and not self._n_mutating:
+                self._cache[request.key] = (time.perf_counter(), response)
+
+    def _complete_mutating(self, request: Request, response: tuple) -> None:
+        """Called from the TEM thread when the mutating `request` has been
+        evaluated."""
+        with self._lock:
+            self._n_mutating -= 1
+            self._cache.clear()
 
 
 class TemServer(threading.Thread):
@@ -26,8 +187,8 @@ class TemServer(threading.Thread):
     Takes a logger object `log`, command queue `q`, and name of the
     microscope `name` that is used to initialize the connection to the
     microscope. Start the server using `TemServer.run` which will wait
-    for items to appear on `q` and execute them on the specified
-    microscope instance.
+    for requests to appear on `q` (see `Dispatcher`) and execute them on
+    the specified microscope instance.
     """
 
     def __init__(self, log=None, q=None, name=None):
@@ -49,27 +210,39 @@ class TemServer(threading.Thread):
         while True:
             now = datetime.datetime.now().strftime('%H:%M:%S.%f')
 
-            cmd = self.q.get()
+            priority, n, request = self.q.get()
+            cmd = request.cmd
 
-            with condition:
+            if 'batch' in cmd:
+                func_name = 'batch'
+                ret = [self.evaluate_cmd(item) for item in cmd['batch']]
+                status = 200
+            else:
                 func_name = cmd['func_name']
-                args = cmd.get('args', ())
-                kwargs = cmd.get('kwargs', {})
-
-                try:
-                    ret = self.evaluate(func_name, args, kwargs)
-                    status = 200
-                except Exception as e:
-                    traceback.print_exc()
-                    if self.log:
-                        self.log.exception(e)
-                    ret = (e.__class__.__name__, e.args)
-                    status = 500
-
-                box.append((status, ret))
-                condition.notify()
-                if self.verbose:
-                    print(f'{now} | {status} {func_name}: {ret}')
+                status, ret = self.evaluate_cmd(cmd)
+
+            request.complete((status, ret))
+            if self.verbose:
+                print(f'{now} | {status} {func_name}: {ret}')
+
+    def evaluate_cmd(self, cmd: dict) -> tuple:
+        """Evaluate the command dict `cmd`, returns a tuple with the status
+        code and the return value (or exception name and arguments)."""
+        func_name = cmd['func_name']
+        args = cmd.get('args', ())
+        kwargs = cmd.get('kwargs', {})
+
+        try:
+            ret = self.evaluate(func_name, args, kwargs)
+            status = 200
+        except Exception as e:
+            traceback.print_exc()
+            if self.log:
+                self.log.exception(e)
+            ret = (e.__class__.__name__, e.args)
+            status = 500
+
+        return status, ret
 
     def evaluate(self, func_name: str, args: list, kwargs: dict):
         """Evaluate the function `func_name` on `self.tem` and call it with
@@ -80,16 +253,20 @@ class TemServer(threading.Thread):
         return ret
 
 
-def handle(conn, q):
-    """Handle incoming connection, put command on the Queue `q`, which is then
-    handled by TEMServer."""
+def handle(conn, dispatcher):
+    """Handle incoming connection, pass commands to the `dispatcher`, which
+    puts them on the queue handled by TEMServer."""
     with conn:
         while True:
-            data = conn.recv(BUFSIZE)
-            if not data:
+            try:
+                data, _ = recv_message(conn, loader)
+            except (FramingError, ConnectionError) as e:
+                print(f'Closing connection: {e}')
+                logger.error('Closing connection: %s', e)
                 break
 
-            data = loader(data)
+            if data is None:
+                break
 
             if data == 'exit':
                 break
@@ -97,11 +274,8 @@ def handle(conn, q):
             if data == 'kill':
                 break
 
-            with condition:
-                q.put(data)
-                condition.wait()
-                response = box.pop()
-                conn.send(dumper(response))
+            response = dispatcher.submit(data)
+            send_message(conn, response, dumper)
 
 
 def main():
@@ -120,13 +294,17 @@ This program initializes a connection to the TEM as defined in the config. On so
 
 The host and port are defined in `config/settings.yaml`.
 
-The data sent over the socket is a serialized dictionary with the following elements:
+The data sent over the socket (framed as described in `instamatic.server.framing`) is a serialized dictionary with the following elements:
 
 - `func_name`: Name of the function to call (str)
 - `args`: (Optional) List of arguments for the function (list)
 - `kwargs`: (Optiona) Dictionary of keyword arguments for the function (dict)
 
+Alternatively, a dictionary with a single element `batch` containing a list of the dictionaries above can be sent. The calls are evaluated one after another and the responses are returned together as a list.
+
 The response is returned as a serialized object.
+
+Calls to getters (`get...`, `is...`) are answered before queued setters, and their responses are cached for `tem_server_cache_ttl` seconds (set in `config/settings.yaml`). Any other call clears the cache.
 """
 
     parser = argparse.ArgumentParser(
@@ -148,7 +326,8 @@ The response is returned as a serialized object.
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
-    q = queue.Queue(maxsize=100)
+    q = queue.PriorityQueue(maxsize=100)
+    dispatcher = Dispatcher(q)
 
     tem_reader = TemServer(name=microscope, log=log, q=q)
     tem_reader.start()
@@ -165,7 +344,7 @@ The response is returned as a serialized object.
             conn, addr = s.accept()
             log.info('Connected by %s', addr)
             print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn, q)).start()
+            threading.Thread(target=handle, args=(conn, dispatcher)).start()
 
 
 if __name__ == '__main__':
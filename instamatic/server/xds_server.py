@@ -1,10 +1,16 @@
 import datetime
+import json
 import logging
 import subprocess as sp
 import threading
 from pathlib import Path
 from socket import *
 
+from .job_queue import DONE
+from .job_queue import Executor
+from .job_queue import handle_command
+from .job_queue import JobQueue
+from .job_queue import ResultCache
 from instamatic import config
 
 HOST = config.settings.indexing_server_host
@@ -43,10 +49,45 @@ def parse_xds(path):
     return msg
 
 
-def run_xds_indexing(path):
+def xds_summary(path) -> dict:
+    """Return the summary of `CORRECT.LP` in `path`, or None if it cannot
+    be parsed."""
+    from instamatic.utils.xds_parser import xds_parser
+
+    try:
+        return xds_parser(Path(path) / 'CORRECT.LP').summary()
+    except Exception:
+        return None
+
+
+def xds_inputs(path) -> list:
+    """Input files of the XDS job in `path`: `XDS.INP` and the data frames
+    it refers to."""
+    path = Path(path)
+    inp = path / 'XDS.INP'
+    inputs = [inp]
+
+    try:
+        lines = inp.read_text().splitlines()
+    except OSError:
+        return inputs
+
+    for line in lines:
+        line = line.split('!')[0].strip()
+        if line.startswith('NAME_TEMPLATE_OF_DATA_FRAMES='):
+            template = Path(path / line.split('=', 1)[1].split()[0])
+            inputs.extend(sorted(template.parent.glob(template.name)))
+
+    return inputs
+
+
+def run_xds_indexing(path) -> dict:
     """Call XDS on the given `path`.
 
-    Uses WSL (Windows 10 only).
+    Uses WSL (Windows 10 only). Returns a dict with the message for
+    the client (`msg`) and the parsed summary of `CORRECT.LP`
+    (`summary`). Raises RuntimeError if indexing failed, so that the
+    job fails instead of caching the result.
     """
     p = sp.Popen('bash -c xds_par 2>&1 >/dev/null', cwd=path)
     p.wait()
@@ -56,11 +97,20 @@ def run_xds_indexing(path):
     now = datetime.datetime.now().strftime('%H:%M:%S.%f')
     print(f'{now} | XDS indexing has finished')
 
-    return msg
+    summary = xds_summary(path)
+    if summary is None:
+        raise RuntimeError(f'No cell found in `CORRECT.LP` (XDS exit code {p.returncode})')
 
+    return {'msg': msg, 'summary': summary}
 
-def handle(conn):
-    """Handle incoming connection."""
+
+def handle(conn, jobs):
+    """Handle incoming connection.
+
+    A data path is submitted to the job queue `jobs`, and the
+    connection waits for the result. Alternatively, a json encoded
+    command can be sent, see `handle_command`.
+    """
     ret = 0
 
     while True:
@@ -80,9 +130,18 @@ def handle(conn):
             ret = 1
             break
 
+        elif data.startswith('{'):
+            response = handle_command(jobs, json.loads(data))
+            conn.send(json.dumps(response).encode())
+
         else:
             conn.send(b'OK')
-            msg = run_xds_indexing(data)
+            job = jobs.submit(data)
+            job.wait()
+            if job.status == DONE:
+                msg = job.output['msg']
+            else:
+                msg = f'{data}: Automatic indexing failed ({job.error})'
             conn.send(msg.encode())
 
     conn.send(b'Connection closed')
@@ -99,12 +158,23 @@ def main():
 Starts a simple XDS server to send indexing jobs to. Runs XDS for every job sent to it. Opens a socket on port {HOST}:{PORT}.
 
 The data sent to the server as a bytes string containing the data path (must contain `cRED_log.txt`).
+
+Jobs are queued and run by a pool of workers (`indexing_server_workers` in `config/settings.yaml`). A dataset that is submitted again while it is being processed is not run twice, and the results of finished jobs are kept in a persistent cache (`indexing_server_cache`), keyed by the data path and a hash of `XDS.INP` and the data frames.
+
+Alternatively, a json encoded dict can be sent to submit a job with a priority or to query the status of the queue:
+
+- `{{"task": "submit", "path": ..., "priority": 10, "wait": false}}`: lower priority numbers are run first
+- `{{"task": "status", "id": ...}}`: status of a job, or of the queue if `id` is omitted
 """
 
     parser = argparse.ArgumentParser(
         description=description,
         formatter_class=argparse.RawDescriptionHelpFormatter)
 
+    parser.add_argument('-w', '--workers', action='store', type=int, dest='workers',
+                        help="""Number of XDS jobs to run at the same time.""")
+
+    parser.set_defaults(workers=config.settings.indexing_server_workers)
     options = parser.parse_args()
 
     date = datetime.datetime.now().strftime('%Y-%m-%d')
@@ -115,19 +185,23 @@ The data sent to the server as a bytes string containing the data path (must con
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
+    cache = ResultCache(config.locations['base'] / config.settings.indexing_server_cache)
+    jobs = JobQueue(Executor(run_xds_indexing, inputs=xds_inputs), workers=options.workers, cache=cache)
+    jobs.start()
+
     s = socket(AF_INET, SOCK_STREAM)
     s.bind((HOST, PORT))
     s.listen(5)
 
-    log.info(f'Indexing server (XDS) listening on {HOST}:{PORT}')
-    print(f'Indexing server (XDS) listening on {HOST}:{PORT}')
+    log.info(f'Indexing server (XDS) listening on {HOST}:{PORT}, {options.workers} workers')
+    print(f'Indexing server (XDS) listening on {HOST}:{PORT}, {options.workers} workers')
 
     with s:
         while True:
             conn, addr = s.accept()
             log.info('Connected by %s', addr)
             print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+            threading.Thread(target=handle, args=(conn, jobs)).start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,327 @@
+"""Route planning for stage positions.
+
+The order in which a list of stage positions is visited determines the
+total time spent moving the stage. Every move takes the time needed by
+the slowest axis, and when moving with backlash correction (see
+`Stage.set_xy_with_backlash_correction`), an extra move and settle
+delay for every position that is not approached from the backlash
+direction. The planner orders the positions to minimize the estimated
+total time, and reports which moves need the backlash correction.
+
+Usage:
+    model = StageModel.from_tem(ctrl.tem)
+    route = plan_route(coords, model=model, method='tsp')
+    for (x, y), backlash in zip(coords[route.order], route.backlash):
+        ...
+"""
+from collections import namedtuple
+
+import numpy as np
+
+Route = namedtuple('Route', ['order', 'backlash', 'time'])
+Route.__doc__ = """Planned route: `order` contains the indices of the positions
+in the order they should be visited, `backlash` whether the move to each of
+these positions needs the backlash correction, and `time` the estimated
+total time (s)."""
+
+
+class StageModel:
+    """Timing model of the stage.
+
+    speed_x, speed_y: float
+        Speed of the x/y axes in nm / s
+    overhead: float
+        Fixed time per move (communication, acceleration) in seconds
+    settle_delay: float
+        Delay after each move to allow the stage to settle in seconds
+    backlash_step: float
+        Size of the backlash correction move (nm), the positions are approached
+        from (x - step, y - step), see `Stage.set_xy_with_backlash_correction`.
+        Set to 0 to ignore backlash
+    backlash_direction: tuple
+        Direction (+1 / -1) from which each axis must be approached
+
+    Moves where all axes move along `backlash_direction` (or do not move)
+    do not need a correction, because the mechanical play has already been
+    taken up in the correct direction.
+    """
+
+    def __init__(self,
+                 speed_x: float = 1_000_000.0,
+                 speed_y: float = 1_000_000.0,
+                 overhead: float = 0.0,
+                 settle_delay: float = 0.200,
+                 backlash_step: float = 10_000,
+                 backlash_direction: tuple = (1, 1),
+                 ):
+        super().__init__()
+        self.speed = np.array((speed_x, speed_y), dtype=float)
+        self.overhead = overhead
+        self.settle_delay = settle_delay
+        self.backlash_step = backlash_step
+        self.backlash_direction = np.sign(backlash_direction)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(speed={self.speed.tolist()}, overhead={self.overhead}, '
+                f'settle_delay={self.settle_delay}, backlash_step={self.backlash_step})')
+
+    @classmethod
+    def from_tem(cls, tem, **kwargs):
+        """Initialize from the stage speeds of a `SimuMicroscope` (or any
+        microscope that models them), falls back to the defaults."""
+        try:
+            stage = tem._stage_dict
+            kwargs.setdefault('speed_x', stage['x']['speed'])
+            kwargs.setdefault('speed_y', stage['y']['speed'])
+        except (AttributeError, KeyError):
+            pass
+        return cls(**kwargs)
+
+    def needs_backlash_correction(self, start, end) -> np.ndarray:
+        """Return whether the moves from `start` to `end` (arrays of (x, y))
+        need the backlash correction."""
+        if not self.backlash_step:
+            return np.zeros(np.broadcast(np.asarray(start)[..., 0], np.asarray(end)[..., 0]).shape, dtype=bool)
+        delta = (np.asarray(end, dtype=float) - np.asarray(start, dtype=float)) * self.backlash_direction
+        return np.any(delta < 0, axis=-1)
+
+    def travel_time(self, start, end) -> np.ndarray:
+        """Time to move straight from `start` to `end` (arrays of (x,
+        y))."""
+        delta = np.abs(np.asarray(end, dtype=float) - np.asarray(start, dtype=float))
+        return np.max(delta / self.speed, axis=-1) + self.overhead
+
+    def move_time(self, start, end, backlash: bool = True) -> np.ndarray:
+        """Time to move from `start` to `end` including the settle delays,
+        and the backlash correction where needed if `backlash` is
+        True."""
+        end = np.asarray(end, dtype=float)
+        t = self.travel_time(start, end) + self.settle_delay
+        if not backlash or not self.backlash_step:
+            return t
+
+        pre = end - self.backlash_step * self.backlash_direction
+        t_corrected = self.travel_time(start, pre) + self.travel_time(pre, end) + 2 * self.settle_delay
+        return np.where(self.needs_backlash_correction(start, end), t_corrected, t)
+
+    def cost_matrix(self, coords, backlash: bool = True) -> np.ndarray:
+        """Matrix with the time to move from position i to position j."""
+        coords = np.asarray(coords, dtype=float)
+        return self.move_time(coords[:, np.newaxis], coords[np.newaxis, :], backlash=backlash)
+
+
+def _as_coords(coords) -> np.ndarray:
+    """Convert a list of (x, y) / (x, y, z) coordinates or navigation items
+    to an array of (x, y) in nm."""
+    xy = []
+    for item in coords:
+        try:
+            xy.append((item.stage_x * 1000, item.stage_y * 1000))  # um -> nm
+        except AttributeError:
+            xy.append(tuple(item[:2]))
+    return np.array(xy, dtype=float).reshape(-1, 2)
+
+
+def route_time(coords, order, model: StageModel = None, start=None, backlash: bool = True) -> float:
+    """Estimate the time (s) to visit `coords` in the given `order`,
+    starting from position `start` if given."""
+    model = model or StageModel()
+    path = _as_coords(coords)[np.asarray(order, dtype=int)]
+    if start is not None:
+        path = np.vstack((start[:2], path))
+    if len(path) < 2:
+        return 0.0
+    return float(np.sum(model.move_time(path[:-1], path[1:], backlash=backlash)))
+
+
+def nearest_neighbour_order(cost: np.ndarray, start_cost: np.ndarray = None) -> np.ndarray:
+    """Greedy tour through all positions, always moving to the cheapest
+    unvisited position next.
+
+    cost: np.ndarray (n, n)
+        Cost of moving from position i to position j
+    start_cost: np.ndarray (n)
+        Cost of moving from the start position to each position, the tour
+        starts at position 0 if not given
+    """
+    n = len(cost)
+    if n == 0:
+        return np.array([], dtype=int)
+
+    visited = np.zeros(n, dtype=bool)
+    current = 0 if start_cost is None else int(np.argmin(start_cost))
+    order = [current]
+    visited[current] = True
+
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, cost[current])
+        current = int(np.argmin(row))
+        order.append(current)
+        visited[current] = True
+
+    return np.array(order)
+
+
+def two_opt(order: np.ndarray, cost: np.ndarray, start_cost: np.ndarray = None, max_iter: int = 100) -> np.ndarray:
+    """Improve the tour `order` by reversing segments (2-opt) as long as it
+    reduces the total cost.
+
+    The costs may be asymmetric (backlash), so reversing a segment also
+    accounts for the changed cost of the moves inside the segment. If
+    `start_cost` is given, the first position of the tour may also
+    change.
+    """
+    order = np.array(order, dtype=int)
+    n = len(order)
+    if n < 3:
+        return order
+
+    if start_cost is None:
+        lo = 1  # first position is fixed
+        start_cost = np.zeros(n)
+    else:
+        lo = 0
+
+    for _ in range(max_iter):
+        improved = False
+        for i in range(lo, n - 1):
+            fwd = cost[order[:-1], order[1:]]
+            bwd = cost[order[1:], order[:-1]]
+            fwd_sum = np.concatenate(([0], np.cumsum(fwd)))
+            bwd_sum = np.concatenate(([0], np.cumsum(bwd)))
+
+            # reverse order[i:j + 1] for all j > i
+            j = np.arange(i + 1, n)
+            first, last = order[i], order[j]
+
+            if i == 0:
+                before = start_cost[first]
+                after = start_cost[last]
+            else:
+                before = cost[order[i - 1], first]
+                after = cost[order[i - 1], last]
+
+            nxt = np.minimum(j + 1, n - 1)
+            has_next = j < n - 1
+            before += np.where(has_next, cost[last, order[nxt]], 0)
+            after += np.where(has_next, cost[first, order[nxt]], 0)
+
+            before = before + fwd_sum[j] - fwd_sum[i]
+            after = after + bwd_sum[j] - bwd_sum[i]
+
+            delta = after - before
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                order[i:j[k] + 1] = order[i:j[k] + 1][::-1]
+                improved = True
+
+        if not improved:
+            break
+
+    return order
+
+
+def serpentine_order(coords, angle: float = 0.0, tolerance: float = None) -> np.ndarray:
+    """Order the positions of a (rotated) grid row by row, alternating the
+    direction of every other row (boustrophedon).
+
+    coords: np.ndarray (n, 2)
+        Positions (x, y)
+    angle: float
+        Rotation of the grid rows with respect to the x-axis (radians)
+    tolerance: float
+        Positions whose y-coordinates (in the rotated frame) differ less
+        than this value belong to the same row, defaults to half of the
+        typical row spacing
+    """
+    coords = _as_coords(coords)
+    n = len(coords)
+    if n == 0:
+        return np.array([], dtype=int)
+
+    if angle:
+        sin, cos = np.sin(angle), np.cos(angle)
+        coords = coords @ np.array([[cos, -sin], [sin, cos]])
+
+    x, y = coords.T
+    by_y = np.argsort(y, kind='stable')
+    gaps = np.diff(y[by_y])
+
+    if tolerance is None:
+        steps = gaps[gaps > 1e-6 * max(np.ptp(y), 1.0)]
+        tolerance = 0.5 * np.median(steps) if len(steps) else 0.0
+
+    row_starts = np.flatnonzero(gaps > tolerance) + 1
+    rows = np.split(by_y, row_starts)
+
+    order = []
+    for k, row in enumerate(rows):
+        row = row[np.argsort(x[row], kind='stable')]
+        order.extend(row if k % 2 == 0 else row[::-1])
+
+    return np.array(order)
+
+
+def plan_route(coords,
+               model: StageModel = None,
+               method: str = 'tsp',
+               start=None,
+               backlash: bool = True,
+               angle: float = 0.0,
+               ) -> Route:
+    """Plan the order in which to visit the stage positions.
+
+    coords: list
+        List of (x, y) / (x, y, z) coordinates (nm), or navigation items
+        loaded from a `.nav` file
+    model: StageModel
+        Timing model of the stage, see `StageModel.from_tem`
+    method: str
+        'tsp': nearest neighbour tour improved with 2-opt, minimizing the
+        estimated time, 'nearest': nearest neighbour tour only,
+        'serpentine': grid rows in alternating directions, None: keep the
+        order as given
+    start: tuple
+        Current stage position (x, y), the tour may then start at any of the
+        positions. Otherwise, the tour starts at the first position
+    backlash: bool
+        The stage is moved with backlash correction
+    angle: float
+        Rotation of the grid rows (radians), used with 'serpentine'
+
+    Returns
+    -------
+    route: `Route`
+        Named tuple with the visiting order, the backlash flags, and the
+        estimated time
+    """
+    model = model or StageModel()
+    xy = _as_coords(coords)
+    n = len(xy)
+
+    if start is not None:
+        start = np.asarray(start[:2], dtype=float)
+
+    if method is None or n < 2:
+        order = np.arange(n)
+    elif method == 'serpentine':
+        order = serpentine_order(xy, angle=angle)
+    elif method in ('tsp', 'nearest'):
+        cost = model.cost_matrix(xy, backlash=backlash)
+        start_cost = None if start is None else model.move_time(start, xy, backlash=backlash)
+        order = nearest_neighbour_order(cost, start_cost)
+        if method == 'tsp':
+            order = two_opt(order, cost, start_cost)
+    else:
+        raise ValueError(f'Unknown routing method: {method!r}')
+
+    if backlash and n:
+        flags = np.ones(n, dtype=bool)  # the direction of the first approach is unknown
+        path = xy[order]
+        flags[1:] = model.needs_backlash_correction(path[:-1], path[1:])
+    else:
+        flags = np.zeros(n, dtype=bool)
+
+    time = route_time(xy, order, model=model, start=start, backlash=backlash)
+
+    return Route(order, flags, time)
@@ -126,6 +126,55 @@ def find_beam_center(img: np.ndarray, sigma: int = 30, m: int = 100, kind: int =
     return center
 
 
+def find_peak_maxima(arr: np.ndarray, sigma: int, m: int = 50, w: int = 10, kind: int = 3) -> np.ndarray:
+    """Find the peak maximum for every row in the 2D array `arr`, see
+    `find_peak_max`.
+
+    All rows are smoothed and interpolated together, rows where the
+    peak is too close to the edges return the initial guess.
+    """
+    arr = np.asarray(arr, dtype=float)
+    n, size = arr.shape
+
+    y1 = ndimage.gaussian_filter1d(arr, sigma, axis=-1)
+    c1 = np.argmax(y1, axis=-1)  # initial guess for beam center
+
+    ret = c1.astype(float)
+
+    ok = (c1 >= w) & (c1 + w + 1 <= size)
+    if not ok.any():
+        return ret
+
+    win_len = 2 * w + 1
+
+    # windows around the initial guess, relative to `c1 - w`
+    windows = np.take_along_axis(y1[ok], c1[ok, None] + np.arange(-w, w + 1), axis=-1)
+
+    r1 = np.linspace(0, 2 * w, win_len)
+    f = interpolate.interp1d(r1, windows, kind=kind, axis=-1)
+    r2 = np.linspace(0, 2 * w, win_len * m)  # extrapolate for subpixel accuracy
+    y2 = f(r2)
+    c2 = np.argmax(y2, axis=-1) / m  # find beam center with `m` precision
+
+    ret[ok] = c2 + c1[ok] - w
+    return ret
+
+
+def find_beam_centers(stack: np.ndarray, sigma: int = 30, m: int = 100, kind: int = 3) -> np.ndarray:
+    """Find the center of the primary beam for every image in `stack`
+    (a 3D array), see `find_beam_center`.
+
+    Returns an (n, 2) array with the beam centers.
+    """
+    xx = np.sum(stack, axis=2)
+    yy = np.sum(stack, axis=1)
+
+    cx = find_peak_maxima(xx, sigma, m=m, kind=kind)
+    cy = find_peak_maxima(yy, sigma, m=m, kind=kind)
+
+    return np.stack([cx, cy], axis=1)
+
+
 def find_beam_center_with_beamstop(img, z: int = None, method='thresh', plot=False) -> (float, float):
     """Find the beam center when a beam stop is present.
 
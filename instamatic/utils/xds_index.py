@@ -0,0 +1,292 @@
+"""Index of XDS results (`CORRECT.LP`) in a local SQLite database.
+
+The summaries of all `CORRECT.LP` files found in the given directories
+are stored in a single table, so that the datasets can be filtered and
+clustered by unit cell without walking the directory trees and parsing
+the files again. Ingesting is incremental: only files that are new or
+have been modified since the last run (by mtime) are parsed, and files
+that no longer exist are removed from the index.
+
+Usage:
+    index = XDSIndex('xds_index.sqlite')
+    index.ingest(['C:/data/experiment_1', 'C:/data/experiment_2'])
+    rows = index.query(spgr=14, min_completeness=50.0)
+    clusters = index.cluster(threshold=0.05, min_cchalf=90.0)
+"""
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from .xds_parser import parse_fns
+from .xds_parser import xds_parser
+
+logger = logging.getLogger(__name__)
+
+CELL_COLUMNS = ('a', 'b', 'c', 'al', 'be', 'ga')
+
+COLUMNS = (
+    ('fn', 'TEXT PRIMARY KEY'),
+    ('mtime', 'REAL'),
+    ('ok', 'INTEGER'),  # 0 if the file could not be parsed
+    *((name, 'REAL') for name in CELL_COLUMNS),
+    ('volume', 'REAL'),
+    ('spgr', 'INTEGER'),
+    ('ISa', 'REAL'),
+    ('Boverall', 'REAL'),
+    ('dmax', 'REAL'),
+    ('dmin', 'REAL'),
+    ('ntot', 'INTEGER'),
+    ('nuniq', 'INTEGER'),
+    ('completeness', 'REAL'),
+    ('ios', 'REAL'),
+    ('rmeas', 'REAL'),
+    ('cchalf', 'REAL'),
+)
+
+INDEXED_COLUMNS = ('spgr', 'volume', 'completeness', 'cchalf', 'ISa', 'dmin')
+
+
+def summary_to_row(summary: dict) -> dict:
+    """Convert the summary from `xds_parser.summary` to a table row."""
+    row = dict(zip(CELL_COLUMNS, summary['cell']))
+    row['dmax'] = summary['res_range'][0]
+    for key in ('volume', 'spgr', 'ISa', 'Boverall', 'dmin', 'ntot', 'nuniq', 'completeness', 'ios', 'rmeas', 'cchalf'):
+        row[key] = summary[key]
+    return row
+
+
+class XDSIndex:
+    """SQLite-backed index of XDS `CORRECT.LP` summaries.
+
+    path: str
+        Location of the database file, the index is kept in memory only
+        if None
+    """
+
+    def __init__(self, path: str = None):
+        super().__init__()
+        self.path = Path(path) if path else None
+        self.conn = sqlite3.connect(str(self.path) if self.path else ':memory:')
+        self.conn.row_factory = sqlite3.Row
+        self._create_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM datasets WHERE ok = 1').fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _create_tables(self) -> None:
+        columns = ', '.join(f'{name} {kind}' for name, kind in COLUMNS)
+        with self.conn:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS datasets ({columns})')
+            for name in INDEXED_COLUMNS:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{name} ON datasets ({name})')
+
+    def mtimes(self) -> dict:
+        """Return the modification times of the indexed files."""
+        return {fn: mtime for fn, mtime in self.conn.execute('SELECT fn, mtime FROM datasets')}
+
+    def ingest(self, paths: list, prune: bool = True) -> dict:
+        """Add the `CORRECT.LP` files in `paths` (files or directories,
+        searched recursively) to the index.
+
+        Only files that are not in the index yet or have been modified
+        since they were ingested are parsed. If `prune` is True, indexed
+        files that no longer exist are removed.
+
+        Returns a dict with the number of files that were added, updated,
+        removed, unchanged, and that could not be parsed.
+        """
+        fns = parse_fns([Path(path) for path in paths])
+        known = self.mtimes()
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0}
+
+        with self.conn:
+            for fn in fns:
+                key = str(fn)
+                mtime = os.path.getmtime(fn)
+                if known.get(key) == mtime:
+                    counts['unchanged'] += 1
+                    continue
+
+                row = {'fn': key, 'mtime': mtime, 'ok': 0}
+                try:
+                    p = xds_parser(fn)
+                except (UnboundLocalError, ValueError, IndexError, StopIteration) as e:
+                    logger.warning('Could not parse %s: %s', fn, e)
+                else:
+                    if p.d:
+                        row.update(summary_to_row(p.summary()), ok=1)
+
+                if not row['ok']:
+                    counts['failed'] += 1
+                counts['updated' if key in known else 'added'] += 1
+
+                names = ', '.join(row)
+                values = ', '.join(f':{name}' for name in row)
+                self.conn.execute(f'INSERT OR REPLACE INTO datasets ({names}) VALUES ({values})', row)
+
+            if prune:
+                for key in known:
+                    if not os.path.exists(key):
+                        self.conn.execute('DELETE FROM datasets WHERE fn = ?', (key,))
+                        counts['removed'] += 1
+
+        logger.info('Ingested %s', counts)
+        return counts
+
+    def query(self,
+              spgr: int = None,
+              min_completeness: float = None,
+              min_cchalf: float = None,
+              min_isa: float = None,
+              max_dmin: float = None,
+              volume: tuple = None,
+              fn: str = None,
+              ) -> list:
+        """Return the indexed datasets matching all of the given criteria as
+        a list of dicts, sorted by filename.
+
+        spgr: int
+            Space group number
+        min_completeness, min_cchalf, min_isa: float
+            Lower limits for the overall completeness (%), CC(1/2) (%), and
+            ISa
+        max_dmin: float
+            Datasets must extend to at least this resolution (Ångström)
+        volume: tuple
+            Range (min, max) of the unit cell volume
+        fn: str
+            SQL `LIKE` pattern for the filename, i.e. `%/experiment_1/%`
+        """
+        conditions = ['ok = 1']
+        params = []
+
+        for condition, value in (
+            ('spgr = ?', spgr),
+            ('completeness >= ?', min_completeness),
+            ('cchalf >= ?', min_cchalf),
+            ('ISa >= ?', min_isa),
+            ('dmin <= ?', max_dmin),
+            ('fn LIKE ?', fn),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        if volume is not None:
+            conditions.append('volume BETWEEN ? AND ?')
+            params.extend(volume)
+
+        sql = f'SELECT * FROM datasets WHERE {" AND ".join(conditions)} ORDER BY fn'
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def cluster(self, threshold: float = 0.05, method: str = 'average', **kwargs) -> list:
+        """Group the datasets by unit cell using hierarchical clustering.
+
+        The distance between two cells is the euclidean distance between
+        the logarithms of the cell lengths and the angles in radians, so
+        that `threshold` is roughly the relative difference between two
+        cells. The cells are compared as given, axes are not permuted.
+        Keyword arguments are passed to `XDSIndex.query` to select the
+        datasets.
+
+        Returns a list of clusters (lists of rows, see `query`), largest
+        cluster first.
+        """
+        rows = self.query(**kwargs)
+        if len(rows) < 2:
+            return [rows] if rows else []
+
+        from scipy.cluster.hierarchy import fcluster
+        from scipy.cluster.hierarchy import linkage
+
+        cells = np.array([[row[name] for name in CELL_COLUMNS] for row in rows])
+        vectors = np.hstack((np.log(cells[:, :3]), np.radians(cells[:, 3:])))
+
+        z = linkage(vectors, method=method)
+        labels = fcluster(z, threshold, criterion='distance')
+
+        clusters = [[row for row, label in zip(rows, labels) if label == k] for k in np.unique(labels)]
+        return sorted(clusters, key=len, reverse=True)
+
+
+def print_rows(rows: list) -> None:
+    print('  #  spgr         a         b         c        al        be        ga    volume   compl  CC(1/2)    ISa   dmin')
+    for i, row in enumerate(rows):
+        print('{i: 3d} {spgr: 5d}{a:10.2f}{b:10.2f}{c:10.2f}{al:10.2f}{be:10.2f}{ga:10.2f}{volume:10.1f}{completeness:8.1f}{cchalf:9.1f}{ISa:7.2f}{dmin:7.2f}  # {fn}'.format(
+            i=i, **row))
+
+
+def main():
+    import argparse
+
+    description = """Index the XDS results (`CORRECT.LP`) in the given directories in a local database, and list or cluster the datasets matching the given criteria. Only new or modified files are parsed."""
+
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('args',
+                        type=str, nargs='*', metavar='PATH',
+                        help='Directories to search for `CORRECT.LP` files (default: current directory).')
+
+    parser.add_argument('-d', '--db',
+                        action='store', type=str, dest='db',
+                        help='Database file (default: `xds_index.sqlite`).')
+
+    parser.add_argument('-s', '--spgr',
+                        action='store', type=int, dest='spgr',
+                        help='Select datasets with this space group number.')
+
+    parser.add_argument('-c', '--completeness',
+                        action='store', type=float, dest='min_completeness',
+                        help='Minimum completeness (%%).')
+
+    parser.add_argument('-x', '--cchalf',
+                        action='store', type=float, dest='min_cchalf',
+                        help='Minimum CC(1/2) (%%).')
+
+    parser.add_argument('-t', '--threshold',
+                        action='store', type=float, dest='threshold',
+                        help='Cluster the unit cells using this distance threshold (i.e. 0.05).')
+
+    parser.set_defaults(db='xds_index.sqlite',
+                        spgr=None,
+                        min_completeness=None,
+                        min_cchalf=None,
+                        threshold=None)
+
+    options = parser.parse_args()
+    paths = options.args or ['.']
+
+    with XDSIndex(options.db) as index:
+        counts = index.ingest(paths)
+        print('{added} added, {updated} updated, {removed} removed, {unchanged} unchanged, {failed} failed'.format(**counts))
+        print(f'{len(index)} datasets in {options.db}\n')
+
+        criteria = {
+            'spgr': options.spgr,
+            'min_completeness': options.min_completeness,
+            'min_cchalf': options.min_cchalf,
+        }
+
+        if options.threshold is None:
+            print_rows(index.query(**criteria))
+        else:
+            for k, rows in enumerate(index.cluster(threshold=options.threshold, **criteria)):
+                print(f'\nCluster {k}: {len(rows)} datasets')
+                print_rows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -179,6 +179,24 @@ class xds_parser:
         d['spgr'] = self.space_group
         return d
 
+    def summary(self) -> dict:
+        """Return the cell and the overall integration statistics as a dict
+        of plain python types (json serializable)."""
+        d = self.d
+        summary = {
+            'fn': str(d['fn']),
+            'cell': list(d['cell']),
+            'raw_cell': list(d['raw_cell']),
+            'volume': d['volume'],
+            'spgr': d['spgr'],
+            'ISa': d['ISa'],
+            'Boverall': d['Boverall'],
+            'res_range': list(d['res_range']),
+            'dmin': d['outer'],
+        }
+        summary.update(d['total'])
+        return summary
+
 
 def cells_to_excel(ps, out='cells.xlsx'):
     """Takes a list of `xds_parser` instances and writes the cell parameters to
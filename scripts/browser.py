@@ -24,12 +24,15 @@ R = np.array([
 def get_stage_coords(fns, return_ims=False):
     coords = []
     has_crystals = []
-    t = tqdm(fns, desc='Parsing files')
+
+    # only the headers are parsed, the images are read only when stitching
+    stack = FrameStack(fns)
+    t = tqdm(range(len(stack)), desc='Parsing files')
 
     imgs = []
 
-    for fn in t:
-        img, h = read_image(fn)
+    for i in t:
+        h = stack.header(i)
         try:
             dx, dy = h['exp_hole_offset']
             cx, cy = h['exp_hole_center']
@@ -40,7 +43,7 @@ def get_stage_coords(fns, return_ims=False):
 
         has_crystals.append(len(h['exp_crystal_coords']) > 0)
         if return_ims:
-            img = ndimage.zoom(img, 0.0969)
+            img = ndimage.zoom(stack[i], 0.0969)
             imgs.append(img)
     # convert to um
 
@@ -17,6 +17,59 @@ def closest_distance(node, nodes):
     return np.sort(dist_2)[1]**0.5
 
 
+def classify_crystals(coords, h: dict, min_separation=1.5, boundary=0.5) -> list:
+    """Classify the crystals at `coords` in the image with header `h`.
+
+    Returns a list of (x, y, color), where the color is red for isolated
+    crystals, orange for crystals near the boundary, and blue otherwise.
+    """
+    # apply calibration
+    shape = h['ImageCameraDimensions']
+    dimensions = h['ImageDimensions']
+    calibrated_coords = np.multiply(coords, dimensions / shape)
+
+    boundary_px = shape * boundary / dimensions
+
+    objects = []
+
+    for i, (coord, calibrated_coord) in enumerate(zip(coords, calibrated_coords)):
+        try:
+            min_dist = closest_distance(calibrated_coord, calibrated_coords)
+        except IndexError:
+            min_dist = 9999
+
+        x, y = coord
+
+        if not (boundary_px[0] < x < shape[0] - boundary_px[0]):
+            objects.append((x, y, 'orange'))
+        elif not (boundary_px[1] < y < shape[1] - boundary_px[1]):
+            objects.append((x, y, 'orange'))
+        elif min_dist > min_separation:
+            objects.append((x, y, 'red'))
+        else:
+            objects.append((x, y, 'blue'))
+
+    return objects
+
+
+def plot_crystals(img, objects, title):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    ax.imshow(img)
+
+    for (x, y, color) in objects:
+        ax.scatter(y, x, color=color)
+
+    # diff_img, _ = read_hdf5(isolated[-1])
+    # ax2 = inset_locator.inset_axes(ax, "40%", "40%", loc=3)
+    # ax2.imshow(diff_img, vmax=np.percentile(diff_img, 99))
+    # ax2.axis("off")
+
+    ax.axis('off')
+    ax.set_title(title)
+    plt.show()
+
+
 def find_isolated_crystals(fns, min_separation=1.5, boundary=0.5, plot=False):
     """Find crystals that are at least `min_separation` in micrometers away
     from other crystals."""
@@ -29,96 +82,158 @@ def find_isolated_crystals(fns, min_separation=1.5, boundary=0.5, plot=False):
         if len(coords) == 0:
             continue
 
-        # apply calibration
-        shape = h['ImageCameraDimensions']
-        dimensions = h['ImageDimensions']
-        calibrated_coords = np.multiply(coords, dimensions / shape)
+        objects = classify_crystals(coords, h, min_separation=min_separation, boundary=boundary)
 
-        boundary_px = shape * boundary / dimensions
+        p = Path(fn)
+        for i, (x, y, color) in enumerate(objects):
+            if color == 'red':
+                isolated.append(p.parents[1] / 'data' / f'{p.stem}_{i:04d}{p.suffix}')
 
-        objects = []
-        n_isolated = 0
+        if plot and any(color == 'red' for x, y, color in objects):
+            plot_crystals(img, objects, fn)
 
-        for i, (coord, calibrated_coord) in enumerate(zip(coords, calibrated_coords)):
-            try:
-                min_dist = closest_distance(calibrated_coord, calibrated_coords)
-            except IndexError:
-                min_dist = 9999
+    return isolated
 
-            x, y = coord
 
-            if not (boundary_px[0] < x < shape[0] - boundary_px[0]):
-                objects.append((x, y, 'orange'))
-            elif not (boundary_px[1] < y < shape[1] - boundary_px[1]):
-                objects.append((x, y, 'orange'))
-            elif min_dist > min_separation:
-                objects.append((x, y, 'red'))
-                n_isolated += 1
-                p = Path(fn)
-                isolated.append(p.parents[1] / 'data' / f'{p.stem}_{i:04d}{p.suffix}')
-            else:
-                objects.append((x, y, 'blue'))
+def find_isolated_crystals_container(reader, min_separation=1.5, boundary=0.5, plot=False):
+    """Find crystals that are at least `min_separation` in micrometers away
+    from other crystals in a serialED container.
+
+    Returns the indices of their diffraction patterns in the `data`
+    series.
+    """
+    if 'data' not in reader:
+        return []
 
-        if plot and n_isolated:
-            import matplotlib.pyplot as plt
-            fig, ax = plt.subplots()
-            ax.imshow(img)
+    images = reader['images']
+    headers = reader['data'].headers
+
+    isolated = []
+
+    for n in range(len(images)):
+        h = images.header(n)
+        coords = images.crystal_coords(n)
+
+        if len(coords) == 0:
+            continue
 
-            for (x, y, color) in objects:
-                ax.scatter(y, x, color=color)
+        objects = classify_crystals(coords, h, min_separation=min_separation, boundary=boundary)
 
-            # diff_img, _ = read_hdf5(isolated[-1])
-            # ax2 = inset_locator.inset_axes(ax, "40%", "40%", loc=3)
-            # ax2.imshow(diff_img, vmax=np.percentile(diff_img, 99))
-            # ax2.axis("off")
+        sel = headers['exp_image_index'] == h['exp_image_index']
+        for i, (x, y, color) in enumerate(objects):
+            if color == 'red':
+                # first pattern of the crystal, skip other rotation angles
+                match = np.flatnonzero(sel & (headers['exp_crystal_index'] == i))
+                if len(match):
+                    isolated.append(match[0])
 
-            ax.axis('off')
-            ax.set_title(fn)
-            plt.show()
+        if plot and any(color == 'red' for x, y, color in objects):
+            plot_crystals(images.data[n], objects, f'images/{n}')
 
     return isolated
 
 
-def main(file_pattern):
-    image_fns = glob.glob(file_pattern)
-    print(len(image_fns), 'Images')
+def pattern_info(h: dict):
+    """Return the crystal size and stage position (size, x, y) of a
+    diffraction pattern from its header `h`."""
+    try:
+        size = h['total_area_micrometer'] / h['crystal_clusters']  # micrometer^2
+    except KeyError:
+        # old data formats don't have this information
+        size = 0.0
 
-    diff_fns = find_isolated_crystals(image_fns)
-    print(len(diff_fns), 'Patterns from isolated crystals')
+    try:
+        dx, dy = h['exp_hole_offset']
+        cx, cy = h['exp_hole_center']
+    except KeyError:
+        dx, dy = h['exp_scan_offset']
+        cx, cy = h['exp_scan_center']
 
-    lst = []
-    for fn in tqdm(diff_fns):
-        img, h = read_hdf5(fn)
+    size = round(size, 4)
+    x = int(cx + dx)
+    y = int(cy + dy)
+
+    return size, x, y
+
+
+def evaluate_pattern(img, h: dict):
+    """Predict the quality of the diffraction pattern `img`.
+
+    Returns a tuple (prediction, size, x, y), or None if the
+    prediction is too low.
+    """
+    img_processed = neural_network.preprocess(img.astype(np.float))
+    prediction = neural_network.predict(img_processed)
 
-        frame = int(str(fn)[-12:-8])
-        number = int(str(fn)[-7:-3])
+    if prediction < 0.5:
+        # print fn, "prediction too low", prediction
+        return None
 
-        img_processed = neural_network.preprocess(img.astype(np.float))
-        prediction = neural_network.predict(img_processed)
+    prediction = round(prediction, 4)
+    return (prediction, *pattern_info(h))
 
+
+def evaluate_patterns(patterns):
+    """Predict the quality of the diffraction patterns in one batch.
+
+    `patterns` is an iterable of (name, frame, number, img, h), returns
+    a list of (name, frame, number, prediction, size, x, y) for the
+    patterns with a prediction of at least 0.5.
+    """
+    items = []
+    processed = []
+    for name, frame, number, img, h in patterns:
+        processed.append(neural_network.preprocess(img.astype(np.float)))
+        items.append((name, frame, number, h))
+
+    if not processed:
+        return []
+
+    predictions = neural_network.predict_batch(np.stack(processed))
+
+    lst = []
+    for (name, frame, number, h), prediction in zip(items, predictions):
         if prediction < 0.5:
-            # print fn, "prediction too low", prediction
             continue
+        lst.append((name, frame, number, round(float(prediction), 4), *pattern_info(h)))
 
-        try:
-            size = h['total_area_micrometer'] / h['crystal_clusters']  # micrometer^2
-        except KeyError:
-            # old data formats don't have this information
-            size = 0.0
+    return lst
 
-        try:
-            dx, dy = h['exp_hole_offset']
-            cx, cy = h['exp_hole_center']
-        except KeyError:
-            dx, dy = h['exp_scan_offset']
-            cx, cy = h['exp_scan_center']
 
-        prediction = round(prediction, 4)
-        size = round(size, 4)
-        x = int(cx + dx)
-        y = int(cy + dy)
+def main(file_pattern):
+    if is_h5container(file_pattern):
+        with H5ContainerReader(file_pattern) as reader:
+            print(len(reader['images']), 'Images')
+
+            indices = find_isolated_crystals_container(reader)
+            print(len(indices), 'Patterns from isolated crystals')
+
+            data = reader['data']
+            fn = Path(file_pattern).absolute()
+
+            def patterns():
+                for j in tqdm(indices):
+                    img, h = data[j]
+                    yield f'{fn}:data/{j}', h['exp_image_index'], h['exp_crystal_index'], img, h
+
+            lst = evaluate_patterns(patterns())
+    else:
+        image_fns = glob.glob(file_pattern)
+        print(len(image_fns), 'Images')
+
+        diff_fns = find_isolated_crystals(image_fns)
+        print(len(diff_fns), 'Patterns from isolated crystals')
+
+        def patterns():
+            for fn in tqdm(diff_fns):
+                img, h = read_hdf5(fn)
+
+                frame = int(str(fn)[-12:-8])
+                number = int(str(fn)[-7:-3])
+
+                yield fn.absolute(), frame, number, img, h
 
-        lst.append((fn.absolute(), frame, number, prediction, size, x, y))
+        lst = evaluate_patterns(patterns())
 
     with open('learning.csv', 'w', newline='') as csvfile:
         # writer = csv.DictWriter(csvfile, fieldnames=["filename", "frame", "number", "quality", "size", "xpos", "ypos"])
@@ -137,7 +252,7 @@ def main_entry():
 
     parser.add_argument('args',
                         type=str, nargs=1, metavar='PAT',
-                        help='File pattern to glob for images (HDF5), i.e. `images/*.h5`.')
+                        help='File pattern to glob for images (HDF5), i.e. `images/*.h5`, or a serialED container, i.e. `serialed.h5`.')
 
     options = parser.parse_args()
     args = options.args
@@ -32,7 +32,58 @@ def get_files(file_pat: str) -> list:
     return fns
 
 
-fns = get_files(r'images\image*.h5')
+def iter_files(file_pat: str):
+    """Yield the image, its name, crystal coordinates, and a list of
+    (diffraction pattern, name) for every image from separate files."""
+    for fn in get_files(file_pat):
+        dps = glob.glob(fn.replace('images', 'data').replace('.h5', '_*.h5'))
+
+        im, h_im = read_image(fn)
+        crystal_coords = np.array(h_im['exp_crystal_coords'])
+
+        diffs = []
+        for dp in dps:
+            try:
+                diff, h_diff = read_image(dp)
+            except BaseException:
+                print('fail')
+                continue
+            diffs.append((diff, dp))
+
+        yield im, fn, crystal_coords, diffs
+
+
+def iter_container(fname: str):
+    """Yield the image, its name, crystal coordinates, and a list of
+    (diffraction pattern, name) for every image in a serialED container."""
+    from instamatic.formats import H5ContainerReader
+
+    with H5ContainerReader(fname) as reader:
+        images = reader['images']
+
+        if 'data' in reader:
+            data = reader['data']
+            headers = data.headers
+        else:
+            headers = np.zeros(0, dtype=[('exp_image_index', int), ('exp_crystal_index', int)])
+
+        for i, (im, h_im) in enumerate(images):
+            n = h_im['exp_image_index']
+
+            # skip the patterns at other rotation angles
+            diffs = {}
+            for j in np.flatnonzero(headers['exp_image_index'] == n):
+                k = headers['exp_crystal_index'][j]
+                if k not in diffs:
+                    diffs[k] = (data.data[j], f'data/{j}')
+
+            yield im, f'images/{i}', images.crystal_coords(i), list(diffs.values())
+
+
+if os.path.exists('serialed.h5'):
+    items = iter_container('serialed.h5')
+else:
+    items = iter_files(r'images\image*.h5')
 
 fontdict = {'fontsize': 30}
 vmax_im = 500
@@ -46,20 +97,8 @@ number = 0
 if not os.path.isdir('movie'):
     os.mkdir('movie')
 
-for i, fn in enumerate(tqdm(fns)):
-    dps = glob.glob(fn.replace('images', 'data').replace('.h5', '_*.h5'))
-
-    im, h_im = read_image(fn)
-
-    crystal_coords = np.array(h_im['exp_crystal_coords'])
-
-    for j, dp in enumerate(dps):
-        try:
-            diff, h_diff = read_image(dp)
-        except BaseException:
-            print('fail')
-            continue
-
+for im, fn, crystal_coords, diffs in tqdm(items):
+    for j, (diff, dp) in enumerate(diffs):
         x, y = crystal_coords[j]
 
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(21.5, 10), sharex=True, sharey=True)
@@ -1,3 +1,4 @@
+import os
 import sys
 from pathlib import Path
 
@@ -137,7 +138,8 @@ def img_convert(credlog, tiff_path='tiff2', mrc_path='RED', smv_path='SMV'):
                              flatfield=None,
                              pixelsize=pixelsize,
                              physical_pixelsize=physical_pixelsize,
-                             wavelength=wavelength)
+                             wavelength=wavelength,
+                             processes=os.cpu_count())
 
     if mrc_path:
         mrc_path = drc / mrc_path
@@ -161,6 +163,8 @@ def img_convert(credlog, tiff_path='tiff2', mrc_path='RED', smv_path='SMV'):
 
     img_conv.write_pets_inp(path=drc, tiff_path=tiff_drc_name)
 
+    img_conv.close()
+
 
 def main():
     try:
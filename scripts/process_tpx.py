@@ -12,6 +12,7 @@ Defaults to `cred_log.txt` in the current directory if left blank.
 If the first argument is given as `all`, the script will look for
 all `cred_log.txt` files in the subdirectories, and iterate over those.
 """
+import os
 import sys
 from pathlib import Path
 
@@ -147,6 +148,7 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
                              wavelength=wavelength,
                              stretch_amplitude=stretch_amplitude,
                              stretch_azimuth=stretch_azimuth,
+                             processes=os.cpu_count(),
                              )
 
     # azimuth, amplitude = 83.37, 2.43  # add 90 to azimuth for old files
@@ -177,6 +179,8 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
         img_conv.write_xds_inp(smv_path)
         # img_conv.to_dials(smv_path)
 
+    img_conv.close()
+
 
 def main():
     try:
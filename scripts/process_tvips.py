@@ -12,6 +12,7 @@ Defaults to `cred_log.txt` in the current directory if left blank.
 If the first argument is given as `all`, the script will look for
 all `cred_log.txt` files in the subdirectories, and iterate over those.
 """
+import os
 import sys
 from pathlib import Path
 
@@ -178,7 +179,8 @@ def img_convert(credlog, tiff_path=None, mrc_path='RED', smv_path='SMV'):
                              flatfield=None,
                              pixelsize=pixelsize,
                              physical_pixelsize=physical_pixelsize,
-                             wavelength=wavelength)
+                             wavelength=wavelength,
+                             processes=os.cpu_count())
 
     if beamstop:
         from instamatic.utils.beamstop import find_beamstop_rect
@@ -215,6 +217,8 @@ def img_convert(credlog, tiff_path=None, mrc_path='RED', smv_path='SMV'):
         img_conv.write_pets_inp(path=drc, tiff_path=tiff_drc_name)
     img_conv.write_beam_centers(path=drc)
 
+    img_conv.close()
+
 
 def main():
     try:
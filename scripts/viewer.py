@@ -1,14 +1,17 @@
 import sys
 
 import matplotlib.pyplot as plt
+from matplotlib.widgets import Slider
 
-from instamatic.formats import read_image
+from instamatic.formats import FrameStack
 
 
 def main():
     import argparse
     description = """
 Simple image viewer to open any image collected collected using instamatic. Supported formats include `TIFF`, `MRC`, [`HDF5`](http://www.h5py.org/), and [`SMV`](https://strucbio.biologie.uni-konstanz.de/ccp4wiki/index.php/SMV_file_format).
+
+A directory, glob pattern, or multi-frame file (MRC stack, multi-page TIFF, HDF5 container) can also be given, use the slider to scrub through the frames. Frames are read on demand.
 """
 
     parser = argparse.ArgumentParser(
@@ -17,32 +20,50 @@ Simple image viewer to open any image collected collected using instamatic. Supp
 
     parser.add_argument('args',
                         type=str, nargs=1, metavar='IMG',
-                        help='Image to display (TIFF, HDF5, MRC, SMV).')
+                        help='Image, directory or multi-frame file to display (TIFF, HDF5, MRC, SMV).')
 
     options = parser.parse_args()
     args = options.args
 
     fn = args[0]
 
-    img, h = read_image(fn)
+    stack = FrameStack(fn)
+    img = stack[0]
+    h = stack.header(0)
 
     print(f"""Loading data: {fn}
+      frames: {len(stack)}
         size: {img.nbytes / 1024} kB
        shape: {img.shape}
        range: {img.min()}-{img.max()}
        dtype: {img.dtype}
 """)
 
-    max_len = max(len(s) for s in h.keys())
+    max_len = max((len(s) for s in h.keys()), default=0)
 
     fmt = f'{{:{max_len}s}} = {{}}'
     for key in sorted(h.keys()):
         print(fmt.format(key, h[key]))
 
-    plt.imshow(img, cmap='gray')
-    plt.title(fn)
+    fig, ax = plt.subplots()
+    im = ax.imshow(img, cmap='gray')
+    ax.set_title(fn)
+
+    if len(stack) > 1:
+        fig.subplots_adjust(bottom=0.15)
+        slider_ax = fig.add_axes([0.2, 0.03, 0.6, 0.03])
+        slider = Slider(slider_ax, 'Frame', 0, len(stack) - 1, valinit=0, valstep=1, valfmt='%d')
+
+        def update(val):
+            im.set_data(stack[int(val)])
+            fig.canvas.draw_idle()
+
+        slider.on_changed(update)
+
     plt.show()
 
+    stack.close()
+
 
 if __name__ == '__main__':
     main()
@@ -62,6 +62,7 @@ setup(
             'instamatic.find_crystals = instamatic.processing.find_crystals:main_entry',
             'instamatic.find_crystals_ilastik = instamatic.processing.find_crystals_ilastik:main_entry',
             'instamatic.learn = scripts.learn:main_entry',
+            'instamatic.benchmark = instamatic.benchmark:main_entry',
             'instamatic.temserver = instamatic.server.tem_server:main',
             'instamatic.camserver = instamatic.server.cam_server:main',
             'instamatic.dialsserver = instamatic.server.dials_server:main',
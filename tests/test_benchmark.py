@@ -0,0 +1,23 @@
+import json
+
+from instamatic import benchmark
+
+
+def test_benchmark(tmp_path):
+    inputs = benchmark.Inputs(nframes=2)
+    results = benchmark.run(groups=['formats', 'serializer'], repeat=1, inputs=inputs, verbose=False)
+
+    assert results['meta']['shape'] == inputs.diff[0].shape
+    assert not [name for name, result in results['results'].items() if 'error' in result]
+    for name in ('formats.write_tiff', 'formats.read_h5container', 'serializer.json.loads_batch'):
+        assert results['results'][name]['median'] > 0
+
+    out = tmp_path / 'benchmark.json'
+    with open(out, 'w') as f:
+        json.dump(results, f, default=float)
+    with open(out) as f:
+        baseline = json.load(f)
+
+    rows = benchmark.compare(baseline, results)
+    assert len(rows) == len(results['results'])
+    assert all(ratio == 1.0 for name, old, new, ratio in rows)
@@ -22,3 +22,51 @@ def test_functions(ctrl):
     dims = ctrl.cam.getImageDimensions()
     assert isinstance(dims, tuple)
     assert len(dims) == 2
+
+
+def test_synthetic_camera(ctrl):
+    import numpy as np
+    from instamatic.camera.camera_synthetic import CameraSynthetic
+
+    cam = CameraSynthetic(name='test', tem=ctrl.tem)
+
+    mode = ctrl.mode.get()
+    magnification = ctrl.magnification.value
+    angle = ctrl.stage.a
+
+    ctrl.mode.set('diff')
+    ctrl.stage.a = 0.0
+    img = cam.getImage(exposure=0.1)
+    assert img.shape == tuple(cam.getCameraDimensions())
+
+    # direct beam moves with the diffraction shift
+    x, y = ctrl.diffshift.get()
+    ctrl.diffshift.set(x + 5000, y - 5000)
+    row, col = cam.beam_center()
+    assert row == img.shape[0] / 2 + 10
+    assert col == img.shape[1] / 2 - 10
+
+    # spots rotate with the stage
+    ctrl.stage.a = 5.0
+    img2 = cam.getImage(exposure=0.1)
+    assert not np.array_equal(img > 100, img2 > 100)
+
+    # crystals are dark at their known positions
+    ctrl.mode.set('mag1')
+    ctrl.magnification.value = 2500
+    img = cam.getImage(exposure=0.1)
+    crystals = cam.crystals_in_view()
+    assert len(crystals) > 0
+    for row, col in crystals[:, :2].astype(int):
+        if 0 <= row < img.shape[0] and 0 <= col < img.shape[1]:
+            assert img[row, col] < 0.6 * np.median(img)
+
+    # same seed, state, and frame number give the same image
+    other = CameraSynthetic(name='test', tem=ctrl.tem)
+    other._frame_index = cam._frame_index - 1
+    assert np.array_equal(other.getImage(exposure=0.1), img)
+
+    ctrl.diffshift.set(x, y)
+    ctrl.mode.set(mode)
+    ctrl.magnification.value = magnification
+    ctrl.stage.a = angle
@@ -227,6 +227,148 @@ def test_align_to(ctrl):
     assert pos != ctrl.stage.xy
 
 
+def test_batch(ctrl):
+    mode, spotsize = ctrl.batch([('getFunctionMode', ()), ('getSpotSize', ())])
+    assert mode == ctrl.mode.get()
+    assert spotsize == ctrl.spotsize
+
+    ctrl.mode.set('mag1')
+    dct = ctrl.to_dict()
+    assert 'DiffFocus' not in dct
+    assert dct['StagePosition'] == ctrl.stage.get()
+    assert dct['GunShift'].x == ctrl.gunshift.x
+
+    ctrl.gunshift.set(1, 2)
+    ctrl.spotsize = 5
+    ctrl.from_dict(dct)
+    assert ctrl.gunshift.get() == dct['GunShift']
+    assert ctrl.spotsize == dct['SpotSize']
+
+    dct = ctrl.to_dict('SpotSize', 'Brightness')
+    assert tuple(dct.keys()) == ('SpotSize', 'Brightness')
+
+
+def test_snapshot(ctrl):
+    import time
+
+    ctrl.mode.set('mag1')
+    ctrl.tem._set_call_latency(0.05)
+
+    try:
+        t0 = time.perf_counter()
+        dct = ctrl.snapshot.get(refresh=True)
+        t1 = time.perf_counter()
+        assert t1 - t0 < 0.5  # 12 getters read out concurrently
+        assert 'DiffFocus' not in dct
+
+        # only the stage is read out again
+        t0 = time.perf_counter()
+        dct = ctrl.snapshot.get()
+        t1 = time.perf_counter()
+        assert t1 - t0 < 0.2
+        assert dct['StagePosition'] == ctrl.stage.get()
+
+        # setters invalidate the cached values
+        ctrl.beamshift.set(123, 456)
+        ctrl.spotsize = 4
+        dct = ctrl.snapshot.get('BeamShift', 'SpotSize')
+        assert dct['BeamShift'] == (123, 456)
+        assert dct['SpotSize'] == 4
+    finally:
+        ctrl.tem._set_call_latency(0)
+
+
+def test_snapshot_sequential():
+    import threading
+    from instamatic.TEMController.snapshot import StateSnapshot
+
+    class COMMicroscope:
+        """Microscope bound to the thread that created it."""
+
+        def __init__(self):
+            self.thread = threading.get_ident()
+
+        def getSpotSize(self):
+            assert threading.get_ident() == self.thread
+            return 3
+
+        def getBrightness(self):
+            assert threading.get_ident() == self.thread
+            return 12345
+
+    snapshot = StateSnapshot(COMMicroscope())
+    assert snapshot.get('SpotSize', 'Brightness') == {'SpotSize': 3, 'Brightness': 12345}
+
+
+def test_acquire_at_items_pipeline(ctrl):
+    coords = [(0, 0), (20_000, 10_000), (-10_000, 5_000)]
+
+    def acquire(ctrl):
+        return ctrl.stage.xy
+
+    def process(i, item, result):
+        (x, y), = result
+        return i, x - item[0], y - item[1]
+
+    def pre_acquire(ctrl):
+        assert ctrl.stage.xy != coords[0]  # runs before the first move
+
+    ctrl.stage.set(x=5_000, y=5_000)
+    results = ctrl.acquire_at_items(coords, acquire=acquire, process=process, pre_acquire=pre_acquire,
+                                    pipeline=True, settle_delay=0)
+
+    assert [r.index for r in results] == [0, 1, 2]
+    assert [r.item for r in results] == coords
+    assert all(r.error is None for r in results)
+    assert [r.processed for r in results] == [(0, 0, 0), (1, 0, 0), (2, 0, 0)]
+
+
+def test_acquire_at_items_route(ctrl):
+    coords = [(0, 0), (40_000, 0), (10_000, 0), (30_000, 0), (20_000, 0)]
+
+    def acquire(ctrl):
+        return ctrl.stage.xy
+
+    results = ctrl.acquire_at_items(coords, acquire=acquire, route='nearest', backlash=False,
+                                    pipeline=True, settle_delay=0)
+
+    # items are visited in the planned order, and the stage reaches each of them
+    assert [r.item for r in results] == sorted(coords)
+    assert [r.result[0] for r in results] == sorted(coords)
+
+
+def test_stage_set_async(ctrl):
+    stage_dict = ctrl.tem._stage_dict
+    saved = {key: dict(d) for key, d in stage_dict.items()}
+    try:
+        for key in ('x', 'y'):
+            stage_dict[key].update(speed=500_000.0, overshoot=100.0, settle_time=0.02)
+
+        x0, y0 = ctrl.stage.xy
+        progress = []
+        finished = []
+
+        move = ctrl.stage.set_async(x=x0 + 50_000, y=y0 - 50_000)
+        move.add_progress_callback(lambda fraction, position: progress.append(fraction))
+        move.add_done_callback(finished.append)
+
+        assert not move.done()
+        assert move.wait(timeout=5)
+        assert finished == [move]
+
+        # the position has converged, most of the 100 nm overshoot has decayed
+        x, y, z, a, b = move.result()
+        assert x == pytest.approx(x0 + 50_000, abs=10)
+        assert y == pytest.approx(y0 - 50_000, abs=10)
+        assert move.duration >= 0.1
+
+        assert progress[-1] == 1.0
+        assert progress == sorted(progress)
+    finally:
+        for key, d in saved.items():
+            stage_dict[key].update(d)
+
+
 if __name__ == '__main__':
     test_ctrl()
 
@@ -2,6 +2,9 @@ import tempfile
 import threading
 from unittest.mock import MagicMock
 
+import numpy as np
+import pytest
+
 
 def test_cred(ctrl):
     """This one is difficult to test with threads and events."""
@@ -78,13 +81,18 @@ def test_red(ctrl):
         flatfield=None,
     )
 
-    for x in range(2):
+    for pipeline in (False, True):
         red_exp.start_collection(
             exposure_time=exposure_time,
             tilt_range=tilt_range,
             stepsize=stepsize,
+            pipeline=pipeline,
         )
 
+    assert [j for j, img, h in red_exp.buffer] == list(range(1, 11))
+    angles = [h['StagePosition'].a for j, img, h in red_exp.buffer]
+    assert angles == pytest.approx(np.arange(angles[0], angles[0] + 10, 1.0), abs=0.1)
+
     red_exp.finalize()
 
     tempdrc.cleanup()
@@ -0,0 +1,22 @@
+from instamatic.calibrate.optimize_focus import FocusOptimizer
+from instamatic.camera.camera_synthetic import CameraSynthetic
+
+
+def test_optimize_diffraction_focus(ctrl):
+    cam = CameraSynthetic(name='test', tem=ctrl.tem)
+    cam._focus_offset = 150
+    ctrl.cam = cam
+
+    ctrl.mode.set('diff')
+    x, y = ctrl.diffshift.get()
+    ctrl.diffshift.set(x + 20000, y)  # move the beam away from the beamstop
+
+    start = ctrl.difffocus.value
+    cam.getImage(exposure=0.01)
+    assert cam.best_focus == start + 150
+
+    result = FocusOptimizer(ctrl, step=50, tolerance=5, exposure=0.01).optimize()
+
+    assert result.n_exposures <= 8
+    assert abs(result.focus - cam.best_focus) < 25
+    assert ctrl.difffocus.value == result.focus
@@ -38,9 +38,29 @@ def test_cbf(data, header):
 
     assert os.path.exists(out)
 
-    # Reader Not implemented:
-    with pytest.raises(NotImplementedError):
-        img, h = formats.read_image(out)
+    img, h = formats.read_image(out)
+
+    assert np.array_equal(img, data)
+    assert img.dtype == data.dtype
+    assert isinstance(h, dict)
+
+
+def test_byte_offset():
+    from instamatic.formats.xdscbf import compByteOffset
+    from instamatic.formats.xdscbf import decByteOffset
+
+    test = np.array([0, 1, 2, 127, 0, 1, 2, 128, 0, 1, 2, 32767, 0, 1, 2, 32768, 0, 1, 2, 2147483647, 0, 1, 2,
+                     2147483648, 0, 1, 2, 128, 129, 130, 32767, 32768, 128, 129, 130, 32768, 2147483647, 2147483648,
+                     -128, -127, -32768, -2147483648, -2147483649, 0])
+    stream = compByteOffset(test)
+    assert np.array_equal(decByteOffset(stream, size=test.size), test)
+
+    # 0x80 bytes inside the exceptions must not be taken for markers
+    arr = np.random.RandomState(0).randint(-2**40, 2**40, size=10000) // np.array([1, 2**10, 2**20, 2**30, 2**40]).repeat(2000)
+    assert np.array_equal(decByteOffset(compByteOffset(arr)), arr)
+
+    with pytest.raises(ValueError):
+        decByteOffset(stream, size=test.size + 1)
 
 
 def test_mrc(data, header):
@@ -82,3 +102,89 @@ def test_hdf5(data, header):
 
     assert np.allclose(img, data)
     assert header == h
+
+
+def test_h5container(tmp_path):
+    from instamatic.formats import H5ContainerReader
+    from instamatic.formats import H5ContainerWriter
+    from instamatic.formats import is_h5container
+
+    out = tmp_path / 'out.h5'
+
+    with H5ContainerWriter(out) as writer:
+        for i in range(3):
+            img = np.full((32, 32), i, dtype=np.uint16)
+            h = {'exp_image_index': i,
+                 'ImageExposureTime': 0.5,
+                 'ImageComment': f'image {i}',
+                 'exp_scan_offset': (i, -i),
+                 'exp_info': {'nested': [1, 2]}}
+            if i == 2:
+                h['exp_extra'] = 'only here'
+                h['ImageExposureTime'] = 'invalid'
+            coords = [(j, j) for j in range(i)]
+            writer.append('images', img, header=h, stage_position=(i, i * 10), crystal_coords=coords)
+
+        with pytest.raises(ValueError):
+            writer.append('images', np.zeros((16, 16)))
+
+    # append to existing container
+    with H5ContainerWriter(out) as writer:
+        writer.append('data', np.ones((8, 8)), header={'exp_image_index': 1})
+
+    assert is_h5container(out)
+
+    with H5ContainerReader(out) as reader:
+        assert set(reader.keys()) == {'images', 'data'}
+
+        images = reader['images']
+        assert len(images) == 3
+        assert images.data.shape == (3, 32, 32)
+
+        img, h = images[2]
+        assert img.dtype == np.uint16
+        assert img[0, 0] == 2
+        assert h['ImageComment'] == 'image 2'
+        assert h['exp_extra'] == 'only here'
+        assert h['ImageExposureTime'] == 'invalid'
+        assert h['exp_info'] == {'nested': [1, 2]}
+        assert tuple(h['exp_scan_offset']) == (2, -2)
+
+        assert images.header(0)['ImageExposureTime'] == 0.5
+        assert list(images.headers['exp_image_index']) == [0, 1, 2]
+        assert images.crystal_coords(0).shape == (0, 2)
+        assert images.crystal_coords(2).tolist() == [[0, 0], [1, 1]]
+        assert images.stage_positions[1, :2].tolist() == [1, 10]
+        assert np.isnan(images.stage_positions[1, 2])
+
+        assert len(reader['data']) == 1
+
+
+def test_framestack(tmp_path):
+    import tifffile
+    from instamatic.formats import FrameStack
+
+    stack = (np.random.random((4, 16, 12)) * 1000).astype(np.uint16)
+
+    for i, img in enumerate(stack):
+        formats.write_adsc(tmp_path / f'{i:05d}.img', img, header={'FRAME': i})
+        formats.write_mrc(tmp_path / 'stack.mrc', img.astype(np.float32), index=i)
+
+    with tifffile.TiffWriter(tmp_path / 'stack.tiff') as f:
+        for i, img in enumerate(stack):
+            f.save(img, contiguous=False, software='instamatic', description=f'frame: {i}')
+
+    for source in (tmp_path / '*.img', tmp_path / 'stack.mrc', tmp_path / 'stack.tiff'):
+        with FrameStack(source) as frames:
+            assert frames.shape == stack.shape
+            assert isinstance(frames[1], np.memmap)
+            np.testing.assert_array_equal(frames[2], stack[2])
+            np.testing.assert_array_equal(np.asarray(frames[1::2]), stack[1::2])
+
+    frames = FrameStack(tmp_path / 'stack.tiff')[::-1]
+    assert frames.header(0) == {'frame': 3}
+    frames.close()
+
+    frames = FrameStack(tmp_path / '*.img')
+    assert frames.header(3)['FRAME'] == '3'
+    assert len(frames.fnames) == 4
@@ -0,0 +1,29 @@
+import numpy as np
+from scipy import ndimage
+from skimage.registration import phase_cross_correlation
+
+from instamatic.imreg import ImageRegistration
+
+
+def test_image_registration():
+    np.random.seed(0)
+    ref = ndimage.gaussian_filter(np.random.random((128, 128)), 2)
+    shifts = [(3.4, -7.1), (-12.6, 5.3), (0.0, 0.0)]
+    images = [np.fft.ifft2(ndimage.fourier_shift(np.fft.fft2(ref), shift)).real for shift in shifts]
+
+    reg = ImageRegistration(ref, upsample_factor=10)
+    batch = reg.register_batch(images)
+
+    for i, img in enumerate(images):
+        expected = phase_cross_correlation(ref, img, upsample_factor=10)
+        result = reg.register(img)
+
+        np.testing.assert_allclose(result.shift, expected[0])
+        np.testing.assert_allclose(result.error, expected[1], atol=1e-6)
+        np.testing.assert_allclose(result.phasediff, expected[2], atol=1e-6)
+        np.testing.assert_allclose(batch.shift[i], result.shift)
+
+        assert 0 < result.quality <= 1
+
+    np.testing.assert_allclose(-batch.shift, shifts, atol=0.1)
+    assert batch.quality[2] > batch.quality[0]
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def predict_reference(image, weights):
+    """Per-window loop implementation of `neural_network.predict`, used
+    before the convolutions were batched."""
+    def conv_layer(in_layer, weight, offset):
+        first_layer = np.ones([(in_layer.shape[0] - 2) * (in_layer.shape[1] - 2), in_layer.shape[2], 3, 3])
+        q = 0
+        for n in range(in_layer.shape[0] - 2):
+            for p in range(in_layer.shape[1] - 2):
+                first_layer[q] = np.transpose(in_layer[n:n + 3, p:p + 3], [2, 0, 1])
+                q += 1
+        convoluted = np.tensordot(first_layer, weight, axes=(((2, 3, 1), (0, 1, 2))))
+        convoluted_reshaped = convoluted.reshape([in_layer.shape[0] - 2, in_layer.shape[1] - 2, 64])
+        convoluted_reshaped += offset
+        return convoluted_reshaped
+
+    def max_pooling(convoluted):
+        pooled = np.ones((convoluted.shape[0] // 2, convoluted.shape[1] // 2, convoluted.shape[2]))
+        for n in range(convoluted.shape[0] // 2):
+            for p in range(convoluted.shape[1] // 2):
+                pooled[n, p] = np.amax(convoluted[n * 2:n * 2 + 2, p * 2:p * 2 + 2], axis=(0, 1))
+        return pooled
+
+    def relu(x):
+        return np.maximum(x, 0)
+
+    layer = image
+    for i in range(0, 8, 2):
+        layer = max_pooling(relu(conv_layer(layer, weights[i], weights[i + 1])))
+    flattened = relu(conv_layer(layer, weights[8], weights[9])).reshape((1, 1600))
+    dense1 = relu(np.tensordot(flattened, weights[10], axes=(1, 0)) + weights[11])
+    dense2 = relu(np.tensordot(dense1, weights[12], axes=(1, 0)) + weights[13])
+    dense3 = np.tensordot(dense2, weights[14], axes=(1, 0)) + weights[15]
+    return 1 / (1 + np.exp(-dense3[0][0]))
+
+
+def test_predict_batch():
+    from instamatic.neural_network import neural_network as nn
+
+    rng = np.random.RandomState(0)
+
+    # convolution against a direct 3x3 correlation
+    layer = rng.random_sample((8, 7, 4)).astype(np.float32)
+    weight = rng.random_sample((3, 3, 4, 5)).astype(np.float32)
+    offset = rng.random_sample(5).astype(np.float32)
+    expected = np.empty((6, 5, 5))
+    for i in range(6):
+        for j in range(5):
+            expected[i, j] = np.tensordot(layer[i:i + 3, j:j + 3], weight, axes=3) + offset
+    np.testing.assert_allclose(nn.conv_layer(layer, weight, offset), expected, rtol=1e-5)
+
+    pooled = nn.max_pooling(expected)
+    assert pooled.shape == (3, 2, 5)
+    assert pooled[1, 1, 2] == expected[2:4, 2:4, 2].max()
+
+    images = rng.random_sample((3, 150, 150, 1)) * np.array([0.02, 0.05, 0.1])[:, None, None, None]
+    predictions = nn.predict_batch(images, batch_size=2)
+    assert predictions.shape == (3,)
+    expected = [predict_reference(img, nn.weights) for img in images]
+    np.testing.assert_allclose(predictions, expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(nn.predict(images[0]), predictions[0], rtol=1e-5)
@@ -0,0 +1,184 @@
+import time
+
+import numpy as np
+import pytest
+
+
+def test_img_conversion_stream(tmp_path):
+    from instamatic.formats import read_adsc
+    from instamatic.formats import read_tiff
+    from instamatic.processing.ImgConversionStream import ImgConversionStream
+
+    img_conv = ImgConversionStream(tiff_path=tmp_path / 'tiff',
+                                   smv_path=tmp_path / 'SMV',
+                                   mrc_path=tmp_path / 'RED',
+                                   flatfield=None,
+                                   workers=2,
+                                   max_pending=2)
+
+    shape = (64, 64)
+    for i in (1, 2, 3, 5):
+        img = np.random.RandomState(i).randint(100, size=shape)
+        img[30:34, 40:44] = 10000
+        img_conv.put(i, img, {'ImageExposureTime': 0.1, 'ImageGetTime': 0})
+
+    img_conv.finalize(osc_angle=0.5,
+                      start_angle=-10,
+                      end_angle=-7.5,
+                      rotation_axis=-2.2,
+                      acquisition_time=0.1,
+                      pixelsize=0.01,
+                      physical_pixelsize=0.055,
+                      wavelength=0.0251)
+
+    assert not img_conv.data
+    assert img_conv.missing_range == {4}
+    np.testing.assert_allclose(img_conv.mean_beam_center, (31.5, 41.5), atol=1.0)
+
+    img, h = read_tiff(tmp_path / 'tiff' / '00005.tiff')
+    assert img.shape == shape
+
+    img, h = read_adsc(tmp_path / 'SMV' / 'data' / '00005.img')
+    assert img.shape == shape
+    assert h['OSC_START'] == '-8.0000'
+    assert float(h['BEAM_CENTER_X']) == img_conv.mean_beam_center[1]
+
+    img_conv.to_dials(tmp_path / 'SMV')
+    img_conv.write_xds_inp(tmp_path / 'SMV')
+    assert (tmp_path / 'SMV' / 'data' / '00004.img').exists()
+    assert (tmp_path / 'SMV' / 'XDS.INP').exists()
+
+
+def test_img_conversion_stream_error(tmp_path):
+    from instamatic.processing.ImgConversionStream import ImgConversionStream
+
+    img_conv = ImgConversionStream(tiff_path=tmp_path / 'tiff', flatfield=None, workers=1)
+
+    def write_tiff(path, i):
+        raise OSError('disk full')
+
+    img_conv.write_tiff = write_tiff
+    img = np.zeros((64, 64))
+
+    # the error is raised during collection, not only at the end
+    with pytest.raises(OSError, match='disk full'):
+        for i in range(1, 100):
+            img_conv.put(i, img, {})
+            time.sleep(0.01)
+
+    with pytest.raises(OSError, match='disk full'):
+        img_conv.close()
+    img_conv.close()
+
+
+def test_find_beam_centers():
+    from instamatic.tools import find_beam_center
+    from instamatic.tools import find_beam_centers
+
+    rng = np.random.RandomState(0)
+    stack = rng.randint(100, size=(5, 128, 128)).astype(float)
+    for k, (x, y) in enumerate([(30, 40), (64, 64), (90, 20), (50, 100), (70, 75)]):
+        stack[k, x - 2:x + 2, y - 2:y + 2] += 10000
+
+    centers = find_beam_centers(stack, sigma=10)
+    expected = [find_beam_center(img, sigma=10) for img in stack]
+    np.testing.assert_allclose(centers, expected, atol=1 / 100)
+
+
+def test_img_conversion_processes(tmp_path):
+    from instamatic.formats import read_tiff
+    from instamatic.processing.ImgConversionTPX import ImgConversionTPX
+
+    shape = (64, 64)
+    buffer = []
+    for i in range(1, 6):
+        img = np.random.RandomState(i).randint(100, size=shape)
+        img[30:34, 40:44] = 10000
+        buffer.append((i, img, {'ImageExposureTime': 0.1, 'ImageGetTime': 0}))
+
+    img_conv = ImgConversionTPX(buffer=buffer,
+                                osc_angle=0.5,
+                                start_angle=-10,
+                                end_angle=-7.5,
+                                rotation_axis=-2.2,
+                                acquisition_time=0.1,
+                                flatfield=None,
+                                pixelsize=0.01,
+                                physical_pixelsize=0.055,
+                                wavelength=0.0251,
+                                processes=2)
+
+    try:
+        np.testing.assert_allclose(img_conv.mean_beam_center, (31.5, 41.5), atol=1.0)
+        assert img_conv.headers[3]['beam_center'] == tuple(img_conv._beam_centers[2])
+
+        img_conv.threadpoolwriter(tiff_path=tmp_path / 'tiff', smv_path=tmp_path / 'SMV')
+    finally:
+        img_conv.close()
+
+    img, h = read_tiff(tmp_path / 'tiff' / '00005.tiff')
+    assert img.shape == shape
+    assert (tmp_path / 'SMV' / 'data' / '00005.img').exists()
+
+
+def test_flatfield_corrector():
+    from instamatic.processing.flatfield import apply_flatfield_correction
+    from instamatic.processing.flatfield import FlatfieldCorrector
+
+    rng = np.random.RandomState(0)
+    flatfield = rng.uniform(0.5, 1.5, size=(32, 32))
+    darkfield = rng.uniform(0, 0.1, size=(32, 32))
+    deadpixels = np.array([[0, 0], [10, 12], [31, 5]])
+
+    stack = rng.randint(100, size=(3, 32, 32)).astype(float)
+    stack[:, deadpixels[:, 0], deadpixels[:, 1]] = 0
+
+    corrector = FlatfieldCorrector(flatfield, darkfield=darkfield, deadpixels=deadpixels)
+    corrected = corrector(stack)
+
+    assert corrected is not stack
+    assert np.all(corrected[:, 10, 12] > 0)
+    np.testing.assert_allclose(corrected[:, 10, 12] / corrector.gain[10, 12] + darkfield[10, 12],
+                               stack[:, 9:12, 11:14].sum(axis=(1, 2)) / 9)
+    np.testing.assert_allclose(corrected[:, 0, 0] / corrector.gain[0, 0] + darkfield[0, 0],
+                               stack[:, 0:2, 0:2].sum(axis=(1, 2)) / 4)
+
+    mask = np.ones((32, 32), dtype=bool)
+    mask[deadpixels[:, 0], deadpixels[:, 1]] = False
+    expected = apply_flatfield_correction(stack[1], flatfield, darkfield=darkfield)
+    np.testing.assert_allclose(corrected[1][mask], expected[mask])
+
+    # in place on a single frame
+    frame = stack[2].copy()
+    ret = corrector.correct(frame, out=frame)
+    assert ret is frame
+    np.testing.assert_allclose(frame, corrected[2])
+
+
+def test_crystal_finder():
+    from instamatic.processing.find_crystals import CrystalFinder
+    from instamatic.processing.find_crystals import find_crystals_timepix
+
+    magnification = 2500
+    yy, xx = np.mgrid[:256, :256]
+
+    stack = []
+    for i in range(3):
+        rng = np.random.RandomState(i)
+        img = 200 + rng.normal(0, 5, size=(256, 256))
+        for cx, cy in rng.randint(40, 216, size=(3, 2)):
+            img[(xx - cx)**2 + (yy - cy)**2 < 8**2] = 20
+        stack.append(img)
+    stack = np.array(stack)
+
+    with CrystalFinder(magnification, timepix=True, processes=2) as finder:
+        results = dict(finder.find_all(stack))
+        single = finder.submit(stack[0]).result()
+
+    assert sorted(results) == [0, 1, 2]
+    for i, img in enumerate(stack):
+        expected = find_crystals_timepix(img, magnification)
+        assert len(results[i]) == len(expected)
+        assert all(crystal.isolated for crystal in expected)
+        np.testing.assert_allclose([crystal[:2] for crystal in results[i]], [crystal[:2] for crystal in expected])
+    assert single == results[0]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+
+def test_record_replay(ctrl, tmp_path, monkeypatch):
+    from instamatic import config
+    from instamatic.camera.camera import get_cam
+    from instamatic.TEMController.microscope import get_tem
+    from instamatic.TEMController.recording import read_recording
+    from instamatic.TEMController.recording import record
+    from instamatic.TEMController.recording import ReplayError
+    from instamatic.TEMController.TEMController import TEMController
+
+    fn = tmp_path / 'session.rec'
+
+    rec = record(ctrl, fn)
+    rec.stage.set(x=1000, y=-2000)
+    rec.beamshift.set(100, 200)
+    pos = rec.stage.get()
+    beamshift = rec.beamshift.get()
+    img, h = rec.get_image(exposure=0.01)
+    with pytest.raises(Exception):
+        rec.tem.setFunctionMode('rawr')
+    rec.tem.close_log()
+
+    recording = read_recording(fn)
+    assert set(recording.devices) == {'tem', 'cam'}
+    assert recording.devices['cam'].attrs['dimensions'] == ctrl.cam.dimensions
+
+    monkeypatch.setattr(config.settings, 'replay_file', str(fn))
+    monkeypatch.setattr(config.settings, 'replay_time_scale', 0)
+
+    tem = get_tem('replay')(name=config.microscope.name)
+    cam = get_cam('replay')(name=config.camera.name)
+    replay = TEMController(tem=tem, cam=cam)
+
+    replay.stage.set(x=1000, y=-2000)
+    replay.beamshift.set(100, 200)
+    assert replay.stage.get() == pos
+    assert replay.beamshift.get() == beamshift
+    img2, h2 = replay.get_image(exposure=0.01)
+    np.testing.assert_array_equal(img, img2)
+    with pytest.raises(Exception):
+        replay.tem.setFunctionMode('rawr')
+
+    with pytest.raises(ReplayError):
+        replay.tem.setScreenPosition('up')  # not recorded
+    with pytest.raises(AttributeError):
+        replay.tem.noSuchMethod()
@@ -0,0 +1,371 @@
+import queue
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from instamatic.server.framing import FramingError
+from instamatic.server.framing import HEADER
+from instamatic.server.framing import MAGIC
+from instamatic.server.framing import recv_message
+from instamatic.server.framing import send_message
+from instamatic.server.serializer import pickle_dumper
+from instamatic.server.serializer import pickle_loader
+
+
+def start_server(module, server_cls, q=None, target=None) -> int:
+    """Start the server thread and accept connections on a free port, returns
+    the port number. Connections are handled with `target` (defaults to
+    `q`)."""
+    if q is None:
+        q = queue.Queue(maxsize=100)
+    if target is None:
+        target = q
+
+    server = server_cls(q=q)
+    server.daemon = True
+    server.start()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    s.listen(5)
+
+    def accept():
+        while True:
+            conn, addr = s.accept()
+            threading.Thread(target=module.handle, args=(conn, target), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    return s.getsockname()[1]
+
+
+def test_framing():
+    a, b = socket.socketpair()
+
+    with a, b:
+        dct = {'func_name': 'getStagePosition', 'args': (), 'kwargs': {}}
+        send_message(a, dct, pickle_dumper)
+        obj, arr = recv_message(b, pickle_loader)
+        assert obj == dct
+        assert arr is None
+
+        img = np.arange(64 * 64, dtype=np.uint16).reshape(64, 64)
+        send_message(a, (200, None), pickle_dumper, array=img)
+        obj, arr = recv_message(b, pickle_loader)
+        assert obj == (200, None)
+        assert arr.dtype == img.dtype
+        assert np.array_equal(arr, img)
+
+        with pytest.raises(FramingError):
+            send_message(a, (200, None), pickle_dumper, array=np.array([None, 1]))
+
+        a.close()
+        obj, arr = recv_message(b, pickle_loader)
+        assert obj is None
+
+
+def test_framing_closed_mid_frame():
+    meta = pickle_dumper((200, None))
+    info = b'{"dtype": "<u2", "shape": [4, 4]}'
+
+    # closed before the array payload arrives
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(HEADER.pack(MAGIC, len(meta), len(info), 32) + meta + info)
+        a.close()
+        with pytest.raises(FramingError):
+            recv_message(b, pickle_loader)
+
+    # closed right after the header
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(HEADER.pack(MAGIC, len(meta), 0, 0))
+        a.close()
+        with pytest.raises(FramingError):
+            recv_message(b, pickle_loader)
+
+
+def test_tem_server(monkeypatch):
+    from instamatic.server import tem_server
+    from instamatic.TEMController import microscope_client
+
+    q = queue.PriorityQueue(maxsize=100)
+    dispatcher = tem_server.Dispatcher(q)
+    port = start_server(tem_server, tem_server.TemServer, q=q, target=dispatcher)
+    monkeypatch.setattr(microscope_client, 'PORT', port)
+
+    tem = microscope_client.MicroscopeClient(name='test')
+
+    for i in range(100):
+        assert len(tem.getStagePosition()) == 5
+
+    tem.setSpotSize(3)
+    assert tem.getSpotSize() == 3
+
+    with pytest.raises(Exception):
+        tem.setFunctionMode('rawr')
+
+    calls = [('setSpotSize', (2,)),
+             ('getSpotSize', ()),
+             ('setFunctionMode', ('rawr',)),
+             ('getStagePosition', (), {})]
+    spotsize_set, spotsize, error, pos = tem.batch(calls, return_exceptions=True)
+    assert spotsize == 2
+    assert isinstance(error, Exception)
+    assert len(pos) == 5
+
+    with pytest.raises(Exception):
+        tem.batch(calls)
+
+    tem.setSpotSize(3)
+
+    # garbage on the socket closes the connection on the server side
+    with socket.create_connection(('localhost', port)) as s:
+        s.sendall(b'x' * HEADER.size)
+        assert s.recv(1) == b''
+
+    assert tem.getSpotSize() == 3
+
+
+def test_dispatcher():
+    from instamatic.server.tem_server import Dispatcher
+
+    q = queue.PriorityQueue()
+    dispatcher = Dispatcher(q, ttl=60)
+    evaluated = []
+
+    def serve():
+        while True:
+            priority, n, request = q.get()
+            evaluated.append(request.cmd['func_name'])
+            request.complete((200, len(evaluated)))
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    getter = {'func_name': 'getSpotSize', 'args': (), 'kwargs': {}}
+    setter = {'func_name': 'setSpotSize', 'args': (1,), 'kwargs': {}}
+
+    assert dispatcher.submit(getter) == (200, 1)
+    assert dispatcher.submit(getter) == (200, 1)  # cached
+    assert dispatcher.submit(setter) == (200, 2)
+    assert dispatcher.submit(getter) == (200, 3)  # cache invalidated
+    assert evaluated == ['getSpotSize', 'setSpotSize', 'getSpotSize']
+
+    live = {'func_name': 'getStagePosition', 'args': (), 'kwargs': {}}
+    assert dispatcher.submit(live) == (200, 4)
+    assert dispatcher.submit(live) == (200, 5)  # live state is not cached
+    assert dispatcher.submit(getter) == (200, 3)  # does not invalidate the cache
+
+
+def test_dispatcher_order():
+    from instamatic.server.tem_server import Dispatcher
+
+    q = queue.PriorityQueue()
+    dispatcher = Dispatcher(q, ttl=60)
+
+    getter = {'func_name': 'getSpotSize', 'args': (), 'kwargs': {}}
+    setter = {'func_name': 'setSpotSize', 'args': (1,), 'kwargs': {}}
+
+    threads = [threading.Thread(target=dispatcher.submit, args=(cmd,), daemon=True)
+               for cmd in (setter, getter)]
+    for thread in threads:
+        thread.start()
+        while q.qsize() < threads.index(thread) + 1:
+            time.sleep(0.001)
+
+    # getters do not jump ahead of setters submitted earlier
+    evaluated = []
+    while not q.empty():
+        priority, n, request = q.get()
+        evaluated.append(request.cmd['func_name'])
+        request.complete((200, None))
+
+    assert evaluated == ['setSpotSize', 'getSpotSize']
+
+
+def test_cam_server(monkeypatch):
+    from instamatic import config
+    from instamatic.server import cam_server
+    from instamatic.camera import camera_client
+
+    monkeypatch.setattr(config.settings, 'cam_use_shared_memory', False)
+
+    port = start_server(cam_server, cam_server.CamServer)
+    monkeypatch.setattr(camera_client, 'PORT', port)
+
+    cam = camera_client.CamClient(name='test', interface='simulate')
+
+    # full-size image is much larger than the socket buffer
+    xres, yres = cam.getImageDimensions()
+    for i in range(3):
+        img = cam.getImage(exposure=0.001, binsize=1)
+        assert img.shape == (xres, yres)
+
+    for i in range(100):
+        assert cam.getImageDimensions() == (xres, yres)
+
+
+def test_ringbuffer():
+    from instamatic.server.ringbuffer import FrameOverwrittenError
+    from instamatic.server.ringbuffer import RingBuffer
+
+    ring = RingBuffer.create(n_slots=4, slot_size=16 * 16 * 2)
+    reader = RingBuffer.attach(ring.name)
+
+    try:
+        assert reader.latest == 0
+        frames = [np.full((16, 16), i, dtype=np.uint16) for i in range(6)]
+        for frame in frames:
+            seq = ring.write(frame)
+
+        assert reader.latest == seq == 6
+
+        arr, seq, timestamp = reader.read()
+        assert seq == 6
+        assert np.array_equal(arr, frames[-1])
+
+        # smaller frames and other dtypes fit in the same slot
+        seq = ring.write(np.arange(10, dtype=np.float32))
+        arr, _, _ = reader.read(seq, copy=False)
+        assert arr.dtype == np.float32
+        assert np.array_equal(arr, np.arange(10))
+
+        # frame 3 lives in the same slot as frame 7
+        with pytest.raises(FrameOverwrittenError):
+            reader.read(3)
+
+        with pytest.raises(ValueError):
+            ring.write(np.zeros((32, 32), dtype=np.uint16))
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_cam_server_shared_memory(monkeypatch):
+    from instamatic.server import cam_server
+    from instamatic.camera import camera_client
+    from instamatic.camera.videostream import VideoStream
+
+    port = start_server(cam_server, cam_server.CamServer)
+    monkeypatch.setattr(camera_client, 'PORT', port)
+
+    cam = camera_client.CamClient(name='test', interface='simulate')
+    assert cam.use_shared_memory
+
+    img = cam.getImage(exposure=0.001, binsize=2)
+    xres, yres = cam.getImageDimensions()
+    assert img.shape == (xres // 2, yres // 2)
+
+    cam.start_streaming(exposure=0.001, binsize=4)
+    seqs = []
+    for i in range(5):
+        frame = cam.get_next_frame(timeout=1.0)
+        assert frame.shape == (xres // 4, yres // 4)
+        seqs.append(cam._stream_seq)
+    assert seqs == sorted(set(seqs))
+
+    # commands are still handled in between streamed frames
+    ring = cam._stream
+    img = cam.getImage(exposure=0.001, binsize=1)
+    assert img.shape == (xres, yres)
+
+    # the larger frame replaced the ring buffer, the stream follows
+    for i in range(ring.n_slots + 2):
+        frame = cam.get_next_frame(timeout=1.0)
+    assert frame.shape == (xres // 4, yres // 4)
+    assert cam._stream is not ring
+    cam.stop_streaming()
+
+    stream = VideoStream(cam)
+    try:
+        frames = stream.continuous_collection(exposure=0.001, n=3)
+        assert len(frames) == 3
+    finally:
+        stream.close()
+
+
+def test_job_queue(tmp_path):
+    import json
+    import time
+    from instamatic.server.job_queue import Executor
+    from instamatic.server.job_queue import JobQueue
+    from instamatic.server.job_queue import ResultCache
+    from instamatic.server.xds_server import handle
+
+    drcs = []
+    for i in range(3):
+        drc = tmp_path / f'data_{i}'
+        drc.mkdir()
+        (drc / 'XDS.INP').write_text(f'JOB= XYCORR {i}')
+        drcs.append(drc)
+
+    runs = []
+    release = threading.Event()
+
+    def run(path, **kwargs):
+        release.wait(5)
+        runs.append(path)
+        return {'msg': f'processed {path}'}
+
+    def inputs(path, **kwargs):
+        return [kwargs, path / 'XDS.INP']
+
+    cache = ResultCache(tmp_path / 'results.json')
+    jobs = JobQueue(Executor(run, inputs=inputs), workers=1, cache=cache)
+
+    # queued before the worker starts, so that the priorities decide the order
+    low = jobs.submit(drcs[0], priority=20)
+    high = jobs.submit(drcs[1], priority=0)
+    duplicate = jobs.submit(drcs[0], priority=20)
+    assert duplicate is low
+    assert jobs.status()['jobs']['queued'] == 2
+
+    jobs.start()
+    release.set()
+    assert low.result(timeout=5) == {'msg': f'processed {drcs[0]}'}
+    assert runs == [drcs[1], drcs[0]]
+
+    # status and results over the socket protocol
+    conn, client = socket.socketpair()
+    thread = threading.Thread(target=handle, args=(conn, jobs), daemon=True)
+    thread.start()
+
+    client.send(json.dumps({'task': 'status', 'id': high.id}).encode())
+    assert json.loads(client.recv(4096).decode())['status'] == 'done'
+
+    client.send(str(drcs[2]).encode())
+    assert client.recv(1024) == b'OK'
+    assert client.recv(1024).decode() == f'processed {drcs[2]}'
+    client.send(b'close')
+    thread.join(5)
+    client.close()
+    jobs.stop()
+
+    # results are answered from the persistent cache, unless the inputs change
+    jobs = JobQueue(Executor(run, inputs=inputs), cache=ResultCache(tmp_path / 'results.json'))
+    job = jobs.submit(drcs[0])
+    assert job.done() and job.cached
+
+    time.sleep(0.01)
+    (drcs[0] / 'XDS.INP').write_text('JOB= ALL')
+    job = jobs.submit(drcs[0])
+    assert not job.done()
+
+    # failed jobs are not cached, and only the recent jobs are kept
+    def fail(path, **kwargs):
+        raise RuntimeError('No cell found')
+
+    with JobQueue(Executor(fail, inputs=inputs), cache=cache, keep=2) as jobs:
+        job = jobs.submit(drcs[1], new=True)
+        with pytest.raises(RuntimeError, match='No cell found'):
+            job.result(timeout=5)
+        assert job.key not in cache
+
+        finished = [jobs.submit(drcs[1]) for i in range(3)]  # cached
+        assert all(job.cached for job in finished)
+        assert jobs.status()['jobs']['done'] == 2
+        with pytest.raises(KeyError):
+            jobs.get(finished[0].id)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from instamatic.stage_route import StageModel
+from instamatic.stage_route import plan_route
+from instamatic.stage_route import route_time
+
+
+def test_serpentine():
+    x, y = np.meshgrid(np.arange(4), np.arange(3))
+    coords = np.stack((x.ravel(), y.ravel()), axis=1) * 10_000
+
+    route = plan_route(coords[::-1], method='serpentine', backlash=False)
+    path = coords[::-1][route.order]
+
+    np.testing.assert_array_equal(path[:5], [[0, 0], [10_000, 0], [20_000, 0], [30_000, 0], [30_000, 10_000]])
+    assert not route.backlash.any()
+
+
+def test_plan_route(ctrl):
+    model = StageModel.from_tem(ctrl.tem, speed_x=100_000.0, speed_y=100_000.0)
+
+    np.random.seed(0)
+    coords = np.random.uniform(-200_000, 200_000, size=(50, 2))
+
+    route = plan_route(coords, model=model, method='tsp')
+    assert sorted(route.order) == list(range(len(coords)))
+    assert route.time < route_time(coords, range(len(coords)), model=model)
+    assert route.time <= plan_route(coords, model=model, method='nearest').time
+
+    # the correction can be skipped when both axes approach from below
+    path = coords[route.order]
+    delta = np.diff(path, axis=0)
+    np.testing.assert_array_equal(route.backlash[1:], np.any(delta < 0, axis=1))
+    assert route.backlash[0]
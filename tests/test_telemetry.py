@@ -0,0 +1,39 @@
+import time
+
+import numpy as np
+
+from instamatic.TEMController.telemetry import read_telemetry
+from instamatic.TEMController.telemetry import RingBuffer
+from instamatic.TEMController.telemetry import TelemetryRecorder
+
+
+def test_ring_buffer():
+    buf = RingBuffer(capacity=3, ncols=1)
+    for i in range(5):
+        buf.append([i])
+    assert len(buf) == 3
+    assert buf.get().ravel().tolist() == [2, 3, 4]
+
+
+def test_telemetry(ctrl, tmp_path):
+    path = tmp_path / 'telemetry.h5'
+    channels = {'StagePosition': 0.02, 'BeamShift': 0.05, 'getHTValue': 0.05}
+
+    with TelemetryRecorder(ctrl.tem, channels=channels, path=path, capacity=1000) as rec:
+        time.sleep(0.3)
+
+    t, values = rec.get('StagePosition')
+    assert values.shape[1] == 5
+    assert 5 < len(t) <= 16
+    assert np.all(np.diff(t) > 0)
+    assert rec.channels['StagePosition'].columns == ['x', 'y', 'z', 'a', 'b']
+
+    # channels that are due at the same time are read out together
+    n_samples = sum(len(rec.get(name)[0]) for name in channels)
+    assert rec.n_batches < n_samples
+
+    assert rec.latest('getHTValue')['value'] == ctrl.tem.getHTValue()
+
+    t_file, values_file, columns = read_telemetry(path, 'BeamShift')
+    assert columns == ['x', 'y']
+    np.testing.assert_array_equal(values_file, rec.get('BeamShift')[1])
@@ -0,0 +1,67 @@
+import os
+
+from instamatic.utils.xds_index import XDSIndex
+
+CORRECT_LP = """\
+ UNIT_CELL_CONSTANTS= {a:10.3f}{b:10.3f}{c:10.3f}  90.000  90.000  90.000 as used by INTEGRATE
+ SPACE GROUP NUMBER   {spgr}
+ UNIT CELL PARAMETERS{a:10.3f}{b:10.3f}{c:10.3f}  90.000  90.000  90.000
+     a        b          ISa
+ 1.000E+00  2.000E-03   {isa:.2f}
+   WILSON LINE (using all data) : A=  4.1 B=   3.2 CORRELATION=  0.95
+   --------------------------------------------------------------------------
+   20.00   0.80
+ SUBSET OF INTENSITY DATA WITH SIGNAL/NOISE >= -3.0 AS FUNCTION OF RESOLUTION
+ RESOLUTION     NUMBER OF REFLECTIONS    COMPLETENESS R-FACTOR  R-FACTOR COMPARED I/SIGMA   R-meas  CC(1/2)  Anomal  SigAno   Nano
+   LIMIT     OBSERVED  UNIQUE  POSSIBLE     OF DATA   observed  expected                                      Corr
+
+     1.60        1000     400       500       80.0%      10.0%     11.0%     1000    8.00     12.0%    99.0*     0    0.000       0
+     0.80        2000     800      1000       {compl:.1f}%      30.0%     31.0%     2000    1.00     35.0%    80.0*     0    0.000       0
+    total        3000    1200      1500       {compl:.1f}%      15.0%     16.0%     3000    4.00     18.0%    {cchalf:.1f}*     0    0.000       0
+"""
+
+
+def write_correct_lp(path, a=10.0, b=12.0, c=15.0, spgr=19, isa=20.0, compl=75.0, cchalf=98.0):
+    path.mkdir(parents=True, exist_ok=True)
+    fn = path / 'CORRECT.LP'
+    fn.write_text(CORRECT_LP.format(a=a, b=b, c=c, spgr=spgr, isa=isa, compl=compl, cchalf=cchalf))
+    return fn
+
+
+def test_xds_index(tmp_path):
+    write_correct_lp(tmp_path / 'exp1' / 'SMV', compl=75.0)
+    write_correct_lp(tmp_path / 'exp2' / 'SMV', a=10.1, compl=40.0)
+    fn3 = write_correct_lp(tmp_path / 'exp3' / 'SMV', a=20.0, b=20.0, c=5.0, spgr=75)
+    (tmp_path / 'exp4').mkdir()
+    (tmp_path / 'exp4' / 'CORRECT.LP').write_text('!!! ERROR !!! INSUFFICIENT PERCENTAGE OF INDEXED REFLECTIONS\n')
+
+    db = tmp_path / 'index.sqlite'
+
+    with XDSIndex(db) as index:
+        counts = index.ingest([tmp_path])
+        assert counts['added'] == 4
+        assert counts['failed'] == 1
+        assert len(index) == 3
+
+        row, = index.query(spgr=75)
+        assert row['a'] == 20.0
+        assert row['ISa'] == 20.0
+        assert row['dmin'] == 0.8
+
+        assert len(index.query(min_completeness=50.0)) == 2
+        assert len(index.query(fn='%exp2%')) == 1
+
+        clusters = index.cluster(threshold=0.05)
+        assert [len(rows) for rows in clusters] == [2, 1]
+
+    # files are only parsed again when modified, removed files are pruned
+    write_correct_lp(tmp_path / 'exp1' / 'SMV', compl=90.0)
+    fn1 = tmp_path / 'exp1' / 'SMV' / 'CORRECT.LP'
+    os.utime(fn1, (0, os.path.getmtime(fn1) + 10))
+    fn3.unlink()
+
+    with XDSIndex(db) as index:
+        counts = index.ingest([tmp_path])
+        assert counts == {'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 2, 'failed': 0}
+        assert len(index) == 2
+        assert index.query(fn='%exp1%')[0]['completeness'] == 90.0